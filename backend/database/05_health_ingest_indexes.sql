@@ -0,0 +1,8 @@
+-- Lookup index for per-user, per-metric time ranges.
+-- Serves the bulk COPY duplicate check (email, metric_name, timestamp) as well as
+-- the dashboard, report and emergency-check range scans.
+create index if not exists health_realtime_email_metric_ts_idx
+  on public.health_realtime(email, metric_name, "timestamp" desc);
+
+create index if not exists health_aggregated_email_metric_ts_idx
+  on public.health_aggregated(email, metric_name, "timestamp" desc);
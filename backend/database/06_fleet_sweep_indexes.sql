@@ -0,0 +1,9 @@
+-- Covering index for the fleet-wide emergency sweep.
+-- The sweep filters on metric_name and the last hour of "timestamp" across all users,
+-- which the (email, ...) indexes cannot serve; email and value are included so the
+-- grouped min/max query runs as an index-only scan.
+create index if not exists health_realtime_metric_ts_idx
+  on public.health_realtime(metric_name, "timestamp") include (email, value);
+
+create index if not exists health_aggregated_metric_ts_idx
+  on public.health_aggregated(metric_name, "timestamp") include (email, value);
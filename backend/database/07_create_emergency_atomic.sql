@@ -0,0 +1,98 @@
+-- Atomic emergency creation.
+-- Resolves the patient's care context (latest conversation, active doctor and the
+-- doctor's name), inserts the emergency and both emergency alerts in one transaction.
+-- emergencies_one_active_per_conversation makes a concurrent or repeated call a no-op
+-- that reports 'already_active' instead of raising.
+--
+-- Returns jsonb with a "status" of:
+--   'created'          -> also "emergency", "conversation_id", "doctor_id", "doctor_name"
+--   'no_conversation'  -> patient has no conversation
+--   'already_active'   -> an active emergency exists for the conversation
+--   'no_doctor'        -> patient has no active doctor link
+create or replace function public.create_emergency_atomic(p_patient_id uuid, p_patient_email text)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+  v_conversation_id bigint;
+  v_doctor_id uuid;
+  v_doctor_name text;
+  v_emergency public.emergencies;
+  v_now timestamptz := now();
+begin
+  select c.id into v_conversation_id
+    from public.conversations c
+   where c.patient_id = p_patient_id
+   order by c.created_at desc
+   limit 1;
+
+  if v_conversation_id is null then
+    return jsonb_build_object('status', 'no_conversation');
+  end if;
+
+  if exists (
+    select 1 from public.emergencies e
+     where e.conversation_id = v_conversation_id and e.status = 'active'
+  ) then
+    return jsonb_build_object('status', 'already_active', 'conversation_id', v_conversation_id);
+  end if;
+
+  select l.doctor_id, coalesce(p.full_name, 'Doctor')
+    into v_doctor_id, v_doctor_name
+    from public.patient_doctor_links l
+    left join public.profiles p on p.id = l.doctor_id
+   where l.patient_id = p_patient_id and l.status = 'active'
+   limit 1;
+
+  if v_doctor_id is null then
+    return jsonb_build_object('status', 'no_doctor', 'conversation_id', v_conversation_id);
+  end if;
+
+  insert into public.emergencies (patient_id, doctor_id, conversation_id, video_call_id, status, created_at)
+  values (p_patient_id, v_doctor_id, v_conversation_id, null, 'active', v_now)
+  on conflict (conversation_id) where status = 'active' do nothing
+  returning * into v_emergency;
+
+  if v_emergency.id is null then
+    return jsonb_build_object('status', 'already_active', 'conversation_id', v_conversation_id);
+  end if;
+
+  insert into public.alerts (
+    patient_id, patient_email, title, message, alert_type, severity, status, emergency_id, metadata, created_at
+  ) values
+  (
+    p_patient_id, p_patient_email,
+    '🚨 Emergency Alert',
+    'Medical emergency detected. Your doctor will contact you shortly.',
+    'health_metric', 'critical', 'open', v_emergency.id,
+    jsonb_build_object('conversation_id', v_conversation_id, 'type', 'emergency_alert'),
+    v_now
+  ),
+  (
+    v_doctor_id, p_patient_email,
+    '🚨 Emergency Alert - Patient Crisis',
+    format('Patient %s vitals triggered an emergency. Please call them immediately.', p_patient_email),
+    'health_metric', 'critical', 'open', v_emergency.id,
+    jsonb_build_object(
+      'patient_id', p_patient_id,
+      'patient_email', p_patient_email,
+      'conversation_id', v_conversation_id,
+      'type', 'emergency_doctor_alert'
+    ),
+    v_now
+  );
+
+  return jsonb_build_object(
+    'status', 'created',
+    'emergency', to_jsonb(v_emergency),
+    'conversation_id', v_conversation_id,
+    'doctor_id', v_doctor_id,
+    'doctor_name', v_doctor_name
+  );
+end;
+$$;
+
+revoke all on function public.create_emergency_atomic(uuid, text) from public, anon, authenticated;
+grant execute on function public.create_emergency_atomic(uuid, text) to service_role;
@@ -0,0 +1,43 @@
+-- Care-context change notifications.
+-- The API caches each patient's conversation/doctor and each doctor's patient list
+-- (services/care_context.py); these triggers tell it which entries to drop.
+create or replace function public.notify_care_context_changed()
+returns trigger as $$
+declare
+  v_row record;
+begin
+  if tg_op = 'DELETE' then
+    v_row := old;
+  else
+    v_row := new;
+  end if;
+
+  perform pg_notify(
+    'care_context_changed',
+    json_build_object('table', tg_table_name, 'patient_id', v_row.patient_id, 'doctor_id', v_row.doctor_id)::text
+  );
+
+  -- A re-pointed row invalidates the previous patient/doctor as well
+  if tg_op = 'UPDATE' and (old.patient_id is distinct from new.patient_id or old.doctor_id is distinct from new.doctor_id) then
+    perform pg_notify(
+      'care_context_changed',
+      json_build_object('table', tg_table_name, 'patient_id', old.patient_id, 'doctor_id', old.doctor_id)::text
+    );
+  end if;
+
+  return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists patient_doctor_links_care_context_notify on public.patient_doctor_links;
+create trigger patient_doctor_links_care_context_notify
+after insert or update or delete on public.patient_doctor_links
+for each row
+execute function public.notify_care_context_changed();
+
+-- Only columns the cache reads; every chat message bumps last_message_at
+drop trigger if exists conversations_care_context_notify on public.conversations;
+create trigger conversations_care_context_notify
+after insert or delete or update of patient_id, doctor_id on public.conversations
+for each row
+execute function public.notify_care_context_changed();
@@ -0,0 +1,67 @@
+-- Coalesce emergency_check_queue jobs per email.
+-- The row-level triggers in 04_emergency_queue.sql queued one job per inserted sample,
+-- and their "on conflict do nothing" never fired because nothing was unique. This keeps
+-- at most one pending job per email and queues once per insert statement.
+
+-- Collapse the backlog first so the unique index can be built: keep the oldest pending
+-- job per email and close the rest.
+with ranked as (
+  select id, row_number() over (partition by email order by created_at, id) as rn
+    from public.emergency_check_queue
+   where status = 'pending'
+)
+update public.emergency_check_queue q
+   set status = 'completed',
+       processed_at = now(),
+       error_message = 'coalesced into an earlier pending job'
+  from ranked
+ where q.id = ranked.id and ranked.rn > 1;
+
+create unique index if not exists emergency_queue_one_pending_per_email
+  on public.emergency_check_queue(email)
+  where status = 'pending';
+
+create or replace function public.queue_emergency_check(p_email text, p_metric_source text)
+returns void as $$
+begin
+  insert into public.emergency_check_queue (email, metric_source)
+  values (p_email, p_metric_source)
+  on conflict (email) where status = 'pending' do nothing;
+end;
+$$ language plpgsql;
+
+-- Statement-level triggers: one queue insert per distinct email in the statement
+create or replace function public.trigger_emergency_check_realtime_batch()
+returns trigger as $$
+begin
+  insert into public.emergency_check_queue (email, metric_source)
+  select distinct email, 'realtime' from new_rows
+  on conflict (email) where status = 'pending' do nothing;
+  return null;
+end;
+$$ language plpgsql;
+
+create or replace function public.trigger_emergency_check_aggregated_batch()
+returns trigger as $$
+begin
+  insert into public.emergency_check_queue (email, metric_source)
+  select distinct email, 'aggregated' from new_rows
+  on conflict (email) where status = 'pending' do nothing;
+  return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists health_realtime_emergency_check on public.health_realtime;
+drop trigger if exists health_aggregated_emergency_check on public.health_aggregated;
+
+create trigger health_realtime_emergency_check
+after insert on public.health_realtime
+referencing new table as new_rows
+for each statement
+execute function public.trigger_emergency_check_realtime_batch();
+
+create trigger health_aggregated_emergency_check
+after insert on public.health_aggregated
+referencing new table as new_rows
+for each statement
+execute function public.trigger_emergency_check_aggregated_batch();
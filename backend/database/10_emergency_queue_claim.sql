@@ -0,0 +1,41 @@
+-- Atomic, lease-based claiming of emergency_check_queue jobs.
+-- Any number of workers (threads, processes, hosts) can call claim_emergency_checks
+-- concurrently: SKIP LOCKED hands each one a disjoint batch, and a job whose worker
+-- died is claimable again once its lease expires.
+alter table public.emergency_check_queue
+  add column if not exists claimed_by text null,
+  add column if not exists claimed_at timestamptz null,
+  add column if not exists lease_expires_at timestamptz null;
+
+create index if not exists emergency_queue_lease_idx
+  on public.emergency_check_queue(lease_expires_at)
+  where status = 'processing';
+
+create or replace function public.claim_emergency_checks(
+  p_worker text,
+  p_limit integer default 10,
+  p_lease_seconds integer default 60
+)
+returns setof public.emergency_check_queue
+language sql
+as $$
+  with candidates as (
+    select id
+      from public.emergency_check_queue
+     where status = 'pending'
+        or (status = 'processing' and lease_expires_at < now())
+     order by created_at
+     limit p_limit
+     for update skip locked
+  )
+  update public.emergency_check_queue q
+     set status = 'processing',
+         claimed_by = p_worker,
+         claimed_at = now(),
+         lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+    from candidates c
+   where q.id = c.id
+  returning q.*;
+$$;
+
+grant execute on function public.claim_emergency_checks(text, integer, integer) to service_role;
@@ -0,0 +1,45 @@
+-- Wake queue workers as soon as a job is queued.
+-- Workers LISTEN on emergency_check_queued (services/queue_wakeup.py); polling remains
+-- only as a slow safety net. Notifications are delivered on commit and identical
+-- payloads within a transaction are folded into one by Postgres. Only inserts that
+-- queued a job notify, since NOTIFY takes a global lock at commit.
+create or replace function public.queue_emergency_check(p_email text, p_metric_source text)
+returns void as $$
+begin
+  insert into public.emergency_check_queue (email, metric_source)
+  values (p_email, p_metric_source)
+  on conflict (email) where status = 'pending' do nothing;
+  -- Coalesced into an existing pending job: nothing new to wake for
+  if found then
+    perform pg_notify('emergency_check_queued', p_email);
+  end if;
+end;
+$$ language plpgsql;
+
+create or replace function public.trigger_emergency_check_realtime_batch()
+returns trigger as $$
+begin
+  insert into public.emergency_check_queue (email, metric_source)
+  select distinct email, 'realtime' from new_rows
+  on conflict (email) where status = 'pending' do nothing;
+  -- Coalesced into an existing pending job: nothing new to wake for
+  if found then
+    perform pg_notify('emergency_check_queued', '');
+  end if;
+  return null;
+end;
+$$ language plpgsql;
+
+create or replace function public.trigger_emergency_check_aggregated_batch()
+returns trigger as $$
+begin
+  insert into public.emergency_check_queue (email, metric_source)
+  select distinct email, 'aggregated' from new_rows
+  on conflict (email) where status = 'pending' do nothing;
+  -- Coalesced into an existing pending job: nothing new to wake for
+  if found then
+    perform pg_notify('emergency_check_queued', '');
+  end if;
+  return null;
+end;
+$$ language plpgsql;
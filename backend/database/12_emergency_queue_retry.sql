@@ -0,0 +1,213 @@
+-- Retries with backoff and a dead-letter state for emergency_check_queue.
+-- attempts counts claims; a failed job goes back to pending with next_attempt_at in the
+-- future until it has used p_max_attempts, then it is parked as 'dead' for replay.
+alter table public.emergency_check_queue
+  add column if not exists attempts integer not null default 0,
+  add column if not exists next_attempt_at timestamptz null;
+
+alter table public.emergency_check_queue
+  drop constraint if exists emergency_check_queue_status_check;
+alter table public.emergency_check_queue
+  add constraint emergency_check_queue_status_check
+  check (status in ('pending', 'processing', 'completed', 'failed', 'dead'));
+
+create index if not exists emergency_queue_dead_idx
+  on public.emergency_check_queue(created_at desc)
+  where status = 'dead';
+
+-- Fresh jobs are claimed before retries, and retries only once they are due
+create or replace function public.claim_emergency_checks(
+  p_worker text,
+  p_limit integer default 10,
+  p_lease_seconds integer default 60
+)
+returns setof public.emergency_check_queue
+language sql
+as $$
+  with candidates as (
+    select id
+      from public.emergency_check_queue
+     where (status = 'pending' and (next_attempt_at is null or next_attempt_at <= now()))
+        or (status = 'processing' and lease_expires_at < now())
+     order by (attempts > 0), created_at
+     limit p_limit
+     for update skip locked
+  )
+  update public.emergency_check_queue q
+     set status = 'processing',
+         attempts = q.attempts + 1,
+         claimed_by = p_worker,
+         claimed_at = now(),
+         lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+    from candidates c
+   where q.id = c.id
+  returning q.*;
+$$;
+
+-- Settle a failed evaluation covering p_ids (all jobs for one email).
+-- The job with the most attempts carries the retry; the others are folded into it.
+-- Returns the new status: 'pending' (retry scheduled), 'dead', 'completed' (a newer
+-- pending job already covers the email) or 'not_owned' (lease lost to another worker).
+create or replace function public.retry_emergency_checks(
+  p_ids bigint[],
+  p_worker text,
+  p_error text,
+  p_delay_seconds double precision,
+  p_max_attempts integer
+)
+returns text
+language plpgsql
+as $$
+declare
+  v_keep bigint;
+  v_attempts integer;
+  v_email text;
+  v_status text;
+begin
+  select q.id, q.attempts, q.email
+    into v_keep, v_attempts, v_email
+    from public.emergency_check_queue q
+   where q.id = any(p_ids) and q.claimed_by = p_worker and q.status = 'processing'
+   order by q.attempts desc, q.id
+   limit 1;
+
+  if v_keep is null then
+    return 'not_owned';
+  end if;
+
+  -- Same per-email lock as the queueing paths, so the pending check below cannot race
+  -- a concurrent insert into a second pending job
+  perform pg_advisory_xact_lock(hashtext('emergency_check_queue:' || v_email));
+
+  update public.emergency_check_queue
+     set status = 'completed',
+         processed_at = now(),
+         lease_expires_at = null,
+         error_message = format('coalesced into job %s', v_keep)
+   where id = any(p_ids) and id <> v_keep and claimed_by = p_worker and status = 'processing';
+
+  if v_attempts >= p_max_attempts then
+    v_status := 'dead';
+  elsif exists (
+    select 1 from public.emergency_check_queue
+     where email = v_email and status = 'pending'
+  ) then
+    v_status := 'completed';
+  else
+    v_status := 'pending';
+  end if;
+
+  update public.emergency_check_queue
+     set status = v_status,
+         error_message = case when v_status = 'completed'
+                              then format('superseded by a newer pending job after: %s', p_error)
+                              else p_error end,
+         processed_at = case when v_status = 'pending' then null else now() end,
+         next_attempt_at = case when v_status = 'pending'
+                                then now() + make_interval(secs => p_delay_seconds)
+                                else null end,
+         claimed_by = case when v_status = 'pending' then null else claimed_by end,
+         lease_expires_at = null
+   where id = v_keep;
+
+  return v_status;
+end;
+$$;
+
+-- Put dead jobs back in the queue (all of them when p_ids is null), one per email.
+-- Returns the number of jobs made pending again.
+create or replace function public.replay_emergency_checks(p_ids bigint[] default null)
+returns integer
+language plpgsql
+as $$
+declare
+  v_revived integer;
+begin
+  perform pg_advisory_xact_lock(hashtext('emergency_check_queue:' || d.email))
+     from (select distinct email from public.emergency_check_queue
+            where status = 'dead' and (p_ids is null or id = any(p_ids))
+            order by email) d;
+
+  with targets as (
+    select distinct on (q.email) q.id
+      from public.emergency_check_queue q
+     where q.status = 'dead'
+       and (p_ids is null or q.id = any(p_ids))
+       and not exists (
+             select 1 from public.emergency_check_queue p
+              where p.email = q.email and p.status = 'pending')
+     order by q.email, q.created_at desc
+  )
+  update public.emergency_check_queue q
+     set status = 'pending',
+         attempts = 0,
+         next_attempt_at = null,
+         claimed_by = null,
+         lease_expires_at = null,
+         processed_at = null,
+         error_message = null
+    from targets t
+   where q.id = t.id;
+  get diagnostics v_revived = row_count;
+
+  -- Every remaining selected dead job's email now has a pending job
+  update public.emergency_check_queue
+     set status = 'completed',
+         processed_at = now(),
+         error_message = 'superseded by a pending job on replay'
+   where status = 'dead'
+     and (p_ids is null or id = any(p_ids));
+
+  return v_revived;
+end;
+$$;
+
+grant execute on function public.retry_emergency_checks(bigint[], text, text, double precision, integer) to service_role;
+grant execute on function public.replay_emergency_checks(bigint[]) to service_role;
+
+-- A job waiting out its backoff is still the email's pending job, so new samples
+-- coalesce into it. Make it due again right away: retry scheduling must not hold up
+-- fresh work. Notify when a job was queued or made due.
+create or replace function public.queue_emergency_check(p_email text, p_metric_source text)
+returns void as $$
+begin
+  insert into public.emergency_check_queue as q (email, metric_source)
+  values (p_email, p_metric_source)
+  on conflict (email) where status = 'pending'
+  do update set next_attempt_at = null
+        where q.next_attempt_at is not null;
+  if found then
+    perform pg_notify('emergency_check_queued', p_email);
+  end if;
+end;
+$$ language plpgsql;
+
+create or replace function public.trigger_emergency_check_realtime_batch()
+returns trigger as $$
+begin
+  insert into public.emergency_check_queue as q (email, metric_source)
+  select distinct email, 'realtime' from new_rows
+  on conflict (email) where status = 'pending'
+  do update set next_attempt_at = null
+        where q.next_attempt_at is not null;
+  if found then
+    perform pg_notify('emergency_check_queued', '');
+  end if;
+  return null;
+end;
+$$ language plpgsql;
+
+create or replace function public.trigger_emergency_check_aggregated_batch()
+returns trigger as $$
+begin
+  insert into public.emergency_check_queue as q (email, metric_source)
+  select distinct email, 'aggregated' from new_rows
+  on conflict (email) where status = 'pending'
+  do update set next_attempt_at = null
+        where q.next_attempt_at is not null;
+  if found then
+    perform pg_notify('emergency_check_queued', '');
+  end if;
+  return null;
+end;
+$$ language plpgsql;
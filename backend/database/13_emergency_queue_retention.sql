@@ -0,0 +1,370 @@
+-- Retention, rollup and daily partitioning for emergency_check_queue.
+-- The table is range-partitioned on created_at by UTC day so settled history can be
+-- dropped a partition at a time. maintain_emergency_queue (run daily by the backend)
+-- rolls settled jobs older than the retention window into emergency_check_queue_daily,
+-- drops old partitions that hold nothing else, deletes the stragglers, and pre-creates
+-- upcoming partitions. Pending and dead jobs are never purged.
+--
+-- Postgres cannot enforce a unique index on a partitioned table unless it includes the
+-- partition key, so the one-pending-job-per-email rule from 09_emergency_queue_coalesce.sql
+-- is now a per-email advisory lock plus a not-exists guard.
+
+-- Per-day totals of settled jobs, kept after their rows are purged
+create table if not exists public.emergency_check_queue_daily (
+  day date not null,
+  metric_source text not null,
+  status text not null,
+  jobs bigint not null default 0,
+  total_attempts bigint not null default 0,
+  total_latency_seconds double precision not null default 0,
+  max_latency_seconds double precision null,
+  primary key (day, metric_source, status)
+);
+
+grant select, insert, update, delete on public.emergency_check_queue_daily to service_role;
+
+-- Add settled (completed/failed) jobs of p_relation created before p_before to the daily
+-- rollup; with p_delete they are deleted in the same statement. Returns the job count.
+create or replace function public.rollup_emergency_checks(
+  p_relation regclass,
+  p_before timestamptz,
+  p_delete boolean default false
+)
+returns bigint
+language plpgsql
+as $$
+declare
+  v_source text;
+  v_jobs bigint;
+begin
+  v_source := format(
+    case when p_delete
+         then 'delete from %s where status in (''completed'', ''failed'') and created_at < $1 returning *'
+         else 'select * from %s where status in (''completed'', ''failed'') and created_at < $1'
+    end,
+    p_relation
+  );
+
+  execute format($q$
+    with settled as (%s),
+    totals as (
+      select (created_at at time zone 'utc')::date as day,
+             metric_source,
+             status,
+             count(*) as jobs,
+             coalesce(sum(attempts), 0) as total_attempts,
+             coalesce(sum(extract(epoch from processed_at - created_at)), 0) as total_latency_seconds,
+             max(extract(epoch from processed_at - created_at)) as max_latency_seconds
+        from settled
+       group by 1, 2, 3
+    ),
+    merged as (
+      insert into public.emergency_check_queue_daily as d
+             (day, metric_source, status, jobs, total_attempts, total_latency_seconds, max_latency_seconds)
+      select day, metric_source, status, jobs, total_attempts, total_latency_seconds, max_latency_seconds
+        from totals
+      on conflict (day, metric_source, status) do update
+         set jobs = d.jobs + excluded.jobs,
+             total_attempts = d.total_attempts + excluded.total_attempts,
+             total_latency_seconds = d.total_latency_seconds + excluded.total_latency_seconds,
+             max_latency_seconds = greatest(d.max_latency_seconds, excluded.max_latency_seconds)
+    )
+    select coalesce(sum(jobs), 0)::bigint from totals
+  $q$, v_source)
+  into v_jobs
+  using p_before;
+
+  return v_jobs;
+end;
+$$;
+
+-- Create the daily partitions from p_from (default today, UTC) through p_days_ahead days
+-- ahead. A day whose rows already landed in the default partition is skipped; those
+-- rows are purged from there instead. Returns the number of partitions created.
+create or replace function public.ensure_emergency_queue_partitions(
+  p_days_ahead integer default 3,
+  p_from date default null
+)
+returns integer
+language plpgsql
+as $$
+declare
+  v_day date;
+  v_name text;
+  v_created integer := 0;
+  v_start timestamptz;
+begin
+  for v_day in
+    select generate_series(
+             coalesce(p_from, (now() at time zone 'utc')::date),
+             (now() at time zone 'utc')::date + p_days_ahead,
+             interval '1 day'
+           )::date
+  loop
+    v_name := 'emergency_check_queue_p' || to_char(v_day, 'YYYYMMDD');
+    continue when to_regclass('public.' || v_name) is not null;
+
+    v_start := v_day::timestamp at time zone 'utc';
+    if to_regclass('public.emergency_check_queue_default') is not null
+       and exists (select 1 from public.emergency_check_queue_default
+                    where created_at >= v_start and created_at < v_start + interval '1 day') then
+      raise notice 'emergency_check_queue: % has rows in the default partition, not creating %', v_day, v_name;
+      continue;
+    end if;
+
+    execute format(
+      'create table public.%I partition of public.emergency_check_queue for values from (%L) to (%L)',
+      v_name, v_start, v_start + interval '1 day'
+    );
+    v_created := v_created + 1;
+  end loop;
+
+  return v_created;
+end;
+$$;
+
+-- Convert the existing table. Settled jobs older than the default 7-day retention are
+-- rolled up and left behind; older live jobs go to the default partition.
+do $$
+declare
+  v_cutoff timestamptz := date_trunc('day', now() at time zone 'utc') at time zone 'utc' - interval '7 days';
+  v_max_id bigint;
+begin
+  if exists (select 1 from pg_partitioned_table
+              where partrelid = 'public.emergency_check_queue'::regclass) then
+    return;
+  end if;
+
+  lock table public.emergency_check_queue in access exclusive mode;
+  alter table public.emergency_check_queue rename to emergency_check_queue_legacy;
+  alter table public.emergency_check_queue_legacy
+    rename constraint emergency_check_queue_pkey to emergency_check_queue_legacy_pkey;
+
+  create table public.emergency_check_queue (
+    id bigint generated by default as identity,
+    email text not null,
+    metric_source text not null check (metric_source in ('realtime', 'aggregated')),
+    status text not null default 'pending',
+    error_message text null,
+    created_at timestamptz not null default now(),
+    processed_at timestamptz null,
+    claimed_by text null,
+    claimed_at timestamptz null,
+    lease_expires_at timestamptz null,
+    attempts integer not null default 0,
+    next_attempt_at timestamptz null,
+    constraint emergency_check_queue_status_check
+      check (status in ('pending', 'processing', 'completed', 'failed', 'dead')),
+    primary key (id, created_at)
+  ) partition by range (created_at);
+
+  create table public.emergency_check_queue_default
+    partition of public.emergency_check_queue default;
+  perform public.ensure_emergency_queue_partitions(3, v_cutoff::date);
+
+  perform public.rollup_emergency_checks('public.emergency_check_queue_legacy'::regclass, v_cutoff);
+
+  insert into public.emergency_check_queue
+         (id, email, metric_source, status, error_message, created_at, processed_at,
+          claimed_by, claimed_at, lease_expires_at, attempts, next_attempt_at)
+  overriding system value
+  select id, email, metric_source, status, error_message, created_at, processed_at,
+         claimed_by, claimed_at, lease_expires_at, attempts, next_attempt_at
+    from public.emergency_check_queue_legacy
+   where not (status in ('completed', 'failed') and created_at < v_cutoff);
+
+  select max(id) into v_max_id from public.emergency_check_queue_legacy;
+  perform setval(pg_get_serial_sequence('public.emergency_check_queue', 'id'), coalesce(v_max_id, 0) + 1, false);
+
+  -- Its return type is the legacy table's row type; recreated below
+  drop function if exists public.claim_emergency_checks(text, integer, integer);
+  drop table public.emergency_check_queue_legacy;
+end;
+$$;
+
+grant select, insert, update, delete on public.emergency_check_queue to service_role;
+
+-- Serves claims and the legacy pending lookup without touching settled rows
+create index if not exists emergency_queue_pending_idx
+  on public.emergency_check_queue(created_at)
+  where status = 'pending';
+create index if not exists emergency_queue_pending_email_idx
+  on public.emergency_check_queue(email)
+  where status = 'pending';
+create index if not exists emergency_queue_email_idx
+  on public.emergency_check_queue(email);
+create index if not exists emergency_queue_lease_idx
+  on public.emergency_check_queue(lease_expires_at)
+  where status = 'processing';
+create index if not exists emergency_queue_dead_idx
+  on public.emergency_check_queue(created_at desc)
+  where status = 'dead';
+
+create or replace function public.claim_emergency_checks(
+  p_worker text,
+  p_limit integer default 10,
+  p_lease_seconds integer default 60
+)
+returns setof public.emergency_check_queue
+language sql
+as $$
+  with candidates as (
+    select id
+      from public.emergency_check_queue
+     where (status = 'pending' and (next_attempt_at is null or next_attempt_at <= now()))
+        or (status = 'processing' and lease_expires_at < now())
+     order by (attempts > 0), created_at
+     limit p_limit
+     for update skip locked
+  )
+  update public.emergency_check_queue q
+     set status = 'processing',
+         attempts = q.attempts + 1,
+         claimed_by = p_worker,
+         claimed_at = now(),
+         lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+    from candidates c
+   where q.id = c.id
+  returning q.*;
+$$;
+
+grant execute on function public.claim_emergency_checks(text, integer, integer) to service_role;
+
+-- Coalescing: the advisory lock serialises inserts for one email so the guard holds.
+-- A pending job waiting out a retry backoff is made due again instead of blocking new
+-- work. Notify only when a job was queued or made due.
+create or replace function public.queue_emergency_check(p_email text, p_metric_source text)
+returns void as $$
+declare
+  v_changed integer;
+  v_inserted integer;
+begin
+  perform pg_advisory_xact_lock(hashtext('emergency_check_queue:' || p_email));
+  update public.emergency_check_queue
+     set next_attempt_at = null
+   where email = p_email and status = 'pending' and next_attempt_at is not null;
+  get diagnostics v_changed = row_count;
+  insert into public.emergency_check_queue (email, metric_source)
+  select p_email, p_metric_source
+   where not exists (select 1 from public.emergency_check_queue
+                      where email = p_email and status = 'pending');
+  get diagnostics v_inserted = row_count;
+  if v_changed + v_inserted > 0 then
+    perform pg_notify('emergency_check_queued', p_email);
+  end if;
+end;
+$$ language plpgsql;
+
+create or replace function public.trigger_emergency_check_realtime_batch()
+returns trigger as $$
+declare
+  v_changed integer;
+  v_inserted integer;
+begin
+  perform pg_advisory_xact_lock(hashtext('emergency_check_queue:' || e.email))
+     from (select distinct email from new_rows order by email) e;
+  update public.emergency_check_queue q
+     set next_attempt_at = null
+   where q.email in (select email from new_rows)
+     and q.status = 'pending' and q.next_attempt_at is not null;
+  get diagnostics v_changed = row_count;
+  insert into public.emergency_check_queue (email, metric_source)
+  select distinct n.email, 'realtime'
+    from new_rows n
+   where not exists (select 1 from public.emergency_check_queue q
+                      where q.email = n.email and q.status = 'pending');
+  get diagnostics v_inserted = row_count;
+  if v_changed + v_inserted > 0 then
+    perform pg_notify('emergency_check_queued', '');
+  end if;
+  return null;
+end;
+$$ language plpgsql;
+
+create or replace function public.trigger_emergency_check_aggregated_batch()
+returns trigger as $$
+declare
+  v_changed integer;
+  v_inserted integer;
+begin
+  perform pg_advisory_xact_lock(hashtext('emergency_check_queue:' || e.email))
+     from (select distinct email from new_rows order by email) e;
+  update public.emergency_check_queue q
+     set next_attempt_at = null
+   where q.email in (select email from new_rows)
+     and q.status = 'pending' and q.next_attempt_at is not null;
+  get diagnostics v_changed = row_count;
+  insert into public.emergency_check_queue (email, metric_source)
+  select distinct n.email, 'aggregated'
+    from new_rows n
+   where not exists (select 1 from public.emergency_check_queue q
+                      where q.email = n.email and q.status = 'pending');
+  get diagnostics v_inserted = row_count;
+  if v_changed + v_inserted > 0 then
+    perform pg_notify('emergency_check_queued', '');
+  end if;
+  return null;
+end;
+$$ language plpgsql;
+
+-- Daily retention pass; returns what it did as jsonb
+create or replace function public.maintain_emergency_queue(
+  p_retention_days integer default 7,
+  p_days_ahead integer default 3
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+  v_cutoff timestamptz := date_trunc('day', now() at time zone 'utc') at time zone 'utc'
+                          - make_interval(days => p_retention_days);
+  v_partition text;
+  v_live boolean;
+  v_rolled_up bigint := 0;
+  v_purged bigint := 0;
+  v_dropped integer := 0;
+  v_created integer;
+begin
+  -- Every backend schedules this at startup; let one pass run at a time
+  if not pg_try_advisory_xact_lock(hashtext('maintain_emergency_queue')) then
+    return jsonb_build_object('skipped', 'another retention pass is running');
+  end if;
+
+  for v_partition in
+    select c.relname
+      from pg_inherits i
+      join pg_class c on c.oid = i.inhrelid
+     where i.inhparent = 'public.emergency_check_queue'::regclass
+       and c.relname ~ '^emergency_check_queue_p[0-9]{8}$'
+       and to_date(right(c.relname, 8), 'YYYYMMDD') + 1 <= (v_cutoff at time zone 'utc')::date
+     order by c.relname
+  loop
+    execute format('lock table public.%I in access exclusive mode', v_partition);
+    execute format(
+      'select exists (select 1 from public.%I where status not in (''completed'', ''failed''))',
+      v_partition
+    ) into v_live;
+    -- Partitions still holding pending or dead jobs are purged row by row below
+    continue when v_live;
+
+    v_rolled_up := v_rolled_up + public.rollup_emergency_checks(('public.' || quote_ident(v_partition))::regclass, v_cutoff);
+    execute format('drop table public.%I', v_partition);
+    v_dropped := v_dropped + 1;
+  end loop;
+
+  v_purged := public.rollup_emergency_checks('public.emergency_check_queue'::regclass, v_cutoff, true);
+  v_created := public.ensure_emergency_queue_partitions(p_days_ahead);
+
+  return jsonb_build_object(
+    'cutoff', v_cutoff,
+    'rolled_up', v_rolled_up + v_purged,
+    'dropped_partitions', v_dropped,
+    'purged_rows', v_purged,
+    'created_partitions', v_created
+  );
+end;
+$$;
+
+grant execute on function public.rollup_emergency_checks(regclass, timestamptz, boolean) to service_role;
+grant execute on function public.ensure_emergency_queue_partitions(integer, date) to service_role;
+grant execute on function public.maintain_emergency_queue(integer, integer) to service_role;
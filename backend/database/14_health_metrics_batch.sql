@@ -0,0 +1,132 @@
+-- Batch variant of get_health_metrics (database/schema.md) for the alert pipeline.
+-- Returns the same last-hour and today summary per metric, for many emails in one call,
+-- so the backend transfers one row per (email, metric) instead of every sample of the
+-- day. Only the summarised metrics (under all their source names) are read, which lets
+-- the (email, metric_name, "timestamp") indexes from 05_health_ingest_indexes.sql
+-- serve both scans. Aggregated metric names are normalised the same way as realtime
+-- ones, and "today" is the UTC day.
+create or replace function public.get_health_metrics_batch(p_emails text[])
+returns table (
+  email text,
+  metric_name text,
+  last_hour_current numeric,
+  last_hour_current_ts timestamptz,
+  last_hour_avg numeric,
+  last_hour_low numeric,
+  last_hour_high numeric,
+  today_avg numeric,
+  today_low numeric,
+  today_high numeric
+) as $$
+with params as (
+  select
+    now() - interval '1 hour' as hour_start,
+    now() as hour_end,
+    date_trunc('day', now() at time zone 'utc') at time zone 'utc' as day_start,
+    array[
+      'heartRate', 'heart_rate', 'respiratoryRate', 'respiratory_rate',
+      'activeEnergy', 'active_energy', 'activeEnergyBurned',
+      'oxygenSaturation', 'blood_oxygen_saturation',
+      'apple_sleeping_wrist_temperature', 'heart_rate_variability', 'resting_heart_rate'
+    ] as source_names
+),
+
+samples as (
+  select hr.email, hr.metric_name, hr.value, hr."timestamp"
+  from public.health_realtime hr, params p
+  where hr.email = any(p_emails)
+    and hr.metric_name = any(p.source_names)
+    and hr."timestamp" >= p.day_start
+
+  union all
+
+  select ha.email, ha.metric_name, ha.value, ha."timestamp"
+  from public.health_aggregated ha, params p
+  where ha.email = any(p_emails)
+    and ha.metric_name = any(p.source_names)
+    and ha."timestamp" >= p.day_start
+),
+
+all_metrics as (
+  select
+    s.email,
+    case
+      when s.metric_name in ('heartRate','heart_rate') then 'heart_rate'
+      when s.metric_name in ('respiratoryRate','respiratory_rate') then 'respiratory_rate'
+      when s.metric_name in ('activeEnergy','active_energy','activeEnergyBurned') then 'active_energy'
+      when s.metric_name in ('oxygenSaturation','blood_oxygen_saturation') then 'blood_oxygen_saturation'
+      else s.metric_name
+    end as metric_name,
+    s.value,
+    s."timestamp"
+  from samples s
+),
+
+today_stats as (
+  select email, metric_name, avg(value) today_avg, min(value) today_low, max(value) today_high
+  from all_metrics
+  group by email, metric_name
+),
+
+last_hour_base as (
+  select a.*
+  from all_metrics a, params p
+  where a."timestamp" >= p.hour_start
+    and a."timestamp" <= p.hour_end
+),
+
+last_hour_stats as (
+  select email, metric_name, avg(value) last_hour_avg, min(value) last_hour_low, max(value) last_hour_high
+  from last_hour_base
+  group by email, metric_name
+),
+
+last_hour_latest as (
+  select distinct on (email, metric_name)
+    email,
+    metric_name,
+    value as last_hour_current,
+    "timestamp" as last_hour_current_ts
+  from last_hour_base
+  order by email, metric_name, "timestamp" desc
+)
+
+select
+  t.email,
+  t.metric_name,
+  l.last_hour_current,
+  l.last_hour_current_ts,
+  hs.last_hour_avg,
+  hs.last_hour_low,
+  hs.last_hour_high,
+  t.today_avg,
+  t.today_low,
+  t.today_high
+from today_stats t
+left join last_hour_stats hs using (email, metric_name)
+left join last_hour_latest l using (email, metric_name)
+order by t.email, t.metric_name;
+$$ language sql stable;
+
+grant execute on function public.get_health_metrics_batch(text[]) to service_role;
+
+-- Keep the single-email function in step with the batch one
+create or replace function public.get_health_metrics(p_email text)
+returns table (
+  metric_name text,
+  last_hour_current numeric,
+  last_hour_current_ts timestamptz,
+  last_hour_avg numeric,
+  last_hour_low numeric,
+  last_hour_high numeric,
+  today_avg numeric,
+  today_low numeric,
+  today_high numeric
+) as $$
+  select b.metric_name, b.last_hour_current, b.last_hour_current_ts,
+         b.last_hour_avg, b.last_hour_low, b.last_hour_high,
+         b.today_avg, b.today_low, b.today_high
+    from public.get_health_metrics_batch(array[p_email]) b;
+$$ language sql stable;
+
+grant execute on function public.get_health_metrics(text) to service_role;
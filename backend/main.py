@@ -1,20 +1,37 @@
 import os
 import asyncio
 from datetime import datetime, timedelta, timezone
-from fastapi import FastAPI, Depends, Request
+from typing import List, Optional
+from fastapi import FastAPI, Depends, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from utils.supabase_client import supabase
-from routes.auth import get_current_user
+from utils.db import db_execute, shutdown_executor
+from utils.postgres import init_pool, close_pool
+from utils.http_clients import http_clients
+from utils.loop_monitor import loop_monitor
+from utils.pg_listener import pg_listener
+from utils.tracing import tracer
+from routes.auth import get_current_user, verify_token, require_admin
 from services.health import (
     insert_realtime_data, 
     insert_aggregated_data, 
     fetch_metric,
     upsert_sleep_data
 )
-from services.alerts import run_hourly_alert_check, get_all_user_emails
-from services.emergency import check_vitals_and_trigger_emergency
-from services.queue import process_emergency_check_queue
+from services.alerts import run_hourly_alert_check, get_all_user_emails, alert_prescreen
+from services.emergency import check_vitals_and_trigger_emergency, vitals_window
+from services.emergency_scheduler import emergency_scheduler
+from services.fanout import run_fanout, fanout_stats
+from services.fleet_sweep import run_fleet_emergency_sweep, EMERGENCY_SWEEP_MODE
+from services.identity import identity_directory
+from services.care_context import care_context
+from services.queue import process_emergency_check_queue, list_dead_letters, replay_dead_letters, run_queue_retention
+from services.queue_wakeup import queue_wakeup, QUEUE_POLL_SECONDS
+from services.llm_gateway import llm_gateway
+from services.analysis_cache import analysis_cache
+from services.ingest_stream import stream_health_metrics, INGEST_CHUNK_SIZE
+from services.bulk_ingest import get_ingest_stats
 from routes.dashboard import router as dashboard_router
 from routes.video_calls import router as video_calls_router
 from routes.reports import router as reports_router
@@ -32,24 +49,40 @@ app.add_middleware(
 
 scheduler = AsyncIOScheduler()
 
+# Requests that open a trace for the vitals-to-emergency pipeline
+TRACED_INGEST_PATHS = {"/api/data": "ingest", "/api/health/ingest": "ingest"}
+
+@app.middleware("http")
+async def trace_ingest(request: Request, call_next):
+    stage = TRACED_INGEST_PATHS.get(request.url.path)
+    if stage is None or request.method != "POST":
+        return await call_next(request)
+    with tracer.span(stage, path=request.url.path, content_length=request.headers.get("content-length")) as span:
+        response = await call_next(request)
+        span.set(status_code=response.status_code)
+        return response
+
+# Realtime vs Aggregated mapping (simplified logic from previous server)
+REALTIME_METRIC_NAMES = ["heart_rate", "step_count", "active_energy", "respiratory_rate"]
+
+# Parse /api/data bodies incrementally instead of loading them whole; "?stream=" overrides per request
+STREAMING_INGEST = os.getenv("STREAMING_INGEST", "false").lower() in ("1", "true", "yes")
+
 async def run_hourly_emergency_check() -> None:
     print(f"\n{'='*50}")
     print(f"Running hourly emergency check at {datetime.now(timezone.utc)}")
     print(f"{'='*50}")
     
     try:
+        if EMERGENCY_SWEEP_MODE == "batch":
+            await run_fleet_emergency_sweep()
+            print(f"Hourly emergency check completed at {datetime.now(timezone.utc)}")
+            return
+        
         emails = await get_all_user_emails()
         print(f"Found {len(emails)} users to check for emergencies")
         
-        for email in emails:
-            try:
-                result = await check_vitals_and_trigger_emergency(email)
-                if result:
-                    print(f"✓ Emergency triggered for {email}")
-                else:
-                    print(f"✓ No emergency needed for {email}")
-            except Exception as e:
-                print(f"Error checking emergency for {email}: {e}")
+        await run_fanout("hourly_emergency_check", emails, check_vitals_and_trigger_emergency)
         
         print(f"Hourly emergency check completed at {datetime.now(timezone.utc)}")
     except Exception as e:
@@ -72,9 +105,12 @@ def start_scheduler():
     try:
         scheduler.add_job(run_hourly_alert_check, "interval", hours=1, id="hourly_alert_check", misfire_grace_time=60)
         scheduler.add_job(run_hourly_emergency_check, "interval", hours=1, id="hourly_emergency_check", misfire_grace_time=60)
-        scheduler.add_job(process_emergency_check_queue, "interval", seconds=30, id="emergency_queue_processor", misfire_grace_time=10)
+        # Safety net only; queue_wakeup runs the processor as soon as a job is queued
+        scheduler.add_job(process_emergency_check_queue, "interval", seconds=QUEUE_POLL_SECONDS, id="emergency_queue_processor", misfire_grace_time=10)
+        # First run at startup so upcoming queue partitions exist before any insert needs them
+        scheduler.add_job(run_queue_retention, "interval", days=1, id="emergency_queue_retention", misfire_grace_time=3600, next_run_time=datetime.now(timezone.utc))
         scheduler.start()
-        print("✓ Schedulers started - emergency queue will process every 30 seconds")
+        print(f"✓ Schedulers started - emergency queue wakes on push, safety poll every {QUEUE_POLL_SECONDS} seconds")
         asyncio.ensure_future(run_startup_checks())
     except Exception as e:
         print(f"Error starting scheduler: {e}")
@@ -86,8 +122,21 @@ def stop_scheduler():
         scheduler.shutdown()
         print("✓ Schedulers shut down")
 
+app.add_event_handler("startup", loop_monitor.start)
+app.add_event_handler("startup", http_clients.start)
+app.add_event_handler("startup", init_pool)
+app.add_event_handler("startup", identity_directory.preload)
+app.add_event_handler("startup", queue_wakeup.start)
+app.add_event_handler("startup", pg_listener.start)
 app.add_event_handler("startup", start_scheduler)
 app.add_event_handler("shutdown", stop_scheduler)
+app.add_event_handler("shutdown", emergency_scheduler.flush)
+app.add_event_handler("shutdown", pg_listener.stop)
+app.add_event_handler("shutdown", queue_wakeup.stop)
+app.add_event_handler("shutdown", close_pool)
+app.add_event_handler("shutdown", http_clients.close)
+app.add_event_handler("shutdown", shutdown_executor)
+app.add_event_handler("shutdown", loop_monitor.stop)
 
 app.include_router(dashboard_router)
 app.include_router(video_calls_router)
@@ -101,6 +150,70 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/admin/traces", dependencies=[Depends(require_admin)])
+async def traces(limit: int = 50, name: str = None):
+    return tracer.export(limit=limit, name=name)
+
+@app.get("/admin/loop-lag")
+async def loop_lag():
+    return loop_monitor.snapshot()
+
+@app.get("/admin/http-stats")
+async def http_stats():
+    return http_clients.stats()
+
+@app.get("/admin/identity-stats")
+async def identity_stats():
+    return identity_directory.stats
+
+@app.get("/admin/fanout-runs")
+async def fanout_runs():
+    return fanout_stats()
+
+@app.get("/admin/vitals-window")
+async def vitals_window_stats():
+    return vitals_window.snapshot()
+
+@app.get("/admin/care-context")
+async def care_context_stats():
+    return care_context.snapshot()
+
+@app.get("/admin/queue-wakeup")
+async def queue_wakeup_stats():
+    return {"backend": queue_wakeup.backend, **queue_wakeup.stats}
+
+@app.get("/admin/queue/dead-letters", dependencies=[Depends(require_admin)])
+async def dead_letters(limit: int = 50):
+    jobs = await list_dead_letters(limit)
+    return {"count": len(jobs), "jobs": jobs}
+
+@app.post("/admin/queue/dead-letters/replay", dependencies=[Depends(require_admin)])
+async def replay_dead_letter_jobs(ids: Optional[List[int]] = Query(None)):
+    revived = await replay_dead_letters(ids)
+    if revived:
+        queue_wakeup.notify()
+    return {"replayed": revived}
+
+@app.post("/admin/queue/retention", dependencies=[Depends(require_admin)])
+async def trigger_queue_retention():
+    return await run_queue_retention()
+
+@app.get("/admin/llm-stats")
+async def llm_stats():
+    return llm_gateway.snapshot()
+
+@app.get("/admin/analysis-cache")
+async def analysis_cache_stats():
+    return analysis_cache.snapshot()
+
+@app.get("/admin/alert-prescreen", dependencies=[Depends(require_admin)])
+async def alert_prescreen_stats(limit: int = 50, escalated: Optional[bool] = None):
+    return alert_prescreen.snapshot(limit=limit, escalated=escalated)
+
+@app.get("/admin/ingest-stats")
+async def ingest_stats():
+    return get_ingest_stats()
+
 @app.post("/admin/run-alert-check")
 async def trigger_alert_check():
     await run_hourly_alert_check()
@@ -126,7 +239,7 @@ async def check_emergency_for_user(email: str):
 async def get_active_emergency(user=Depends(get_current_user)):
     try:
         patient_id = user.id
-        response = supabase.table("emergencies").select("*").eq("patient_id", patient_id).eq("status", "active").execute()
+        response = await db_execute(supabase.table("emergencies").select("*").eq("patient_id", patient_id).eq("status", "active"))
         
         if response.data and len(response.data) > 0:
             emergency = response.data[0]
@@ -148,7 +261,7 @@ async def initiate_emergency_call(emergency_id: str, user=Depends(get_current_us
     try:
         patient_id = user.id
         
-        emergency_response = supabase.table("emergencies").select("*").eq("id", emergency_id).single().execute()
+        emergency_response = await db_execute(supabase.table("emergencies").select("*").eq("id", emergency_id).single())
         
         if not emergency_response.data:
             return {"success": False, "error": "Emergency not found"}
@@ -183,7 +296,7 @@ async def initiate_emergency_call(emergency_id: str, user=Depends(get_current_us
             "created_at": datetime.now(timezone.utc).isoformat()
         }
         
-        video_response = supabase.table("video_calls").insert(video_call_data).execute()
+        video_response = await db_execute(supabase.table("video_calls").insert(video_call_data))
         print(f"[EMERGENCY_CALL] Video call insert response: {video_response.data}")
         
         if not video_response.data:
@@ -191,9 +304,9 @@ async def initiate_emergency_call(emergency_id: str, user=Depends(get_current_us
         
         video_call_id = video_response.data[0]["id"]
         
-        supabase.table("emergencies").update({
+        await db_execute(supabase.table("emergencies").update({
             "video_call_id": str(video_call_id)
-        }).eq("id", emergency_id).execute()
+        }).eq("id", emergency_id))
         
         token_response = await get_room_token(room_name, patient_id)
         
@@ -217,7 +330,7 @@ async def initiate_emergency_call(emergency_id: str, user=Depends(get_current_us
 @app.post("/api/emergency/{emergency_id}/resolve")
 async def resolve_emergency(emergency_id: str, user=Depends(get_current_user)):
     try:
-        emergency_response = supabase.table("emergencies").select("*").eq("id", emergency_id).single().execute()
+        emergency_response = await db_execute(supabase.table("emergencies").select("*").eq("id", emergency_id).single())
         
         if not emergency_response.data:
             return {"status": "error", "message": "Emergency not found"}
@@ -226,10 +339,10 @@ async def resolve_emergency(emergency_id: str, user=Depends(get_current_user)):
         if emergency["patient_id"] != user.id:
             return {"status": "error", "message": "Unauthorized"}
         
-        update_response = supabase.table("emergencies").update({
+        update_response = await db_execute(supabase.table("emergencies").update({
             "status": "resolved",
             "resolved_at": datetime.now(timezone.utc).isoformat()
-        }).eq("id", emergency_id).execute()
+        }).eq("id", emergency_id))
         
         return {"status": "success", "message": "Emergency resolved"}
     except Exception as e:
@@ -241,7 +354,7 @@ async def reject_emergency(emergency_id: str, user=Depends(get_current_user)):
     try:
         print(f"[EMERGENCY] Rejecting emergency {emergency_id} by {user.id}")
         
-        emergency_response = supabase.table("emergencies").select("*").eq("id", emergency_id).single().execute()
+        emergency_response = await db_execute(supabase.table("emergencies").select("*").eq("id", emergency_id).single())
         
         if not emergency_response.data:
             return {"success": False, "error": "Emergency not found"}
@@ -254,17 +367,17 @@ async def reject_emergency(emergency_id: str, user=Depends(get_current_user)):
         
         if video_call_id:
             try:
-                supabase.table("video_calls").update({
+                await db_execute(supabase.table("video_calls").update({
                     "status": "missed"
-                }).eq("id", video_call_id).execute()
+                }).eq("id", video_call_id))
                 print(f"[EMERGENCY] Marked video call {video_call_id} as missed")
             except Exception as e:
                 print(f"[EMERGENCY] Error updating video call: {e}")
         
-        supabase.table("emergencies").update({
+        await db_execute(supabase.table("emergencies").update({
             "status": "resolved",
             "resolved_at": datetime.now(timezone.utc).isoformat()
-        }).eq("id", emergency_id).execute()
+        }).eq("id", emergency_id))
         
         print(f"[EMERGENCY] Emergency {emergency_id} rejected and resolved")
         return {"success": True, "message": "Emergency rejected"}
@@ -280,8 +393,8 @@ async def get_recent_vitals(email: str, limit: int = 20):
     try:
         print(f"\n[DEBUG_VITALS] Fetching recent vitals for {email} (limit: {limit})")
         
-        realtime = supabase.table("health_realtime").select("*").eq("email", email).order("timestamp", desc=True).limit(limit).execute()
-        aggregated = supabase.table("health_aggregated").select("*").eq("email", email).order("timestamp", desc=True).limit(limit).execute()
+        realtime = await db_execute(supabase.table("health_realtime").select("*").eq("email", email).order("timestamp", desc=True).limit(limit))
+        aggregated = await db_execute(supabase.table("health_aggregated").select("*").eq("email", email).order("timestamp", desc=True).limit(limit))
         
         realtime_data = realtime.data or []
         aggregated_data = aggregated.data or []
@@ -309,14 +422,14 @@ async def get_recent_vitals(email: str, limit: int = 20):
 
 @app.get("/me")
 async def get_me(user=Depends(get_current_user)):
-    profile = supabase.table('profiles').select('*').eq('id', user.id).single().execute()
+    profile = await db_execute(supabase.table('profiles').select('*').eq('id', user.id).single())
     return {"user": user, "profile": profile.data}
 
 @app.post("/api/data")
 async def ingest_health_data(request: Request):
     try:
         print(f"\n=== INCOMING REQUEST ===")
-        print(f"Headers: {dict(request.headers)}")
+        print(f"Content-Length: {request.headers.get('content-length', 'unknown')}")
         
         # Check for authentication header
         auth_header = request.headers.get("Authorization")
@@ -325,9 +438,8 @@ async def ingest_health_data(request: Request):
         if auth_header and auth_header.startswith("Bearer "):
             token = auth_header.split(" ")[1]
             try:
-                user = supabase.auth.get_user(token)
-                if user.user:
-                    email = user.user.email
+                user = await verify_token(token)
+                email = user.email
             except:
                 pass
         
@@ -338,8 +450,15 @@ async def ingest_health_data(request: Request):
                 return {"success": False, "message": "Unauthorized - No user session and no DEFAULT_EMAIL configured"}
             print(f"Using default email: {email}")
         
+        stream_param = request.query_params.get("stream")
+        streaming = STREAMING_INGEST if stream_param is None else stream_param.lower() in ("1", "true", "yes")
+        span = tracer.current_span()
+        if span is not None:
+            span.set(email=email, streaming=streaming)
+        if streaming:
+            return await ingest_health_data_streaming(request, email)
+        
         body = await request.json()
-        print(f"Request body: {body}")
         
         data = body.get("data", {})
         metrics = data.get("metrics", [])
@@ -351,31 +470,29 @@ async def ingest_health_data(request: Request):
 
         total_inserted = 0
         
-        # Realtime vs Aggregated mapping (simplified logic from previous server)
-        realtime_metrics = ["heart_rate", "step_count", "active_energy", "respiratory_rate"]
-        
         print(f"\n{'='*60}")
         print(f"[API_DATA] Processing {len(metrics)} metrics for {email}")
         print(f"{'='*60}")
         
-        for metric in metrics:
-            name = metric.get("name")
-            samples = metric.get("data", [])
-            units = metric.get("units")
-            
-            print(f"[API_DATA] Processing metric: {name} with {len(samples)} samples")
-            
-            if name in realtime_metrics:
-                inserted = await insert_realtime_data(email, name, samples)
-                print(f"[API_DATA] Inserted {inserted} realtime records for {name}")
-                total_inserted += inserted
-            else:
-                inserted = await insert_aggregated_data(email, name, samples, units)
-                print(f"[API_DATA] Inserted {inserted} aggregated records for {name}")
-                total_inserted += inserted
+        async with emergency_scheduler.hold(email):
+            for metric in metrics:
+                name = metric.get("name")
+                samples = metric.get("data", [])
+                units = metric.get("units")
+                
+                print(f"[API_DATA] Processing metric: {name} with {len(samples)} samples")
+                
+                if name in REALTIME_METRIC_NAMES:
+                    inserted = await insert_realtime_data(email, name, samples)
+                    print(f"[API_DATA] Inserted {inserted} realtime records for {name}")
+                    total_inserted += inserted
+                else:
+                    inserted = await insert_aggregated_data(email, name, samples, units)
+                    print(f"[API_DATA] Inserted {inserted} aggregated records for {name}")
+                    total_inserted += inserted
 
         print(f"[API_DATA] Total inserted: {total_inserted}")
-        print(f"[API_DATA] Emergency check will be queued automatically via database triggers")
+        print(f"[API_DATA] Emergency check scheduled once for this request")
         print(f"{'='*60}\n")
         
         return {
@@ -386,6 +503,36 @@ async def ingest_health_data(request: Request):
     except Exception as e:
         return {"success": False, "message": str(e)}
 
+async def ingest_health_data_streaming(request: Request, email: str):
+    print(f"\n{'='*60}")
+    print(f"[API_DATA_STREAM] Streaming ingest for {email} (chunk size {INGEST_CHUNK_SIZE})")
+    print(f"{'='*60}")
+    
+    async def insert_chunk(name: str, units, samples):
+        if name in REALTIME_METRIC_NAMES:
+            inserted = await insert_realtime_data(email, name, samples)
+        else:
+            inserted = await insert_aggregated_data(email, name, samples, units)
+        print(f"[API_DATA_STREAM] Inserted {inserted}/{len(samples)} records for {name}")
+        return inserted
+    
+    # Chunks schedule checks as they land; the hold makes them one evaluation after the body
+    async with emergency_scheduler.hold(email):
+        summary = await stream_health_metrics(request.stream(), insert_chunk)
+    
+    if not summary["metrics"]:
+        return {"success": False, "message": "No metrics found in request"}
+    
+    total_inserted = summary["inserted"]
+    print(f"[API_DATA_STREAM] Total: {summary['metrics']} metrics, {summary['samples']} samples, {total_inserted} inserted")
+    print(f"{'='*60}\n")
+    
+    return {
+        "success": True,
+        "message": f"Successfully ingested {total_inserted} records",
+        "inserted": total_inserted
+    }
+
 @app.post("/api/health/ingest")
 async def ingest_from_api(user=Depends(get_current_user)):
     try:
@@ -414,20 +561,21 @@ async def ingest_from_api(user=Depends(get_current_user)):
         total_inserted = 0
         results = []
         
-        for m in metrics_to_fetch:
-            samples = await fetch_metric(m["endpoint"], params, m["units"])
-            if samples:
-                if m["type"] == "realtime":
-                    inserted = await insert_realtime_data(email, m["name"], samples)
-                elif m["type"] == "sleep":
-                    inserted = await upsert_sleep_data(email, samples)
-                else:
-                    inserted = await insert_aggregated_data(email, m["name"], samples, m["units"])
-                
-                total_inserted += inserted
-                results.append({"metric": m["name"], "inserted": inserted})
+        async with emergency_scheduler.hold(email):
+            for m in metrics_to_fetch:
+                samples = await fetch_metric(m["endpoint"], params, m["units"])
+                if samples:
+                    if m["type"] == "realtime":
+                        inserted = await insert_realtime_data(email, m["name"], samples)
+                    elif m["type"] == "sleep":
+                        inserted = await upsert_sleep_data(email, samples)
+                    else:
+                        inserted = await insert_aggregated_data(email, m["name"], samples, m["units"])
+                    
+                    total_inserted += inserted
+                    results.append({"metric": m["name"], "inserted": inserted})
 
-        print(f"[API_HEALTH_INGEST] Emergency check will be queued automatically via database triggers")
+        print(f"[API_HEALTH_INGEST] Emergency check scheduled once for this request")
 
         return {
             "success": True,
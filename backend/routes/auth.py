@@ -1,21 +1,158 @@
-from fastapi import Request, HTTPException, Depends
+import os
+import time
+import asyncio
+import hashlib
+import hmac
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import jwt
+from pydantic import BaseModel
+from fastapi import Request, HTTPException, Depends, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from utils.supabase_client import supabase
+from utils.db import db_execute, run_blocking
 
 security = HTTPBearer()
 
-async def get_current_user(token: HTTPAuthorizationCredentials = Depends(security)):
+# Legacy HS256 projects sign access tokens with this secret; asymmetric-key projects publish a JWKS
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWKS_URL = os.getenv(
+    "SUPABASE_JWKS_URL",
+    f"{os.getenv('SUPABASE_URL')}/auth/v1/.well-known/jwks.json" if os.getenv("SUPABASE_URL") else ""
+)
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+# Shared secret for /admin endpoints that change queue state or return patient emails; unset disables them
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+
+_jwks_client = jwt.PyJWKClient(SUPABASE_JWKS_URL, cache_keys=True, lifespan=3600) if SUPABASE_JWKS_URL else None
+
+# sha256(token) -> (user, expires_at); ordered for LRU eviction
+_token_cache: "OrderedDict[str, Tuple[AuthenticatedUser, float]]" = OrderedDict()
+
+
+class AuthenticatedUser(BaseModel):
+    id: str
+    email: Optional[str] = None
+    phone: Optional[str] = None
+    role: Optional[str] = None
+    aud: Optional[str] = None
+    app_metadata: Dict[str, Any] = {}
+    user_metadata: Dict[str, Any] = {}
+
+
+class LocalVerificationUnavailable(Exception):
+    """Raised when a token cannot be checked locally and GoTrue must be asked instead."""
+
+
+def _cache_get(key: str) -> Optional[AuthenticatedUser]:
+    entry = _token_cache.get(key)
+    if entry is None:
+        return None
+    user, expires_at = entry
+    if expires_at <= time.time():
+        del _token_cache[key]
+        return None
+    _token_cache.move_to_end(key)
+    return user
+
+
+def _cache_put(key: str, user: AuthenticatedUser, token_exp: Optional[float]) -> None:
+    expires_at = time.time() + TOKEN_CACHE_TTL_SECONDS
+    if token_exp:
+        expires_at = min(expires_at, token_exp)
+    _token_cache[key] = (user, expires_at)
+    _token_cache.move_to_end(key)
+    while len(_token_cache) > TOKEN_CACHE_MAX_ENTRIES:
+        _token_cache.popitem(last=False)
+
+
+async def _decode_locally(token: str) -> Dict[str, Any]:
     try:
-        user = supabase.auth.get_user(token.credentials)
-        if not user.user:
+        header = jwt.get_unverified_header(token)
+    except jwt.InvalidTokenError as e:
+        raise HTTPException(status_code=401, detail=f"Invalid authentication credentials: {e}")
+
+    algorithm = header.get("alg")
+    if algorithm == "HS256" and SUPABASE_JWT_SECRET:
+        key = SUPABASE_JWT_SECRET
+    elif algorithm in ("RS256", "ES256") and _jwks_client is not None:
+        try:
+            # Keys are cached by PyJWKClient; only a kid miss goes to the network, off the event loop
+            key = (await asyncio.to_thread(_jwks_client.get_signing_key_from_jwt, token)).key
+        except jwt.PyJWKClientError as e:
+            raise LocalVerificationUnavailable(str(e))
+    else:
+        raise LocalVerificationUnavailable(f"No local key for algorithm {algorithm}")
+
+    try:
+        return jwt.decode(token, key, algorithms=[algorithm], audience=SUPABASE_JWT_AUDIENCE)
+    except jwt.InvalidTokenError as e:
+        raise HTTPException(status_code=401, detail=f"Invalid authentication credentials: {e}")
+
+
+async def verify_token(token: str) -> AuthenticatedUser:
+    """Resolve a Supabase access token to its user, verifying locally and caching by token hash."""
+    cache_key = hashlib.sha256(token.encode()).hexdigest()
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        claims = await _decode_locally(token)
+        user = AuthenticatedUser(
+            id=claims["sub"],
+            email=claims.get("email"),
+            phone=claims.get("phone"),
+            role=claims.get("role"),
+            aud=claims.get("aud"),
+            app_metadata=claims.get("app_metadata") or {},
+            user_metadata=claims.get("user_metadata") or {}
+        )
+        token_exp = claims.get("exp")
+    except LocalVerificationUnavailable as e:
+        print(f"[AUTH] Local verification unavailable ({e}), asking GoTrue")
+        response = await run_blocking(supabase.auth.get_user, token)
+        if not response or not response.user:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-        return user.user
+        gotrue_user = response.user
+        user = AuthenticatedUser(
+            id=gotrue_user.id,
+            email=gotrue_user.email,
+            phone=gotrue_user.phone,
+            role=gotrue_user.role,
+            aud=gotrue_user.aud,
+            app_metadata=gotrue_user.app_metadata or {},
+            user_metadata=gotrue_user.user_metadata or {}
+        )
+        try:
+            token_exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+        except jwt.InvalidTokenError:
+            token_exp = None
+
+    _cache_put(cache_key, user, token_exp)
+    return user
+
+
+async def get_current_user(token: HTTPAuthorizationCredentials = Depends(security)):
+    try:
+        return await verify_token(token.credentials)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=401, detail=str(e))
 
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Require the X-Admin-Token header to match ADMIN_API_TOKEN."""
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin API disabled: ADMIN_API_TOKEN is not set")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), ADMIN_API_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
 async def get_user_profile(user_id: str):
     try:
-        response = supabase.table('profiles').select('*').eq('id', user_id).single().execute()
+        response = await db_execute(supabase.table('profiles').select('*').eq('id', user_id).single())
         return response.data
     except Exception as e:
         raise HTTPException(status_code=404, detail="Profile not found")
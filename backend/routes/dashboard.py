@@ -1,35 +1,17 @@
-import httpx
-import os
 from datetime import datetime, timedelta, date, timezone
 from typing import List, Dict, Any, Optional
 from fastapi import APIRouter, Depends, HTTPException, Request
 from utils.supabase_client import supabase, supabase_admin
+from utils.db import db_execute
+from utils.postgres import pg_fetch
+from services.identity import identity_directory
+from services.care_context import care_context
 from routes.auth import get_current_user
 from services.alerts import check_alerts_for_user
 from collections import defaultdict
 
 async def get_user_email_from_id(user_id: str) -> Optional[str]:
-    try:
-        supabase_url = os.getenv("SUPABASE_URL")
-        service_key = os.getenv("SUPABASE_SERVICE_KEY", os.getenv("SUPABASE_KEY"))
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{supabase_url}/auth/v1/admin/users/{user_id}",
-                headers={
-                    "Authorization": f"Bearer {service_key}",
-                    "apikey": service_key
-                }
-            )
-            if response.status_code == 200:
-                data = response.json()
-                return data.get("email")
-            else:
-                print(f"Error fetching user {user_id}: {response.status_code}")
-                return None
-    except Exception as e:
-        print(f"Error fetching email for user {user_id}: {e}")
-        return None
+    return await identity_directory.get_email(user_id)
 
 router = APIRouter(prefix="/api/dashboard", tags=["dashboard"])
 
@@ -57,12 +39,19 @@ async def get_dashboard_summary(user=Depends(get_current_user)):
         # 1) Latest Vitals (KPIs) and 2) Today Summary combined
         today_iso = today.isoformat()
         
+        today_start = datetime.combine(today, datetime.min.time())
+        
         # Combined Realtime Query
-        rt_res = supabase.table("health_realtime").select("*").eq("email", email).gte("timestamp", today_iso).execute()
+        rt_rows = await pg_fetch(
+            'select * from public.health_realtime where email = $1 and "timestamp" >= $2',
+            email, today_start
+        )
+        if rt_rows is None:
+            rt_rows = (await db_execute(supabase.table("health_realtime").select("*").eq("email", email).gte("timestamp", today_iso))).data
         
         # Group and calculate latest/summary
         rt_by_metric = defaultdict(list)
-        for r in rt_res.data:
+        for r in rt_rows:
             rt_by_metric[r["metric_name"]].append(r)
             
         latest_rt = {}
@@ -80,10 +69,15 @@ async def get_dashboard_summary(user=Depends(get_current_user)):
         energy_today = sum([r["value"] for r in rt_by_metric["active_energy"]])
         
         # Combined Aggregated Query
-        agg_res = supabase.table("health_aggregated").select("*").eq("email", email).gte("timestamp", today_iso).execute()
+        agg_rows = await pg_fetch(
+            'select * from public.health_aggregated where email = $1 and "timestamp" >= $2',
+            email, today_start
+        )
+        if agg_rows is None:
+            agg_rows = (await db_execute(supabase.table("health_aggregated").select("*").eq("email", email).gte("timestamp", today_iso))).data
         
         agg_by_metric = defaultdict(list)
-        for r in agg_res.data:
+        for r in agg_rows:
             agg_by_metric[r["metric_name"]].append(r)
             
         latest_agg = {}
@@ -121,16 +115,24 @@ async def get_dashboard_trends(user=Depends(get_current_user), metric: str = "he
     start_date = now - timedelta(days=days)
 
     try:
+        table = "health_realtime" if metric in ['heart_rate', 'respiratory_rate', 'step_count', 'active_energy'] else "health_aggregated"
+        rows = await pg_fetch(
+            f'select "timestamp", value from public.{table} where email = $1 and metric_name = $2 and "timestamp" >= $3 order by "timestamp"',
+            email, metric, start_date
+        )
+        if rows is not None:
+            return rows
+        
         if metric == 'heart_rate' and days == 1:
             # Special case for 24h HR chart with more granularity
-            res = supabase.table("health_realtime").select("timestamp, value").eq("email", email).eq("metric_name", metric).gte("timestamp", start_date.isoformat()).order("timestamp").execute()
+            res = await db_execute(supabase.table("health_realtime").select("timestamp, value").eq("email", email).eq("metric_name", metric).gte("timestamp", start_date.isoformat()).order("timestamp"))
             # For 24h we might want to downsample in Python if there's too much data
             return res.data
             
         if metric in ['heart_rate', 'respiratory_rate', 'step_count', 'active_energy']:
-            res = supabase.table("health_realtime").select("timestamp, value").eq("email", email).eq("metric_name", metric).gte("timestamp", start_date.isoformat()).order("timestamp").execute()
+            res = await db_execute(supabase.table("health_realtime").select("timestamp, value").eq("email", email).eq("metric_name", metric).gte("timestamp", start_date.isoformat()).order("timestamp"))
         else:
-            res = supabase.table("health_aggregated").select("timestamp, value").eq("email", email).eq("metric_name", metric).gte("timestamp", start_date.isoformat()).order("timestamp").execute()
+            res = await db_execute(supabase.table("health_aggregated").select("timestamp, value").eq("email", email).eq("metric_name", metric).gte("timestamp", start_date.isoformat()).order("timestamp"))
             
         return res.data
     except Exception as e:
@@ -160,15 +162,27 @@ async def get_vitals_page(user=Depends(get_current_user)):
 
         vitals = {}
         
+        window_start = now - timedelta(days=2)
+        
         # Fetch Realtime (last 48h only for performance)
-        rt_res = supabase.table("health_realtime").select("metric_name, value, timestamp, source").eq("email", email).gte("timestamp", (now - timedelta(days=2)).isoformat()).execute()
+        rt_rows = await pg_fetch(
+            'select metric_name, value, "timestamp", source from public.health_realtime where email = $1 and "timestamp" >= $2',
+            email, window_start
+        )
+        if rt_rows is None:
+            rt_rows = (await db_execute(supabase.table("health_realtime").select("metric_name, value, timestamp, source").eq("email", email).gte("timestamp", window_start.isoformat()))).data
         
         # Fetch Aggregated (last 48h only for performance)
-        agg_res = supabase.table("health_aggregated").select("metric_name, value, timestamp, units").eq("email", email).gte("timestamp", (now - timedelta(days=2)).isoformat()).execute()
+        agg_rows = await pg_fetch(
+            'select metric_name, value, "timestamp", units from public.health_aggregated where email = $1 and "timestamp" >= $2',
+            email, window_start
+        )
+        if agg_rows is None:
+            agg_rows = (await db_execute(supabase.table("health_aggregated").select("metric_name, value, timestamp, units").eq("email", email).gte("timestamp", window_start.isoformat()))).data
 
         # Process RT metrics
         for m in rt_metrics:
-            m_data = [r for r in rt_res.data if r["metric_name"] == m]
+            m_data = [r for r in rt_rows if r["metric_name"] == m]
             if not m_data:
                 vitals[m] = None
                 continue
@@ -184,7 +198,7 @@ async def get_vitals_page(user=Depends(get_current_user)):
 
         # Process Agg metrics
         for m in agg_metrics:
-            m_data = [r for r in agg_res.data if r["metric_name"] == m]
+            m_data = [r for r in agg_rows if r["metric_name"] == m]
             if not m_data:
                 vitals[m] = None
                 continue
@@ -218,21 +232,24 @@ async def check_alerts(user=Depends(get_current_user)):
 async def get_doctor_alerts(user=Depends(get_current_user), status: str = "open"):
     doctor_id = user.id
     try:
-        doctor_links_response = supabase.table("patient_doctor_links").select("patient_id").eq("doctor_id", doctor_id).eq("status", "active").execute()
+        doctor_patient_ids = await care_context.get_doctor_patients(doctor_id)
         
-        if not doctor_links_response.data:
+        if not doctor_patient_ids:
             return {
                 "alerts": [],
                 "patients": {},
                 "status_filter": status
             }
         
-        doctor_patient_ids = [link["patient_id"] for link in doctor_links_response.data]
-        
-        alerts_response = supabase.table("alerts").select("*").eq("status", status).execute()
-        all_alerts = alerts_response.data or []
-        
-        filtered_alerts = [alert for alert in all_alerts if alert["patient_id"] in doctor_patient_ids]
+        filtered_alerts = await pg_fetch(
+            "select * from public.alerts where status = $1 and patient_id = any($2::uuid[])",
+            status, doctor_patient_ids
+        )
+        if filtered_alerts is None:
+            alerts_response = await db_execute(supabase.table("alerts").select("*").eq("status", status))
+            all_alerts = alerts_response.data or []
+            
+            filtered_alerts = [alert for alert in all_alerts if alert["patient_id"] in doctor_patient_ids]
         
         filtered_alerts.sort(key=lambda x: x["created_at"], reverse=True)
         
@@ -245,7 +262,7 @@ async def get_doctor_alerts(user=Depends(get_current_user), status: str = "open"
         
         for patient_id in patient_ids:
             try:
-                profile_response = supabase.table("profiles").select("id, full_name").eq("id", patient_id).single().execute()
+                profile_response = await db_execute(supabase.table("profiles").select("id, full_name").eq("id", patient_id).single())
                 if profile_response.data:
                     patient_profiles[patient_id] = profile_response.data
             except:
@@ -264,7 +281,7 @@ async def get_doctor_alerts(user=Depends(get_current_user), status: str = "open"
 async def acknowledge_alert(alert_id: int, user=Depends(get_current_user)):
     doctor_id = user.id
     try:
-        alert_response = supabase.table("alerts").select("*").eq("id", alert_id).execute()
+        alert_response = await db_execute(supabase.table("alerts").select("*").eq("id", alert_id))
         
         if not alert_response.data:
             raise HTTPException(status_code=404, detail="Alert not found")
@@ -273,16 +290,14 @@ async def acknowledge_alert(alert_id: int, user=Depends(get_current_user)):
         patient_id = alert["patient_id"]
         metadata = alert.get("metadata", {})
         
-        doctor_patient_check = supabase.table("patient_doctor_links").select("*").eq("doctor_id", doctor_id).eq("patient_id", patient_id).eq("status", "active").execute()
-        
-        if not doctor_patient_check.data:
+        if not await care_context.is_linked(doctor_id, patient_id):
             raise HTTPException(status_code=403, detail="You don't have access to this patient's alerts")
         
-        update_response = supabase.table("alerts").update({
+        update_response = await db_execute(supabase.table("alerts").update({
             "status": "acknowledged",
             "acknowledged_by": doctor_id,
             "acknowledged_at": datetime.now(timezone.utc).isoformat()
-        }).eq("id", alert_id).execute()
+        }).eq("id", alert_id))
         
         emergency_id = alert.get("emergency_id")
         alert_type = metadata.get("type")
@@ -292,10 +307,10 @@ async def acknowledge_alert(alert_id: int, user=Depends(get_current_user)):
         if emergency_id:
             print(f"[ALERT_ACK] Resolving emergency {emergency_id}")
             try:
-                emergency_update = supabase_admin.table("emergencies").update({
+                emergency_update = await db_execute(supabase_admin.table("emergencies").update({
                     "status": "resolved",
                     "resolved_at": datetime.now(timezone.utc).isoformat()
-                }).eq("id", emergency_id).execute()
+                }).eq("id", emergency_id))
                 print(f"[ALERT_ACK] Update response: {emergency_update.data}")
                 print(f"[ALERT_ACK] Emergency {emergency_id} marked as resolved")
             except Exception as e:
@@ -1,11 +1,15 @@
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import os
-import httpx
+import asyncio
 import json
 from openai import OpenAI
 from fastapi import APIRouter, Depends, HTTPException, Query
 from utils.supabase_client import supabase, supabase_admin
+from utils.db import db_execute
+from utils.postgres import pg_fetch
+from services.identity import identity_directory
+from services.care_context import care_context
 from routes.auth import get_current_user
 
 def get_openai_client():
@@ -37,27 +41,90 @@ AGGREGATED_METRICS = [
 ]
 
 async def get_user_email(user_id: str) -> Optional[str]:
-    try:
-        supabase_url = os.getenv("SUPABASE_URL")
-        service_key = os.getenv("SUPABASE_SERVICE_KEY", os.getenv("SUPABASE_KEY"))
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{supabase_url}/auth/v1/admin/users/{user_id}",
-                headers={
-                    "Authorization": f"Bearer {service_key}",
-                    "apikey": service_key
-                }
-            )
-            if response.status_code == 200:
-                data = response.json()
-                return data.get("email")
-            else:
-                print(f"Error fetching user {user_id}: {response.status_code} - {response.text}")
-                return None
-    except Exception as e:
-        print(f"Error fetching email for user {user_id}: {e}")
+    return await identity_directory.get_email(user_id)
+
+async def fetch_report_rows(
+    patient_email: str,
+    requested_metrics: List[str],
+    start_datetime: str,
+    end_datetime: str
+) -> Optional[Tuple[Dict[str, List[Dict[str, Any]]], Dict[str, List[Dict[str, Any]]]]]:
+    """Fetch all requested metrics in one query per table on the pool; None means use PostgREST."""
+    start = datetime.fromisoformat(start_datetime)
+    end = datetime.fromisoformat(end_datetime)
+    realtime = [m for m in requested_metrics if m in REALTIME_METRICS]
+    aggregated = [m for m in requested_metrics if m in AGGREGATED_METRICS]
+    
+    realtime_data: Dict[str, List[Dict[str, Any]]] = {}
+    aggregated_data: Dict[str, List[Dict[str, Any]]] = {}
+    
+    if realtime:
+        rows = await pg_fetch(
+            """select metric_name, "timestamp", value, source from public.health_realtime
+               where email = $1 and metric_name = any($2::text[]) and "timestamp" >= $3 and "timestamp" < $4
+               order by "timestamp" desc""",
+            patient_email, realtime, start, end
+        )
+        if rows is None:
+            return None
+        for row in rows:
+            realtime_data.setdefault(row["metric_name"], []).append(row)
+    
+    if aggregated:
+        rows = await pg_fetch(
+            """select metric_name, "timestamp", value, units from public.health_aggregated
+               where email = $1 and metric_name = any($2::text[]) and "timestamp" >= $3 and "timestamp" < $4
+               order by "timestamp" desc""",
+            patient_email, aggregated, start, end
+        )
+        if rows is None:
+            return None
+        for row in rows:
+            aggregated_data.setdefault(row["metric_name"], []).append(row)
+    
+    return realtime_data, aggregated_data
+
+async def fetch_report_summary(patient_email: str, start_datetime: str, end_datetime: str) -> Optional[Dict[str, Any]]:
+    """Aggregate every report metric in SQL on the pool; None means use PostgREST."""
+    # Zero values are skipped to match the PostgREST path's `if r["value"]` filter
+    rows = await pg_fetch(
+        """select 'realtime' as source_table, metric_name,
+                  count(*) filter (where value <> 0) as count,
+                  avg(value) filter (where value <> 0) as average,
+                  min(value) filter (where value <> 0) as min,
+                  max(value) filter (where value <> 0) as max,
+                  sum(value) filter (where value <> 0) as total
+             from public.health_realtime
+            where email = $1 and metric_name = any($2::text[]) and "timestamp" >= $4 and "timestamp" < $5
+            group by metric_name
+           union all
+           select 'aggregated' as source_table, metric_name,
+                  count(*) filter (where value <> 0),
+                  avg(value) filter (where value <> 0),
+                  min(value) filter (where value <> 0),
+                  max(value) filter (where value <> 0),
+                  sum(value) filter (where value <> 0)
+             from public.health_aggregated
+            where email = $1 and metric_name = any($3::text[]) and "timestamp" >= $4 and "timestamp" < $5
+            group by metric_name""",
+        patient_email, REALTIME_METRICS, AGGREGATED_METRICS,
+        datetime.fromisoformat(start_datetime), datetime.fromisoformat(end_datetime)
+    )
+    if rows is None:
         return None
+    
+    metrics_summary = {}
+    for row in rows:
+        entry = {
+            "count": row["count"],
+            "average": row["average"],
+            "min": row["min"],
+            "max": row["max"]
+        }
+        if row["source_table"] == "aggregated":
+            entry["total"] = row["total"] if row["count"] else None
+        metrics_summary[row["metric_name"]] = entry
+    return metrics_summary
 
 @router.get("/patients")
 async def get_doctor_patients(user=Depends(get_current_user)):
@@ -66,26 +133,29 @@ async def get_doctor_patients(user=Depends(get_current_user)):
     print(f"[REPORTS_PATIENTS] Doctor email: {user.email}")
     
     try:
-        doctor_links_response = supabase.table("patient_doctor_links").select("patient_id").eq("doctor_id", doctor_id).eq("status", "active").execute()
-        print(f"[REPORTS_PATIENTS] Query result count: {len(doctor_links_response.data)}")
-        print(f"[REPORTS_PATIENTS] Query result: {doctor_links_response.data}")
+        doctor_patient_ids = await care_context.get_doctor_patients(doctor_id)
+        print(f"[REPORTS_PATIENTS] Linked patient count: {len(doctor_patient_ids)}")
         
-        if not doctor_links_response.data:
+        if not doctor_patient_ids:
             print(f"[REPORTS_PATIENTS] No patient links found for doctor {doctor_id}")
             return {"patients": []}
         
-        doctor_patient_ids = [link["patient_id"] for link in doctor_links_response.data]
         print(f"[REPORTS_PATIENTS] Patient IDs to fetch: {doctor_patient_ids}")
         
-        patient_profiles = []
-        for patient_id in doctor_patient_ids:
-            try:
-                profile_response = supabase.table("profiles").select("id, full_name").eq("id", patient_id).execute()
-                print(f"[REPORTS_PATIENTS] Profile result for {patient_id}: {profile_response.data}")
-                if profile_response.data:
-                    patient_profiles.append(profile_response.data[0])
-            except Exception as e:
-                print(f"[REPORTS_PATIENTS] Error fetching profile for {patient_id}: {e}")
+        patient_profiles = await pg_fetch(
+            "select id, full_name from public.profiles where id = any($1::uuid[])",
+            doctor_patient_ids
+        )
+        if patient_profiles is None:
+            patient_profiles = []
+            for patient_id in doctor_patient_ids:
+                try:
+                    profile_response = await db_execute(supabase.table("profiles").select("id, full_name").eq("id", patient_id))
+                    print(f"[REPORTS_PATIENTS] Profile result for {patient_id}: {profile_response.data}")
+                    if profile_response.data:
+                        patient_profiles.append(profile_response.data[0])
+                except Exception as e:
+                    print(f"[REPORTS_PATIENTS] Error fetching profile for {patient_id}: {e}")
         
         print(f"[REPORTS_PATIENTS] Returning {len(patient_profiles)} patient profiles")
         return {"patients": patient_profiles}
@@ -116,12 +186,10 @@ async def get_report_data(
 ):
     doctor_id = user.id
     try:
-        doctor_patient_check = supabase.table("patient_doctor_links").select("*").eq("doctor_id", doctor_id).eq("patient_id", patient_id).eq("status", "active").execute()
-        
-        if not doctor_patient_check.data:
+        if not await care_context.is_linked(doctor_id, patient_id):
             raise HTTPException(status_code=403, detail="You don't have access to this patient's data")
         
-        patient_profile_response = supabase.table("profiles").select("id, full_name").eq("id", patient_id).execute()
+        patient_profile_response = await db_execute(supabase.table("profiles").select("id, full_name").eq("id", patient_id))
         patient_email = await get_user_email(patient_id)
         
         if not patient_email:
@@ -140,15 +208,20 @@ async def get_report_data(
         
         requested_metrics = metrics if metrics else REALTIME_METRICS + AGGREGATED_METRICS
         
+        pooled = await fetch_report_rows(patient_email, requested_metrics, start_datetime, end_datetime)
+        if pooled is not None:
+            result_data["realtime_data"], result_data["aggregated_data"] = pooled
+            return result_data
+        
         for metric in requested_metrics:
             if metric in REALTIME_METRICS:
-                realtime_response = supabase.table("health_realtime").select("metric_name, timestamp, value, source").eq("email", patient_email).eq("metric_name", metric).gte("timestamp", start_datetime).lt("timestamp", end_datetime).order("timestamp", desc=True).execute()
+                realtime_response = await db_execute(supabase.table("health_realtime").select("metric_name, timestamp, value, source").eq("email", patient_email).eq("metric_name", metric).gte("timestamp", start_datetime).lt("timestamp", end_datetime).order("timestamp", desc=True))
                 
                 if realtime_response.data:
                     result_data["realtime_data"][metric] = realtime_response.data
             
             elif metric in AGGREGATED_METRICS:
-                aggregated_response = supabase.table("health_aggregated").select("metric_name, timestamp, value, units").eq("email", patient_email).eq("metric_name", metric).gte("timestamp", start_datetime).lt("timestamp", end_datetime).order("timestamp", desc=True).execute()
+                aggregated_response = await db_execute(supabase.table("health_aggregated").select("metric_name, timestamp, value, units").eq("email", patient_email).eq("metric_name", metric).gte("timestamp", start_datetime).lt("timestamp", end_datetime).order("timestamp", desc=True))
                 
                 if aggregated_response.data:
                     result_data["aggregated_data"][metric] = aggregated_response.data
@@ -172,12 +245,10 @@ async def get_report_summary(
 ):
     doctor_id = user.id
     try:
-        doctor_patient_check = supabase.table("patient_doctor_links").select("*").eq("doctor_id", doctor_id).eq("patient_id", patient_id).eq("status", "active").execute()
-        
-        if not doctor_patient_check.data:
+        if not await care_context.is_linked(doctor_id, patient_id):
             raise HTTPException(status_code=403, detail="You don't have access to this patient's data")
         
-        patient_profile_response = supabase.table("profiles").select("id, full_name").eq("id", patient_id).execute()
+        patient_profile_response = await db_execute(supabase.table("profiles").select("id, full_name").eq("id", patient_id))
         patient_email = await get_user_email(patient_id)
         
         if not patient_email:
@@ -192,8 +263,13 @@ async def get_report_summary(
             "metrics_summary": {}
         }
         
+        pooled = await fetch_report_summary(patient_email, start_datetime, end_datetime)
+        if pooled is not None:
+            summary["metrics_summary"] = pooled
+            return summary
+        
         for metric in REALTIME_METRICS:
-            realtime_response = supabase.table("health_realtime").select("value").eq("email", patient_email).eq("metric_name", metric).gte("timestamp", start_datetime).lt("timestamp", end_datetime).execute()
+            realtime_response = await db_execute(supabase.table("health_realtime").select("value").eq("email", patient_email).eq("metric_name", metric).gte("timestamp", start_datetime).lt("timestamp", end_datetime))
             
             if realtime_response.data:
                 values = [float(r["value"]) for r in realtime_response.data if r["value"]]
@@ -205,7 +281,7 @@ async def get_report_summary(
                 }
         
         for metric in AGGREGATED_METRICS:
-            aggregated_response = supabase.table("health_aggregated").select("value").eq("email", patient_email).eq("metric_name", metric).gte("timestamp", start_datetime).lt("timestamp", end_datetime).execute()
+            aggregated_response = await db_execute(supabase.table("health_aggregated").select("value").eq("email", patient_email).eq("metric_name", metric).gte("timestamp", start_datetime).lt("timestamp", end_datetime))
             
             if aggregated_response.data:
                 values = [float(r["value"]) for r in aggregated_response.data if r["value"]]
@@ -236,9 +312,7 @@ async def get_ai_analysis(
 ):
     doctor_id = user.id
     try:
-        doctor_patient_check = supabase.table("patient_doctor_links").select("*").eq("doctor_id", doctor_id).eq("patient_id", patient_id).eq("status", "active").execute()
-        
-        if not doctor_patient_check.data:
+        if not await care_context.is_linked(doctor_id, patient_id):
             raise HTTPException(status_code=403, detail="You don't have access to this patient's data")
         
         patient_email = await get_user_email(patient_id)
@@ -264,15 +338,27 @@ async def get_ai_analysis(
         
         metrics_data = {}
         
-        for metric in realtime_metrics:
-            response = supabase.table("health_realtime").select("value, timestamp").eq("email", patient_email).eq("metric_name", metric).gte("timestamp", start_datetime.isoformat()).lt("timestamp", end_datetime.isoformat()).execute()
-            if response.data:
-                metrics_data[metric] = response.data
-        
-        for metric in aggregated_metrics:
-            response = supabase.table("health_aggregated").select("value, timestamp").eq("email", patient_email).eq("metric_name", metric).gte("timestamp", start_datetime.isoformat()).lt("timestamp", end_datetime.isoformat()).execute()
-            if response.data:
-                metrics_data[metric] = response.data
+        pooled = await pg_fetch(
+            """select metric_name, value, "timestamp" from public.health_realtime
+               where email = $1 and metric_name = any($2::text[]) and "timestamp" >= $4 and "timestamp" < $5
+               union all
+               select metric_name, value, "timestamp" from public.health_aggregated
+               where email = $1 and metric_name = any($3::text[]) and "timestamp" >= $4 and "timestamp" < $5""",
+            patient_email, realtime_metrics, aggregated_metrics, start_datetime, end_datetime
+        )
+        if pooled is not None:
+            for row in pooled:
+                metrics_data.setdefault(row["metric_name"], []).append({"value": row["value"], "timestamp": row["timestamp"]})
+        else:
+            for metric in realtime_metrics:
+                response = await db_execute(supabase.table("health_realtime").select("value, timestamp").eq("email", patient_email).eq("metric_name", metric).gte("timestamp", start_datetime.isoformat()).lt("timestamp", end_datetime.isoformat()))
+                if response.data:
+                    metrics_data[metric] = response.data
+            
+            for metric in aggregated_metrics:
+                response = await db_execute(supabase.table("health_aggregated").select("value, timestamp").eq("email", patient_email).eq("metric_name", metric).gte("timestamp", start_datetime.isoformat()).lt("timestamp", end_datetime.isoformat()))
+                if response.data:
+                    metrics_data[metric] = response.data
         
         if not metrics_data:
             return {
@@ -295,7 +381,8 @@ Please provide a professional health analysis report for doctors based on this d
 
 Keep the report concise but informative."""
 
-        response = get_openai_client().chat.completions.create(
+        response = await asyncio.to_thread(
+            get_openai_client().chat.completions.create,
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "You are a medical assistant analyzing patient health data for doctors."},
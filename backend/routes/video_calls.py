@@ -3,6 +3,7 @@ from fastapi.responses import JSONResponse
 from datetime import datetime, timezone
 from services.video_call import create_room, get_room_token
 from utils.supabase_client import supabase, supabase_admin
+from utils.db import db_execute
 
 router = APIRouter(prefix="/api/video", tags=["video_calls"])
 
@@ -45,7 +46,7 @@ async def initiate_call(request: Request):
             "created_at": datetime.utcnow().isoformat()
         }
         
-        result = supabase.table("video_calls").insert(video_call_data).execute()
+        result = await db_execute(supabase.table("video_calls").insert(video_call_data))
         print(f"[VIDEO] Supabase insert result: {result.data}")
         
         if not result.data:
@@ -99,7 +100,7 @@ async def accept_call(request: Request):
                 content={"success": False, "error": "Missing call_id or accepted_by"}
             )
         
-        call = supabase.table("video_calls").select("*").eq("id", call_id).single().execute()
+        call = await db_execute(supabase.table("video_calls").select("*").eq("id", call_id).single())
         
         if not call.data:
             return JSONResponse(
@@ -107,10 +108,10 @@ async def accept_call(request: Request):
                 content={"success": False, "error": "Call not found"}
             )
         
-        supabase.table("video_calls").update({
+        await db_execute(supabase.table("video_calls").update({
             "status": "active",
             "started_at": datetime.utcnow().isoformat()
-        }).eq("id", call_id).execute()
+        }).eq("id", call_id))
         
         token_response = await get_room_token(call.data["room_name"], accepted_by)
         
@@ -152,7 +153,7 @@ async def end_call(request: Request):
                 content={"success": False, "error": "Missing call_id"}
             )
         
-        call = supabase.table("video_calls").select("*").eq("id", call_id).single().execute()
+        call = await db_execute(supabase.table("video_calls").select("*").eq("id", call_id).single())
         
         if not call.data:
             return JSONResponse(
@@ -160,10 +161,10 @@ async def end_call(request: Request):
                 content={"success": False, "error": "Call not found"}
             )
         
-        supabase.table("video_calls").update({
+        await db_execute(supabase.table("video_calls").update({
             "status": "ended",
             "ended_at": datetime.utcnow().isoformat()
-        }).eq("id", call_id).execute()
+        }).eq("id", call_id))
         
         return JSONResponse(
             status_code=200,
@@ -193,7 +194,7 @@ async def reject_call(request: Request):
                 content={"success": True, "message": "Call rejected"}
             )
         
-        call = supabase.table("video_calls").select("*").eq("id", call_id).single().execute()
+        call = await db_execute(supabase.table("video_calls").select("*").eq("id", call_id).single())
         
         if not call.data:
             return JSONResponse(
@@ -201,20 +202,20 @@ async def reject_call(request: Request):
                 content={"success": False, "error": "Call not found"}
             )
         
-        supabase.table("video_calls").update({
+        await db_execute(supabase.table("video_calls").update({
             "status": "missed"
-        }).eq("id", call_id).execute()
+        }).eq("id", call_id))
         
-        emergency_response = supabase_admin.table("emergencies").select("*").eq("video_call_id", str(call_id)).execute()
+        emergency_response = await db_execute(supabase_admin.table("emergencies").select("*").eq("video_call_id", str(call_id)))
         
         if emergency_response.data and len(emergency_response.data) > 0:
             emergency = emergency_response.data[0]
             print(f"[VIDEO] Found associated emergency {emergency.get('id')}, resolving...")
             
-            supabase_admin.table("emergencies").update({
+            await db_execute(supabase_admin.table("emergencies").update({
                 "status": "resolved",
                 "resolved_at": datetime.now(timezone.utc).isoformat()
-            }).eq("id", emergency.get("id")).execute()
+            }).eq("id", emergency.get("id")))
             
             print(f"[VIDEO] Emergency {emergency.get('id')} resolved due to call rejection")
         
@@ -1,17 +1,71 @@
 import os
 import json
 import time
-import httpx
+import asyncio
+from collections import deque
 from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Dict, Any
-import google.genai as genai
 from utils.supabase_client import supabase, supabase_admin
+from utils.db import db_execute
+from utils.postgres import pg_fetch
+from services.identity import identity_directory
+from services.care_context import care_context
+from services.fanout import run_fanout
+from services.llm_gateway import llm_gateway
+from services.analysis_cache import analysis_cache, metrics_fingerprint
+from services.normal_ranges import LLM_NORMAL_RANGES, as_percent, range_band
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-client = genai.Client(api_key=GEMINI_API_KEY)
+# Emails per get_health_metrics_batch call in the hourly alert check
+ALERT_METRICS_BATCH_SIZE = int(os.getenv("ALERT_METRICS_BATCH_SIZE", "100"))
 
-MAX_RETRIES = 3
-RETRY_DELAY = 2
+# Change in last-hour average since the user's last LLM analysis that escalates them
+PRESCREEN_MAX_CHANGE: Dict[str, float] = {
+    "heart_rate": 15.0,
+    "respiratory_rate": 4.0,
+    "heart_rate_variability": 30.0,
+    "blood_oxygen_saturation": 3.0,
+    "resting_heart_rate": 10.0,
+}
+PRESCREEN_HISTORY = int(os.getenv("PRESCREEN_HISTORY", "500"))
+
+# Batched analysis: patients per request are bounded by the prompt and output token budgets
+LLM_BATCH_PROMPT_TOKENS = int(os.getenv("LLM_BATCH_PROMPT_TOKENS", "6000"))
+LLM_BATCH_MAX_OUTPUT_TOKENS = int(os.getenv("LLM_BATCH_MAX_OUTPUT_TOKENS", "8192"))
+LLM_BATCH_OUTPUT_TOKENS_PER_PATIENT = int(os.getenv("LLM_BATCH_OUTPUT_TOKENS_PER_PATIENT", "300"))
+LLM_BATCH_TIMEOUT_SECONDS = float(os.getenv("LLM_BATCH_TIMEOUT_SECONDS", "90"))
+# Rough size of a token for budgeting prompts without a tokenizer round trip
+CHARS_PER_TOKEN = 4
+
+ALERT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "metric_name": {"type": "STRING"},
+        "severity": {"type": "STRING"},
+        "title": {"type": "STRING"},
+        "message": {"type": "STRING"},
+        "reason": {"type": "STRING"}
+    },
+    "required": ["metric_name", "severity", "title", "message", "reason"]
+}
+BATCH_ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "patients": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "patient_id": {"type": "STRING"},
+                    "has_alerts": {"type": "BOOLEAN"},
+                    "alerts": {"type": "ARRAY", "items": ALERT_SCHEMA},
+                    "summary": {"type": "STRING"}
+                },
+                "required": ["patient_id", "has_alerts", "alerts", "summary"]
+            }
+        }
+    },
+    "required": ["patients"]
+}
 
 
 def normalize_metric_name(name: str) -> str:
@@ -41,14 +95,133 @@ def normalize_severity(severity: str) -> str:
     else:
         return 'info'
 
+def normal_ranges_text() -> str:
+    return ", ".join(f"{label} {low}-{high}{unit}" for label, low, high, unit in LLM_NORMAL_RANGES.values())
+
+
+class AlertPrescreen:
+    """Decides locally whether a user's metric summary needs LLM analysis.
+
+    A user is escalated when any ranged metric's recent values (last-hour current, low
+    and high, or today's average when the last hour is empty) fall outside
+    LLM_NORMAL_RANGES or within PRESCREEN_MARGIN_FRACTION of a bound, or when a
+    last-hour average moved more than PRESCREEN_MAX_CHANGE since the user was last
+    escalated. Everyone else is skipped. Each decision and its reasons are kept in a
+    ring buffer of PRESCREEN_HISTORY entries.
+    """
+
+    def __init__(self):
+        # Last-hour averages at the user's last escalation (or first screen)
+        self._baselines: Dict[str, Dict[str, float]] = {}
+        self.decisions = deque(maxlen=PRESCREEN_HISTORY)
+        self.stats = {"screened": 0, "escalated": 0, "skipped": 0}
+
+    def _check_metric(self, metric: Dict[str, Any]) -> Optional[str]:
+        name = metric.get("metric_name")
+        label, low, high, _ = LLM_NORMAL_RANGES[name]
+        values = [metric.get(f) for f in ("last_hour_current", "last_hour_low", "last_hour_high") if metric.get(f) is not None]
+        if not values and metric.get("today_avg") is not None:
+            values = [metric.get("today_avg")]
+        for raw in values:
+            value = as_percent(name, float(raw))
+            band = range_band(name, value)
+            if band in ("low", "high"):
+                return f"{label} {value:g} outside {low}-{high}"
+            if band in ("near_low", "near_high"):
+                return f"{label} {value:g} near limit of {low}-{high}"
+        return None
+
+    def screen(self, email: str, metrics: List[Dict[str, Any]]) -> Dict[str, Any]:
+        reasons = []
+        averages: Dict[str, float] = {}
+        for metric in metrics or []:
+            name = metric.get("metric_name")
+            if name not in LLM_NORMAL_RANGES:
+                continue
+            try:
+                reason = self._check_metric(metric)
+                if metric.get("last_hour_avg") is not None:
+                    averages[name] = as_percent(name, float(metric["last_hour_avg"]))
+            except (TypeError, ValueError):
+                reason = f"{name} has a non-numeric value"
+            if reason:
+                reasons.append(reason)
+
+        baseline = self._baselines.get(email)
+        if baseline is not None:
+            for name, value in averages.items():
+                previous = baseline.get(name)
+                if previous is not None and abs(value - previous) > PRESCREEN_MAX_CHANGE[name]:
+                    reasons.append(f"{LLM_NORMAL_RANGES[name][0]} moved {value - previous:+.1f} since last analysis")
+
+        escalate = bool(reasons)
+        if not metrics:
+            reasons = ["no metrics"]
+        elif not escalate:
+            reasons = ["all ranged metrics well inside normal ranges"]
+        if escalate or baseline is None:
+            self._baselines[email] = averages
+
+        decision = {"email": email, "escalate": escalate, "reasons": reasons, "at": time.time()}
+        self.decisions.appendleft(decision)
+        self.stats["screened"] += 1
+        self.stats["escalated" if escalate else "skipped"] += 1
+        return decision
+
+    def snapshot(self, limit: int = 50, escalated: Optional[bool] = None) -> Dict[str, Any]:
+        decisions = [d for d in self.decisions if escalated is None or d["escalate"] == escalated][:limit]
+        return {**self.stats, "decisions": decisions}
+
+
+alert_prescreen = AlertPrescreen()
+
+
+async def fetch_health_metrics_batch(emails: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Last-hour and today summaries per metric for many emails, aggregated in the database.
+
+    Uses public.get_health_metrics_batch (database/14_health_metrics_batch.sql), so one
+    row per (email, metric) comes back instead of every sample of the day. Emails
+    without data map to []. If the function is unavailable nothing is returned and
+    callers fetch per email (fetch_user_health_metrics falls back to Python).
+    """
+    if not emails:
+        return {}
+    try:
+        rows = await pg_fetch("select * from public.get_health_metrics_batch($1::text[])", emails)
+        if rows is None:
+            rows = (await db_execute(supabase_admin.rpc("get_health_metrics_batch", {"p_emails": emails}))).data or []
+    except Exception as e:
+        print(f"[ALERTS] get_health_metrics_batch unavailable, fetching per email: {e}")
+        return {}
+
+    metrics_by_email: Dict[str, List[Dict[str, Any]]] = {email: [] for email in emails}
+    for row in rows:
+        email = row.pop("email", None)
+        if email in metrics_by_email:
+            metrics_by_email[email].append(row)
+    return metrics_by_email
+
+
 async def fetch_user_health_metrics(email: str) -> Optional[List[Dict[str, Any]]]:
+    try:
+        rows = await pg_fetch("select * from public.get_health_metrics($1)", email)
+        if rows is None:
+            rows = (await db_execute(supabase_admin.rpc("get_health_metrics", {"p_email": email}))).data or []
+        return rows
+    except Exception as e:
+        print(f"[ALERTS] get_health_metrics unavailable, aggregating in Python: {e}")
+        return await aggregate_health_metrics_in_python(email)
+
+
+async def aggregate_health_metrics_in_python(email: str) -> Optional[List[Dict[str, Any]]]:
+    """Fallback for databases without the aggregation functions: downloads the day's samples."""
     try:
         now = datetime.now(timezone.utc)
         hour_start = now - timedelta(hours=1)
         day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
         
-        realtime_response = supabase.table("health_realtime").select("*").eq("email", email).gte("timestamp", day_start.isoformat()).execute()
-        aggregated_response = supabase.table("health_aggregated").select("*").eq("email", email).gte("timestamp", day_start.isoformat()).execute()
+        realtime_response = await db_execute(supabase.table("health_realtime").select("*").eq("email", email).gte("timestamp", day_start.isoformat()))
+        aggregated_response = await db_execute(supabase.table("health_aggregated").select("*").eq("email", email).gte("timestamp", day_start.isoformat()))
         
         all_data = (realtime_response.data or []) + (aggregated_response.data or [])
         
@@ -123,106 +296,201 @@ async def fetch_user_health_metrics(email: str) -> Optional[List[Dict[str, Any]]
         return None
 
 
+def format_metrics_summary(metrics: List[Dict[str, Any]]) -> str:
+    return "\n".join(
+        f"{m['metric_name']}: curr={m.get('last_hour_current')}, hr_avg={m.get('last_hour_avg')}, today_avg={m.get('today_avg')}"
+        for m in metrics
+    )
+
+
 async def analyze_metrics_with_gemini(email: str, metrics: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
     try:
         if not metrics:
             return None
 
-        metrics_summary = []
-        for m in metrics:
-            summary = f"{m['metric_name']}: curr={m.get('last_hour_current')}, hr_avg={m.get('last_hour_avg')}, today_avg={m.get('today_avg')}"
-            metrics_summary.append(summary)
-        
-        metrics_text = "\n".join(metrics_summary)
+        fingerprint = metrics_fingerprint(email, metrics)
+        cached = analysis_cache.get(fingerprint)
+        if cached is not None:
+            print(f"[ALERTS] Reusing cached analysis for {email} (fingerprint {fingerprint[:12]})")
+            return cached
+
+        metrics_text = format_metrics_summary(metrics)
         
         prompt = f"""Analyze health metrics and identify concerning values:
 {metrics_text}
 
-Normal ranges: HR 60-100, RR 12-20, HRV 20-200ms, SpO2 95-100%, RHR 60-100
+Normal ranges: {normal_ranges_text()}
 
 Return JSON: {{"has_alerts": bool, "alerts": [{{"metric_name": str, "severity": str, "title": str, "message": str, "reason": str}}], "summary": str}}
 """
         
-        for attempt in range(MAX_RETRIES):
-            try:
-                response = client.models.generate_content(
-                    model="gemini-2.5-flash",
-                    contents=prompt
-                )
-                
-                try:
-                    text = response.text.strip()
-                    if text.startswith("```json"):
-                        text = text[7:]
-                    if text.startswith("```"):
-                        text = text[3:]
-                    if text.endswith("```"):
-                        text = text[:-3]
-                    text = text.strip()
-                    
-                    analysis = json.loads(text)
-                    return analysis
-                except json.JSONDecodeError:
-                    print(f"Failed to parse Gemini response as JSON: {response.text}")
-                    return None
-                    
-            except Exception as e:
-                error_str = str(e)
-                if "429" in error_str or "quota" in error_str.lower():
-                    if attempt < MAX_RETRIES - 1:
-                        wait_time = RETRY_DELAY * (2 ** attempt)
-                        print(f"Rate limited. Retrying in {wait_time}s (attempt {attempt + 1}/{MAX_RETRIES})...")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        print(f"Rate limit exceeded after {MAX_RETRIES} attempts: {e}")
-                        return None
-                else:
-                    print(f"Error analyzing metrics with Gemini: {e}")
-                    return None
+        text = await llm_gateway.generate(prompt, purpose=f"alert analysis for {email}")
+        if text is None:
+            return None
+        
+        try:
+            text = text.strip()
+            if text.startswith("```json"):
+                text = text[7:]
+            if text.startswith("```"):
+                text = text[3:]
+            if text.endswith("```"):
+                text = text[:-3]
+            text = text.strip()
+            
+            analysis = json.loads(text)
+            analysis_cache.put(fingerprint, analysis)
+            return analysis
+        except json.JSONDecodeError:
+            print(f"Failed to parse Gemini response as JSON: {text}")
+            return None
             
     except Exception as e:
         print(f"Unexpected error in analyze_metrics_with_gemini: {e}")
         return None
 
 
-async def get_patient_id(email: str) -> Optional[str]:
-    try:
-        print(f"[GET_PATIENT_ID] Looking up ID for email: {email}")
-        supabase_url = os.getenv("SUPABASE_URL")
-        service_key = os.getenv("SUPABASE_SERVICE_KEY", os.getenv("SUPABASE_KEY"))
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{supabase_url}/auth/v1/admin/users",
-                headers={
-                    "Authorization": f"Bearer {service_key}",
-                    "apikey": service_key
-                },
-                params={"query": email}
-            )
-            if response.status_code == 200:
-                data = response.json()
-                users = data.get("users", [])
-                for user in users:
-                    if user.get("email") == email:
-                        patient_id = user.get("id")
-                        print(f"[GET_PATIENT_ID] Found patient ID: {patient_id}")
-                        return patient_id
-        
-        print(f"[GET_PATIENT_ID] No user found for {email}")
+def validate_analysis(entry: Any) -> Optional[Dict[str, Any]]:
+    """Return a clean analysis dict, or None if the entry does not match the expected shape."""
+    if not isinstance(entry, dict) or not isinstance(entry.get("has_alerts"), bool):
         return None
-    except Exception as e:
-        print(f"[GET_PATIENT_ID] Error: {e}")
-        import traceback
-        traceback.print_exc()
+    alerts = entry.get("alerts")
+    if not isinstance(alerts, list) or (entry["has_alerts"] and not alerts):
         return None
+    clean_alerts = []
+    for alert in alerts:
+        if not isinstance(alert, dict) or not alert.get("title") or not alert.get("metric_name"):
+            return None
+        clean_alerts.append({key: str(alert.get(key) or "") for key in ALERT_SCHEMA["properties"]})
+    return {"has_alerts": entry["has_alerts"], "alerts": clean_alerts, "summary": str(entry.get("summary") or "")}
+
+
+def pack_analysis_batches(blocks: Dict[str, str]) -> List[List[str]]:
+    """Group patient ids so each batch fits the prompt token budget and its expected output fits the output budget."""
+    max_patients = max(1, LLM_BATCH_MAX_OUTPUT_TOKENS // LLM_BATCH_OUTPUT_TOKENS_PER_PATIENT)
+    batches: List[List[str]] = []
+    current: List[str] = []
+    current_tokens = 0
+    for patient_id, block in blocks.items():
+        tokens = len(block) // CHARS_PER_TOKEN + 1
+        if current and (current_tokens + tokens > LLM_BATCH_PROMPT_TOKENS or len(current) >= max_patients):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(patient_id)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def _analyze_batch(patient_ids: List[str], blocks: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+    """One structured-output request for several patients; returns the valid per-patient analyses."""
+    patients_text = "\n\n".join(f"Patient {pid}:\n{blocks[pid]}" for pid in patient_ids)
+    prompt = f"""Analyze health metrics for each patient below and identify concerning values.
+Assess every patient independently.
+
+Normal ranges: {normal_ranges_text()}
+
+{patients_text}
+
+Return one entry per patient, with patient_id set to the exact id above.
+"""
+    text = await llm_gateway.generate(
+        prompt,
+        config={
+            "response_mime_type": "application/json",
+            "response_schema": BATCH_ANALYSIS_SCHEMA,
+            "max_output_tokens": min(LLM_BATCH_MAX_OUTPUT_TOKENS, LLM_BATCH_OUTPUT_TOKENS_PER_PATIENT * len(patient_ids) * 2)
+        },
+        purpose=f"batch alert analysis ({len(patient_ids)} patients)",
+        timeout=LLM_BATCH_TIMEOUT_SECONDS
+    )
+    if text is None:
+        return {}
+    try:
+        entries = json.loads(text).get("patients")
+    except (json.JSONDecodeError, AttributeError):
+        print(f"[ALERTS] Batch analysis response is not valid JSON ({len(text)} chars)")
+        return {}
+    if not isinstance(entries, list):
+        return {}
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for entry in entries:
+        patient_id = entry.get("patient_id") if isinstance(entry, dict) else None
+        analysis = validate_analysis(entry)
+        # Ids the model invented or repeated are dropped; those patients fall back to single calls
+        if patient_id in blocks and patient_id not in results and analysis is not None:
+            results[patient_id] = analysis
+    return results
+
+
+async def analyze_metrics_batch(metrics_by_email: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """Analyze many patients with as few Gemini requests as the token budgets allow.
+
+    Cached analyses are reused. The rest are packed into batches by pack_analysis_batches
+    under anonymous ids (no emails reach the model). Each batch is one structured-output
+    request, and the per-patient entries are validated and mapped back to their emails.
+    Patients missing from a failed or partial batch fall back to analyze_metrics_with_gemini.
+    """
+    results: Dict[str, Optional[Dict[str, Any]]] = {}
+    emails_by_id: Dict[str, str] = {}
+    blocks: Dict[str, str] = {}
+    fingerprints: Dict[str, str] = {}
+    for email, metrics in metrics_by_email.items():
+        if not metrics:
+            results[email] = None
+            continue
+        fingerprint = metrics_fingerprint(email, metrics)
+        cached = analysis_cache.get(fingerprint)
+        if cached is not None:
+            results[email] = cached
+            continue
+        patient_id = f"p{len(blocks) + 1}"
+        emails_by_id[patient_id] = email
+        blocks[patient_id] = format_metrics_summary(metrics)
+        fingerprints[patient_id] = fingerprint
+
+    if not blocks:
+        return results
+
+    batches = pack_analysis_batches(blocks)
+    print(f"[ALERTS] Batch analysis: {len(blocks)} patient(s) in {len(batches)} request(s), {len(results)} from cache")
+    batch_results = await asyncio.gather(*(_analyze_batch(batch, blocks) for batch in batches))
+
+    fallback = []
+    for batch, analyses in zip(batches, batch_results):
+        for patient_id in batch:
+            analysis = analyses.get(patient_id)
+            if analysis is None:
+                fallback.append(patient_id)
+                continue
+            analysis_cache.put(fingerprints[patient_id], analysis)
+            results[emails_by_id[patient_id]] = analysis
+
+    if fallback:
+        print(f"[ALERTS] Falling back to single-patient analysis for {len(fallback)} patient(s)")
+        singles = await asyncio.gather(*(
+            analyze_metrics_with_gemini(emails_by_id[pid], metrics_by_email[emails_by_id[pid]]) for pid in fallback
+        ))
+        for patient_id, analysis in zip(fallback, singles):
+            results[emails_by_id[patient_id]] = analysis
+    return results
+
+
+async def get_patient_id(email: str) -> Optional[str]:
+    print(f"[GET_PATIENT_ID] Looking up ID for email: {email}")
+    patient_id = await identity_directory.get_user_id(email)
+    if patient_id:
+        print(f"[GET_PATIENT_ID] Found patient ID: {patient_id}")
+    else:
+        print(f"[GET_PATIENT_ID] No user found for {email}")
+    return patient_id
 
 
 async def get_patient_doctor(patient_id: str) -> Optional[str]:
     try:
-        response = supabase.table("patient_doctor_links").select("doctor_id").eq("patient_id", patient_id).eq("status", "active").single().execute()
-        return response.data["doctor_id"] if response.data else None
+        return (await care_context.get(patient_id))["doctor_id"]
     except Exception as e:
         print(f"Error fetching doctor for patient {patient_id}: {e}")
         return None
@@ -256,7 +524,7 @@ async def create_alert(
         print(f"[CREATE_ALERT] Severity: {severity}")
         print(f"[CREATE_ALERT] Alert data: {alert_data}")
         
-        response = supabase_admin.table("alerts").insert(alert_data).execute()
+        response = await db_execute(supabase_admin.table("alerts").insert(alert_data))
         
         print(f"[CREATE_ALERT] Response type: {type(response)}")
         print(f"[CREATE_ALERT] Response status: {response}")
@@ -282,18 +550,31 @@ async def create_alert(
         return False
 
 
-async def process_alerts_for_user(email: str) -> None:
+async def process_alerts_for_user(
+    email: str,
+    metrics: Optional[List[Dict[str, Any]]] = None,
+    prescreen: bool = True,
+    analysis: Optional[Dict[str, Any]] = None
+) -> None:
     try:
         print(f"Processing alerts for {email}...")
         
-        metrics = await fetch_user_health_metrics(email)
+        if metrics is None:
+            metrics = await fetch_user_health_metrics(email)
         if not metrics:
             print(f"No metrics found for {email}")
             return
         
+        if prescreen:
+            decision = alert_prescreen.screen(email, metrics)
+            if not decision["escalate"]:
+                print(f"[PRESCREEN] Skipping {email}: {'; '.join(decision['reasons'])}")
+                return
+        
         print(f"Found {len(metrics)} metrics for {email}")
         
-        analysis = await analyze_metrics_with_gemini(email, metrics)
+        if analysis is None:
+            analysis = await analyze_metrics_with_gemini(email, metrics)
         if not analysis:
             print(f"Failed to analyze metrics for {email}")
             return
@@ -350,33 +631,7 @@ async def process_alerts_for_user(email: str) -> None:
 
 async def get_all_user_emails() -> List[str]:
     try:
-        supabase_url = os.getenv("SUPABASE_URL")
-        service_key = os.getenv("SUPABASE_SERVICE_KEY", os.getenv("SUPABASE_KEY"))
-        
-        emails = []
-        page = 1
-        
-        async with httpx.AsyncClient() as client:
-            while True:
-                response = await client.get(
-                    f"{supabase_url}/auth/v1/admin/users",
-                    headers={
-                        "Authorization": f"Bearer {service_key}",
-                        "apikey": service_key
-                    },
-                    params={"page": page, "per_page": 100}
-                )
-                if response.status_code == 200:
-                    data = response.json()
-                    users = data.get("users", [])
-                    if not users:
-                        break
-                    emails.extend([user["email"] for user in users if user.get("email")])
-                    page += 1
-                else:
-                    break
-        
-        return emails
+        return await identity_directory.all_emails()
     except Exception as e:
         print(f"Error fetching user emails: {e}")
         return []
@@ -474,7 +729,34 @@ async def run_hourly_alert_check() -> None:
     emails = await get_all_user_emails()
     print(f"Found {len(emails)} users to check")
     
+    metrics_by_email: Dict[str, List[Dict[str, Any]]] = {}
+    for i in range(0, len(emails), ALERT_METRICS_BATCH_SIZE):
+        metrics_by_email.update(await fetch_health_metrics_batch(emails[i:i + ALERT_METRICS_BATCH_SIZE]))
+    
+    # Users whose metrics were prefetched are screened here, so only escalated ones are fanned out;
+    # the rest fetch and screen inside process_alerts_for_user
+    candidates = []
     for email in emails:
-        await process_alerts_for_user(email)
+        metrics = metrics_by_email.get(email)
+        if metrics is None:
+            candidates.append(email)
+        elif metrics and alert_prescreen.screen(email, metrics)["escalate"]:
+            candidates.append(email)
+    print(f"[PRESCREEN] {len(candidates)}/{len(emails)} users need LLM analysis")
+    
+    analyses = await analyze_metrics_batch({email: metrics_by_email[email] for email in candidates if email in metrics_by_email})
+    # Prefetched users whose batch and single-patient analysis both failed are not retried here
+    candidates = [email for email in candidates if email not in metrics_by_email or analyses.get(email)]
+    
+    await run_fanout(
+        "hourly_alert_check",
+        candidates,
+        lambda email: process_alerts_for_user(
+            email,
+            metrics_by_email.get(email),
+            prescreen=email not in metrics_by_email,
+            analysis=analyses.get(email)
+        )
+    )
     
     print(f"Hourly alert check completed at {datetime.now(timezone.utc)}")
@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import math
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from services.normal_ranges import LLM_NORMAL_RANGES, as_percent, range_band
+
+ANALYSIS_CACHE_TTL_SECONDS = int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", "10800"))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "5000"))
+
+# Bucket width per metric: a change smaller than this does not change the clinical reading.
+# Ranged metrics' steps must divide their LLM_NORMAL_RANGES width.
+FINGERPRINT_STEPS: Dict[str, float] = {
+    "heart_rate": 5.0,
+    "resting_heart_rate": 5.0,
+    "respiratory_rate": 2.0,
+    "heart_rate_variability": 10.0,
+    "blood_oxygen_saturation": 1.0,
+    "active_energy": 50.0,
+    "apple_sleeping_wrist_temperature": 0.2,
+}
+# Fields of each metric that go into the analysis prompt
+FINGERPRINT_FIELDS = ("last_hour_current", "last_hour_avg", "today_avg")
+
+
+def quantize(metric_name: str, value: Any) -> Optional[float]:
+    """Lower edge of the bucket holding ``value``.
+
+    Buckets of ranged metrics start at the range's low bound, so no bucket straddles a
+    bound of LLM_NORMAL_RANGES (the steps divide each range width).
+    """
+    if value is None:
+        return None
+    try:
+        value = as_percent(metric_name, float(value))
+    except (TypeError, ValueError):
+        return None
+    step = FINGERPRINT_STEPS.get(metric_name)
+    if step is None:
+        # Unknown metric: two significant figures
+        step = 10 ** (len(str(int(abs(value)))) - 2) if abs(value) >= 10 else 0.1
+        return round(round(value / step) * step, 4)
+    origin = LLM_NORMAL_RANGES[metric_name][1] if metric_name in LLM_NORMAL_RANGES else 0
+    return round(origin + math.floor((value - origin) / step) * step, 4)
+
+
+def _band(metric_name: str, value: Any) -> Optional[str]:
+    try:
+        return range_band(metric_name, as_percent(metric_name, float(value)))
+    except (TypeError, ValueError):
+        return None
+
+
+def metrics_fingerprint(email: str, metrics: List[Dict[str, Any]]) -> str:
+    """Stable hash of one patient's quantized metric summary as analyze_metrics_with_gemini sends it.
+
+    Each value contributes its bucket and its band against LLM_NORMAL_RANGES, so values
+    on either side of a bound, or of its near-limit margin, never share a fingerprint.
+    """
+    summary = sorted(
+        (
+            m.get("metric_name"),
+            [
+                [quantize(m.get("metric_name"), m.get(field)), _band(m.get("metric_name"), m.get(field))]
+                for field in FINGERPRINT_FIELDS
+            ]
+        )
+        for m in metrics
+    )
+    payload = json.dumps([email, summary], separators=(",", ":"), default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class AnalysisCache:
+    """TTL + LRU cache of Gemini analyses keyed by metrics_fingerprint.
+
+    Keys are scoped per patient, so an analysis (which quotes the patient's values) is
+    only reused for the same patient with the same quantized summary. Entries expire after ANALYSIS_CACHE_TTL_SECONDS and the least
+    recently used one is evicted beyond ANALYSIS_CACHE_MAX_ENTRIES.
+    """
+
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    def get(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(fingerprint)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        analysis, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[fingerprint]
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(fingerprint)
+        self.stats["hits"] += 1
+        return analysis
+
+    def put(self, fingerprint: str, analysis: Dict[str, Any]) -> None:
+        self._entries[fingerprint] = (analysis, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(fingerprint)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+            "ttl_seconds": self.ttl_seconds,
+            "max_entries": self.max_entries
+        }
+
+
+analysis_cache = AnalysisCache(ANALYSIS_CACHE_TTL_SECONDS, ANALYSIS_CACHE_MAX_ENTRIES)
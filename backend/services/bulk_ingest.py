@@ -0,0 +1,113 @@
+import os
+import time
+from typing import Any, Dict, List, Optional
+from utils.postgres import get_pool
+
+# Batches at least this large go through binary COPY instead of a PostgREST JSON insert
+BULK_INGEST_MIN_ROWS = int(os.getenv("BULK_INGEST_MIN_ROWS", "500"))
+BULK_INGEST_CHUNK_ROWS = int(os.getenv("BULK_INGEST_CHUNK_ROWS", "5000"))
+
+# Last column differs per table; timestamps stay text so Postgres parses them exactly like PostgREST does
+TABLE_COLUMNS = {
+    "health_realtime": ["email", "metric_name", "timestamp", "value", "source"],
+    "health_aggregated": ["email", "metric_name", "timestamp", "value", "units"],
+}
+
+ingest_stats: Dict[str, Dict[str, float]] = {
+    "copy": {"batches": 0, "rows_offered": 0, "rows_inserted": 0, "duplicates": 0, "seconds": 0.0},
+    "rest": {"batches": 0, "rows_offered": 0, "rows_inserted": 0, "duplicates": 0, "seconds": 0.0},
+}
+
+
+def record_ingest(path: str, offered: int, inserted: int, seconds: float) -> None:
+    stats = ingest_stats[path]
+    stats["batches"] += 1
+    stats["rows_offered"] += offered
+    stats["rows_inserted"] += inserted
+    stats["duplicates"] += max(offered - inserted, 0)
+    stats["seconds"] += seconds
+
+
+def get_ingest_stats() -> Dict[str, Dict[str, Any]]:
+    """Cumulative counters per insert path with rows/sec so COPY and PostgREST can be compared."""
+    result = {}
+    for path, stats in ingest_stats.items():
+        seconds = stats["seconds"]
+        result[path] = {
+            **stats,
+            "rows_per_sec": round(stats["rows_inserted"] / seconds, 1) if seconds else None
+        }
+    return result
+
+
+class PartialCopyError(Exception):
+    """A later COPY chunk failed after earlier chunks committed.
+
+    ``inserted`` rows from the first ``committed_rows`` input rows are in the table; the
+    caller must still account for them (and must not re-insert them through PostgREST).
+    """
+
+    def __init__(self, table: str, inserted: int, committed_rows: int, cause: Exception):
+        super().__init__(f"COPY into {table} failed after {committed_rows} rows: {cause}")
+        self.inserted = inserted
+        self.committed_rows = committed_rows
+
+
+async def copy_insert_rows(table: str, rows: List[Dict[str, Any]]) -> Optional[int]:
+    """Insert rows into a health table with binary COPY, skipping duplicates.
+
+    Rows are copied into a transaction-scoped staging table and moved with one
+    INSERT ... SELECT that drops (email, metric_name, timestamp) pairs already present,
+    both within the batch and in the target table. Returns the number of inserted rows,
+    or None if the pool is unavailable so the caller can fall back to PostgREST. Raises
+    PartialCopyError if a chunk fails after earlier chunks committed.
+    """
+    pool = get_pool()
+    if pool is None or table not in TABLE_COLUMNS:
+        return None
+
+    columns = TABLE_COLUMNS[table]
+    extra = columns[-1]
+    staging = f"_bulk_{table}"
+    inserted = 0
+    committed_rows = 0
+
+    try:
+        for offset in range(0, len(rows), BULK_INGEST_CHUNK_ROWS):
+            chunk = rows[offset:offset + BULK_INGEST_CHUNK_ROWS]
+            records = [
+                (r["email"], r["metric_name"], str(r["timestamp"]), r["value"], r.get(extra))
+                for r in chunk
+            ]
+            started = time.perf_counter()
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute(
+                        f'create temp table {staging} (email text, metric_name text, "timestamp" text, '
+                        f'value double precision, {extra} text) on commit drop'
+                    )
+                    await conn.copy_records_to_table(staging, records=records, columns=columns)
+                    status = await conn.execute(
+                        f'''insert into public.{table} (email, metric_name, "timestamp", value, {extra})
+                            select distinct on (s.email, s.metric_name, s.ts)
+                                   s.email, s.metric_name, s.ts, s.value, s.{extra}
+                              from (select email, metric_name, "timestamp"::timestamptz as ts, value, {extra}
+                                      from {staging}) s
+                             where not exists (
+                                   select 1 from public.{table} t
+                                    where t.email = s.email
+                                      and t.metric_name = s.metric_name
+                                      and t."timestamp" = s.ts)'''
+                    )
+            chunk_inserted = int(status.split()[-1])
+            record_ingest("copy", len(chunk), chunk_inserted, time.perf_counter() - started)
+            inserted += chunk_inserted
+            committed_rows += len(chunk)
+        return inserted
+    except Exception as e:
+        if committed_rows:
+            # Earlier chunks are committed; the PostgREST fallback would re-insert them
+            print(f"[BULK_INGEST] ✗ COPY into {table} failed after {committed_rows} committed rows: {e}")
+            raise PartialCopyError(table, inserted, committed_rows, e)
+        print(f"[BULK_INGEST] ✗ COPY into {table} failed, falling back to PostgREST: {e}")
+        return None
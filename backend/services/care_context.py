@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from utils.supabase_client import supabase_admin
+from utils.db import db_execute
+from utils.postgres import pg_fetch, pg_fetchrow
+from utils.pg_listener import pg_listener
+
+CARE_CONTEXT_TTL_SECONDS = int(os.getenv("CARE_CONTEXT_TTL_SECONDS", "300"))
+# Used while no change notifications are arriving (listener down or DATABASE_URL unset);
+# doctor access checks read these entries, so a revoked link must not linger
+CARE_CONTEXT_UNLISTENED_TTL_SECONDS = int(os.getenv("CARE_CONTEXT_UNLISTENED_TTL_SECONDS", "5"))
+# Emitted by the triggers in database/08_care_context_notify.sql
+CARE_CONTEXT_CHANNEL = "care_context_changed"
+
+
+class CareContextCache:
+    """TTL cache of each patient's care context and each doctor's active patients.
+
+    A patient's context is their latest conversation id, active doctor id and that
+    doctor's display name. Entries expire after CARE_CONTEXT_TTL_SECONDS and are dropped
+    as soon as a change to patient_doctor_links or conversations is announced on
+    CARE_CONTEXT_CHANNEL. Entries loaded while the listener is not connected only live
+    for CARE_CONTEXT_UNLISTENED_TTL_SECONDS. Concurrent misses for the same key share
+    one load.
+    """
+
+    def __init__(self):
+        self._patients: Dict[str, Tuple[Dict[str, Any], float]] = {}
+        self._doctor_patients: Dict[str, Tuple[List[str], float]] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        # Bumped on every invalidation so a load that raced with one is not cached
+        self._generation = 0
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def _ttl(self) -> int:
+        return CARE_CONTEXT_TTL_SECONDS if pg_listener.connected.is_set() else CARE_CONTEXT_UNLISTENED_TTL_SECONDS
+
+    async def _load_once(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._loading.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.ensure_future(loader())
+        self._loading[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self._loading.pop(key, None)
+
+    async def _fetch_patient(self, patient_id: str) -> Dict[str, Any]:
+        row = await pg_fetchrow(
+            """select (select c.id from public.conversations c
+                        where c.patient_id = $1::uuid
+                        order by c.created_at desc limit 1) as conversation_id,
+                      l.doctor_id,
+                      p.full_name as doctor_name
+                 from (select 1) one
+                 left join lateral (select doctor_id from public.patient_doctor_links
+                                     where patient_id = $1::uuid and status = 'active'
+                                     limit 1) l on true
+                 left join public.profiles p on p.id = l.doctor_id""",
+            patient_id
+        )
+        if row is None:
+            conversations = (await db_execute(supabase_admin.table("conversations").select("id").eq("patient_id", patient_id).order("created_at", desc=True).limit(1))).data
+            links = (await db_execute(supabase_admin.table("patient_doctor_links").select("doctor_id").eq("patient_id", patient_id).eq("status", "active").limit(1))).data
+            doctor_id = links[0]["doctor_id"] if links else None
+            doctor_name = None
+            if doctor_id:
+                profiles = (await db_execute(supabase_admin.table("profiles").select("full_name").eq("id", doctor_id).limit(1))).data
+                doctor_name = profiles[0].get("full_name") if profiles else None
+            row = {
+                "conversation_id": conversations[0]["id"] if conversations else None,
+                "doctor_id": doctor_id,
+                "doctor_name": doctor_name
+            }
+        return {
+            "conversation_id": row.get("conversation_id"),
+            "doctor_id": row.get("doctor_id"),
+            "doctor_name": row.get("doctor_name") or "Doctor"
+        }
+
+    async def _fetch_doctor_patients(self, doctor_id: str) -> List[str]:
+        rows = await pg_fetch(
+            "select patient_id from public.patient_doctor_links where doctor_id = $1::uuid and status = 'active'",
+            doctor_id
+        )
+        if rows is None:
+            rows = (await db_execute(supabase_admin.table("patient_doctor_links").select("patient_id").eq("doctor_id", doctor_id).eq("status", "active"))).data or []
+        return [r["patient_id"] for r in rows]
+
+    async def get(self, patient_id: str) -> Dict[str, Any]:
+        """Care context for a patient; missing parts are None (doctor_name defaults to "Doctor")."""
+        entry = self._patients.get(patient_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self.stats["hits"] += 1
+            return entry[0]
+        self.stats["misses"] += 1
+        generation = self._generation
+        context = await self._load_once(f"patient:{patient_id}", lambda: self._fetch_patient(patient_id))
+        if generation == self._generation:
+            self._patients[patient_id] = (context, time.monotonic() + self._ttl())
+        return context
+
+    async def get_doctor_patients(self, doctor_id: str) -> List[str]:
+        """Ids of the doctor's actively linked patients."""
+        entry = self._doctor_patients.get(doctor_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self.stats["hits"] += 1
+            return entry[0]
+        self.stats["misses"] += 1
+        generation = self._generation
+        patient_ids = await self._load_once(f"doctor:{doctor_id}", lambda: self._fetch_doctor_patients(doctor_id))
+        if generation == self._generation:
+            self._doctor_patients[doctor_id] = (patient_ids, time.monotonic() + self._ttl())
+        return patient_ids
+
+    async def is_linked(self, doctor_id: str, patient_id: str) -> bool:
+        return patient_id in await self.get_doctor_patients(doctor_id)
+
+    def invalidate(self, patient_id: Optional[str] = None, doctor_id: Optional[str] = None) -> None:
+        self.stats["invalidations"] += 1
+        self._generation += 1
+        if patient_id:
+            self._patients.pop(patient_id, None)
+        if doctor_id:
+            self._doctor_patients.pop(doctor_id, None)
+
+    def clear(self) -> None:
+        self.stats["invalidations"] += 1
+        self._generation += 1
+        self._patients.clear()
+        self._doctor_patients.clear()
+
+    def _on_notify(self, channel: str, payload: str) -> None:
+        try:
+            change = json.loads(payload)
+        except (TypeError, ValueError):
+            self.clear()
+            return
+        self.invalidate(change.get("patient_id"), change.get("doctor_id"))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "patients": len(self._patients), "doctors": len(self._doctor_patients)}
+
+
+care_context = CareContextCache()
+pg_listener.add(CARE_CONTEXT_CHANNEL, care_context._on_notify)
+# Changes made before the listener (re)connected were never announced
+pg_listener.on_reconnect(care_context.clear)
@@ -0,0 +1,167 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from services.emergency import evaluate_vitals
+from utils.tracing import tracer
+
+# Quiet period after the last insert before a user's vitals are evaluated
+EMERGENCY_DEBOUNCE_SECONDS = float(os.getenv("EMERGENCY_DEBOUNCE_SECONDS", "2"))
+# Hard cap on how long an insert can wait for its evaluation, regardless of new inserts or holds
+EMERGENCY_MAX_DELAY_SECONDS = float(os.getenv("EMERGENCY_MAX_DELAY_SECONDS", "10"))
+# Ingest traces linked from one evaluation's trace
+MAX_LINKED_TRACES = 20
+
+
+class _PendingCheck:
+    def __init__(self, now: float):
+        self.first_seen = now
+        self.last_seen = now
+        self.requests = 1
+        self.due = False
+        self.wakeup = asyncio.Event()
+        # Wall-clock arrival of the earliest request behind this check, for detection latency
+        self.arrived_at = time.time()
+        self.links: List[str] = []
+        # Resolved with the evaluation's result, for queue jobs routed onto this check
+        self.outcome = asyncio.get_running_loop().create_future()
+
+    def link_current_trace(self) -> None:
+        span = tracer.current_span()
+        if span is None:
+            return
+        self.arrived_at = min(self.arrived_at, span.trace.root.started_at)
+        if len(self.links) < MAX_LINKED_TRACES and span.trace.trace_id not in self.links:
+            self.links.append(span.trace.trace_id)
+
+
+class EmergencyCheckScheduler:
+    """Coalesces emergency checks per email so a burst of inserts runs one vitals evaluation."""
+
+    def __init__(self, debounce_seconds: float, max_delay_seconds: float):
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._pending: Dict[str, _PendingCheck] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._holds: Dict[str, int] = {}
+        self.stats = {"scheduled": 0, "urgent": 0, "evaluations": 0, "errors": 0}
+
+    def schedule(self, email: str, urgent: bool = False) -> None:
+        """Request an evaluation for ``email``; repeated calls inside the window are merged.
+
+        ``urgent`` skips the debounce and any hold, for inserts that carried an abnormal vital.
+        """
+        now = time.monotonic()
+        self.stats["scheduled"] += 1
+        pending = self._pending.get(email)
+        if pending is None:
+            pending = self._pending[email] = _PendingCheck(now)
+        else:
+            pending.last_seen = now
+            pending.requests += 1
+        pending.link_current_trace()
+        if urgent:
+            self.stats["urgent"] += 1
+            pending.due = True
+        pending.wakeup.set()
+
+        if email not in self._tasks:
+            self._tasks[email] = asyncio.ensure_future(self._run(email))
+
+    def pending_evaluation(self, email: str) -> Optional[asyncio.Future]:
+        """Outcome of the evaluation still waiting on debounce or a hold for ``email``, if any.
+
+        The queue awaits this instead of evaluating mid-request, so inserts from one
+        request still produce a single evaluation.
+        """
+        pending = self._pending.get(email)
+        return pending.outcome if pending is not None else None
+
+    @asynccontextmanager
+    async def hold(self, email: str):
+        """Defer evaluation for ``email`` until the block exits (still bounded by the max delay)."""
+        self._holds[email] = self._holds.get(email, 0) + 1
+        try:
+            yield
+        finally:
+            remaining = self._holds[email] - 1
+            if remaining:
+                self._holds[email] = remaining
+            else:
+                del self._holds[email]
+            pending = self._pending.get(email)
+            if pending is not None:
+                pending.wakeup.set()
+
+    def _deadline(self, email: str, pending: _PendingCheck) -> float:
+        if pending.due:
+            return pending.first_seen
+        hard_deadline = pending.first_seen + self.max_delay_seconds
+        if self._holds.get(email):
+            return hard_deadline
+        return min(pending.last_seen + self.debounce_seconds, hard_deadline)
+
+    async def _run(self, email: str) -> None:
+        try:
+            # Inserts that land while an evaluation is running open a new pending window
+            while email in self._pending:
+                pending = self._pending[email]
+                while True:
+                    remaining = self._deadline(email, pending) - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    pending.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(pending.wakeup.wait(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        pass
+
+                del self._pending[email]
+                await self._evaluate(email, pending)
+        finally:
+            self._tasks.pop(email, None)
+
+    async def _evaluate(self, email: str, pending: _PendingCheck) -> None:
+        waited = time.monotonic() - pending.first_seen
+        print(f"[EMERGENCY_SCHEDULER] Evaluating {email} ({pending.requests} coalesced request(s), waited {waited:.2f}s)")
+        self.stats["evaluations"] += 1
+        try:
+            with tracer.span(
+                "evaluate",
+                new_trace=True,
+                email=email,
+                coalesced=pending.requests,
+                waited_ms=round(waited * 1000, 3),
+                links=pending.links
+            ) as span:
+                result = await evaluate_vitals(email)
+                if result:
+                    latency = tracer.record_detection(pending.arrived_at, email)
+                    span.set(emergency_created=True, detection_ms=round(latency * 1000, 3))
+            print(f"[EMERGENCY_SCHEDULER] Emergency check result for {email}: {result}")
+            pending.outcome.set_result(result)
+        except Exception as e:
+            pending.outcome.set_exception(e)
+            # Retrieved here so an outcome nobody routed onto is not reported as unhandled
+            pending.outcome.exception()
+            self.stats["errors"] += 1
+            print(f"[EMERGENCY_SCHEDULER] Error in emergency check for {email}: {e}")
+            import traceback
+            traceback.print_exc()
+
+    async def flush(self) -> None:
+        """Run every pending evaluation now; used on shutdown so queued checks are not lost."""
+        for pending in self._pending.values():
+            pending.due = True
+            pending.wakeup.set()
+        tasks = list(self._tasks.values())
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+emergency_scheduler = EmergencyCheckScheduler(EMERGENCY_DEBOUNCE_SECONDS, EMERGENCY_MAX_DELAY_SECONDS)
+
+
+def schedule_emergency_check(email: str, urgent: bool = False) -> None:
+    emergency_scheduler.schedule(email, urgent)
@@ -0,0 +1,112 @@
+import os
+import time
+import asyncio
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional
+from utils.rate_limit import fanout_active, rate_limit_stats
+
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "20"))
+FANOUT_JOB_TIMEOUT_SECONDS = float(os.getenv("FANOUT_JOB_TIMEOUT_SECONDS", "60"))
+FANOUT_HISTORY = int(os.getenv("FANOUT_HISTORY", "20"))
+
+
+def _percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(int(q * len(sorted_values)), len(sorted_values) - 1)
+    return round(sorted_values[index], 3)
+
+
+class FanoutRun:
+    """Progress counters for one fan-out run."""
+
+    def __init__(self, name: str, total: int, concurrency: int):
+        self.name = name
+        self.total = total
+        self.concurrency = concurrency
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self.durations: List[float] = []
+        self.counters = {"done": 0, "succeeded": 0, "positive": 0, "failed": 0, "timed_out": 0, "in_flight": 0}
+
+    def summary(self) -> Dict[str, Any]:
+        durations = sorted(self.durations)
+        return {
+            "name": self.name,
+            "started_at": self.started_at.isoformat(),
+            "total": self.total,
+            "concurrency": self.concurrency,
+            **self.counters,
+            "seconds": round(time.perf_counter() - self._started, 3),
+            "p50_seconds": _percentile(durations, 0.5),
+            "p99_seconds": _percentile(durations, 0.99)
+        }
+
+
+_active_runs: Dict[str, FanoutRun] = {}
+_finished_runs: Deque[Dict[str, Any]] = deque(maxlen=FANOUT_HISTORY)
+
+
+async def run_fanout(
+    name: str,
+    items: Iterable[Any],
+    job: Callable[[Any], Awaitable[Any]],
+    concurrency: Optional[int] = None,
+    timeout: Optional[float] = None
+) -> Dict[str, Any]:
+    """Run ``job`` for every item with at most ``concurrency`` in flight and a per-item timeout.
+
+    Jobs run with upstream throttling enabled (see utils.rate_limit.throttle), so DB,
+    GoTrue and Gemini calls made inside them share per-upstream token buckets. A job
+    that raises or times out is counted and the run carries on. Truthy job results are
+    counted as "positive". Returns the run summary.
+    """
+    items = list(items)
+    concurrency = concurrency or FANOUT_CONCURRENCY
+    timeout = timeout or FANOUT_JOB_TIMEOUT_SECONDS
+    run = FanoutRun(name, len(items), concurrency)
+    _active_runs[name] = run
+    pending = iter(items)
+    report_every = max(len(items) // 10, 1)
+    print(f"[FANOUT] {name}: {len(items)} jobs, concurrency {concurrency}, timeout {timeout:g}s")
+
+    async def worker() -> None:
+        fanout_active.set(True)
+        for item in pending:
+            run.counters["in_flight"] += 1
+            started = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(job(item), timeout=timeout)
+                run.counters["succeeded"] += 1
+                if result:
+                    run.counters["positive"] += 1
+            except asyncio.TimeoutError:
+                run.counters["timed_out"] += 1
+                print(f"[FANOUT] {name}: job for {item} timed out after {timeout:g}s")
+            except Exception as e:
+                run.counters["failed"] += 1
+                print(f"[FANOUT] {name}: job for {item} failed: {e}")
+            finally:
+                run.durations.append(time.perf_counter() - started)
+                run.counters["in_flight"] -= 1
+                run.counters["done"] += 1
+                if run.counters["done"] % report_every == 0:
+                    print(f"[FANOUT] {name}: {run.counters['done']}/{run.total} done")
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(items)) or 1)))
+    finally:
+        _active_runs.pop(name, None)
+        summary = run.summary()
+        _finished_runs.appendleft(summary)
+    print(f"[FANOUT] ✓ {name} finished: {summary}")
+    return summary
+
+
+def fanout_stats() -> Dict[str, Any]:
+    return {
+        "active": [run.summary() for run in _active_runs.values()],
+        "recent": list(_finished_runs),
+        "rate_limits": rate_limit_stats()
+    }
@@ -0,0 +1,107 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Tuple
+import numpy as np
+from utils.supabase_client import supabase_admin
+from utils.db import db_execute
+from utils.postgres import pg_fetch
+from services.emergency import VITAL_THRESHOLDS, check_vitals_and_trigger_emergency
+from services.fanout import run_fanout
+
+# "batch" evaluates the whole fleet with set-based queries; "per_user" keeps the original loop
+EMERGENCY_SWEEP_MODE = os.getenv("EMERGENCY_SWEEP_MODE", "batch").lower()
+FLEET_SWEEP_PAGE_SIZE = int(os.getenv("FLEET_SWEEP_PAGE_SIZE", "1000"))
+
+METRIC_NAMES = list(VITAL_THRESHOLDS)
+# Threshold arrays indexed like METRIC_NAMES; a missing bound never breaches
+THRESHOLD_MIN = np.array([t["min"] if t.get("min") is not None else -np.inf for t in VITAL_THRESHOLDS.values()])
+THRESHOLD_MAX = np.array([t["max"] if t.get("max") is not None else np.inf for t in VITAL_THRESHOLDS.values()])
+
+
+async def fetch_fleet_extremes(since: datetime) -> List[Dict[str, Any]]:
+    """Min/max of every threshold-relevant metric per user since ``since``.
+
+    On the pool this is a single grouped query over both health tables; through PostgREST
+    the raw rows are paged and reduced here instead.
+    """
+    rows = await pg_fetch(
+        """select email, metric_name, min(value) as min_value, max(value) as max_value
+             from (select email, metric_name, value from public.health_realtime
+                    where "timestamp" >= $1 and metric_name = any($2::text[])
+                   union all
+                   select email, metric_name, value from public.health_aggregated
+                    where "timestamp" >= $1 and metric_name = any($2::text[])) v
+            group by email, metric_name""",
+        since, METRIC_NAMES
+    )
+    if rows is not None:
+        return rows
+
+    extremes: Dict[Tuple[str, str], List[float]] = {}
+    for table in ("health_realtime", "health_aggregated"):
+        offset = 0
+        while True:
+            page = (await db_execute(
+                supabase_admin.table(table)
+                .select("email,metric_name,value")
+                .in_("metric_name", METRIC_NAMES)
+                .gte("timestamp", since.isoformat())
+                .order("id")
+                .range(offset, offset + FLEET_SWEEP_PAGE_SIZE - 1)
+            )).data or []
+            for r in page:
+                if r.get("value") is None:
+                    continue
+                value = float(r["value"])
+                bounds = extremes.get((r["email"], r["metric_name"]))
+                if bounds is None:
+                    extremes[(r["email"], r["metric_name"])] = [value, value]
+                else:
+                    bounds[0] = min(bounds[0], value)
+                    bounds[1] = max(bounds[1], value)
+            if len(page) < FLEET_SWEEP_PAGE_SIZE:
+                break
+            offset += FLEET_SWEEP_PAGE_SIZE
+
+    return [
+        {"email": email, "metric_name": metric_name, "min_value": bounds[0], "max_value": bounds[1]}
+        for (email, metric_name), bounds in extremes.items()
+    ]
+
+
+def find_breaching_emails(extremes: List[Dict[str, Any]]) -> List[str]:
+    """Emails with at least one metric outside VITAL_THRESHOLDS, checked for all users at once."""
+    if not extremes:
+        return []
+    metric_index = {name: i for i, name in enumerate(METRIC_NAMES)}
+    idx = np.fromiter((metric_index[r["metric_name"]] for r in extremes), dtype=np.intp, count=len(extremes))
+    mins = np.fromiter((float(r["min_value"]) for r in extremes), dtype=np.float64, count=len(extremes))
+    maxs = np.fromiter((float(r["max_value"]) for r in extremes), dtype=np.float64, count=len(extremes))
+
+    breach = (mins < THRESHOLD_MIN[idx]) | (maxs > THRESHOLD_MAX[idx])
+    emails = np.array([r["email"] for r in extremes], dtype=object)
+    return sorted(set(emails[breach]))
+
+
+async def run_fleet_emergency_sweep() -> Dict[str, Any]:
+    """Evaluate every user's last hour in bulk and run the full check only for users that breach."""
+    started = time.perf_counter()
+    since = datetime.now(timezone.utc) - timedelta(hours=1)
+
+    extremes = await fetch_fleet_extremes(since)
+    breaching = find_breaching_emails(extremes)
+    users = len({r["email"] for r in extremes})
+    print(f"[FLEET_SWEEP] {users} users with vitals in the last hour, {len(breaching)} breaching thresholds")
+
+    run = await run_fanout("fleet_emergency_sweep", breaching, check_vitals_and_trigger_emergency)
+    triggered = run["positive"]
+
+    summary = {
+        "users_with_vitals": users,
+        "breaching": len(breaching),
+        "triggered": triggered,
+        "seconds": round(time.perf_counter() - started, 3)
+    }
+    print(f"[FLEET_SWEEP] ✓ Sweep finished: {summary}")
+    return summary
@@ -1,12 +1,17 @@
 import os
-import httpx
+import time
 from typing import List, Optional, Dict
 from datetime import datetime, timedelta
 from pydantic import BaseModel
 from utils.supabase_client import supabase
-from services.emergency import check_vitals_and_trigger_emergency
+from utils.db import db_execute
+from utils.http_clients import get_http_client
+from utils.tracing import tracer
+from services.emergency import vitals_window
+from services.emergency_scheduler import schedule_emergency_check
+from services.queue_wakeup import queue_wakeup
+from services.bulk_ingest import copy_insert_rows, record_ingest, PartialCopyError, BULK_INGEST_MIN_ROWS
 
-HEALTH_API_BASE = os.getenv("HEALTH_API_BASE", "http://127.0.0.1:9876/api")
 HEALTH_API_TOKEN = os.getenv("HEALTH_API_TOKEN")
 
 class HealthSample(BaseModel):
@@ -21,16 +26,16 @@ async def fetch_metric(endpoint: str, params: dict, units: Optional[str] = None)
         if HEALTH_API_TOKEN:
             headers["Authorization"] = f"Bearer {HEALTH_API_TOKEN}"
             
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{HEALTH_API_BASE}{endpoint}", params=params, headers=headers)
-            if response.status_code == 200:
-                data = response.json()
-                # Assuming the response is a list of samples or an object with a 'data' field
-                samples = data if isinstance(data, list) else data.get("data", [])
-                return samples
-            else:
-                print(f"Failed to fetch metric from {endpoint}: {response.status_code}")
-                return []
+        client = get_http_client("health_api")
+        response = await client.get(endpoint, params=params, headers=headers)
+        if response.status_code == 200:
+            data = response.json()
+            # Assuming the response is a list of samples or an object with a 'data' field
+            samples = data if isinstance(data, list) else data.get("data", [])
+            return samples
+        else:
+            print(f"Failed to fetch metric from {endpoint}: {response.status_code}")
+            return []
     except Exception as e:
         print(f"Error fetching metric from {endpoint}: {e}")
         return []
@@ -73,41 +78,62 @@ async def insert_realtime_data(email: str, metric_name: str, samples: List[dict]
     if not samples:
         return 0
     
-    rows = []
-    for s in samples:
-        normalized = normalize_sample(s)
-        if normalized:
-            rows.append({
-                "email": email,
-                "metric_name": metric_name,
-                "timestamp": normalized["timestamp"],
-                "value": normalized["value"],
-                "source": normalized["source"]
-            })
+    with tracer.span("normalize", table="health_realtime", metric=metric_name, samples=len(samples)) as span:
+        rows = []
+        for s in samples:
+            normalized = normalize_sample(s)
+            if normalized:
+                rows.append({
+                    "email": email,
+                    "metric_name": metric_name,
+                    "timestamp": normalized["timestamp"],
+                    "value": normalized["value"],
+                    "source": normalized["source"]
+                })
+        span.set(rows=len(rows))
     
     if not rows:
         return 0
 
     try:
-        # Switching to plain insert to avoid ON CONFLICT errors
-        print(f"\n[HEALTH_REALTIME] Inserting {len(rows)} records for {email}")
-        print(f"[HEALTH_REALTIME] Metric: {metric_name}")
-        for i, row in enumerate(rows):
-            print(f"[HEALTH_REALTIME]   [{i+1}] value={row['value']}, timestamp={row['timestamp']}")
+        with tracer.span("insert", table="health_realtime", metric=metric_name, rows=len(rows)) as span:
+            inserted = None
+            if len(rows) >= BULK_INGEST_MIN_ROWS:
+                try:
+                    inserted = await copy_insert_rows("health_realtime", rows)
+                except PartialCopyError as e:
+                    # Keep going with the committed rows so they are counted and checked
+                    print(f"[HEALTH_REALTIME] ⚠ Only {e.committed_rows}/{len(rows)} {metric_name} records for {email} were written: {e}")
+                    rows = rows[:e.committed_rows]
+                    inserted = e.inserted
+                    span.set(partial=True)
+                if inserted is not None:
+                    span.set(path="copy")
+                    print(f"[HEALTH_REALTIME] ✓ COPY inserted {inserted}/{len(rows)} {metric_name} records for {email} ({len(rows) - inserted} duplicates skipped)")
         
-        response = supabase.table("health_realtime").insert(rows).execute()
-        inserted = len(response.data) if response.data else 0
-        print(f"[HEALTH_REALTIME] ✓ Successfully inserted {inserted} records")
+            if inserted is None:
+                span.set(path="rest")
+                # Switching to plain insert to avoid ON CONFLICT errors
+                print(f"\n[HEALTH_REALTIME] Inserting {len(rows)} records for {email}")
+                print(f"[HEALTH_REALTIME] Metric: {metric_name}")
+                for i, row in enumerate(rows):
+                    print(f"[HEALTH_REALTIME]   [{i+1}] value={row['value']}, timestamp={row['timestamp']}")
+            
+                started = time.perf_counter()
+                response = await db_execute(supabase.table("health_realtime").insert(rows))
+                inserted = len(response.data) if response.data else 0
+                record_ingest("rest", len(rows), inserted, time.perf_counter() - started)
+                print(f"[HEALTH_REALTIME] ✓ Successfully inserted {inserted} records")
+            span.set(inserted=inserted)
         
         if inserted > 0:
-            print(f"[HEALTH_REALTIME] Triggering emergency check for {email}...")
-            try:
-                result = await check_vitals_and_trigger_emergency(email)
-                print(f"[HEALTH_REALTIME] Emergency check result: {result}")
-            except Exception as emerg_e:
-                print(f"[HEALTH_REALTIME] Error in emergency check: {emerg_e}")
-                import traceback
-                traceback.print_exc()
+            abnormal = vitals_window.observe(email, metric_name, rows)
+            if abnormal:
+                print(f"[HEALTH_REALTIME] {abnormal} abnormal {metric_name} sample(s), evaluating {email} now")
+            else:
+                print(f"[HEALTH_REALTIME] Scheduling emergency check for {email}...")
+            schedule_emergency_check(email, urgent=bool(abnormal))
+            queue_wakeup.notify_local(email)
         
         return inserted
     except Exception as e:
@@ -120,41 +146,62 @@ async def insert_aggregated_data(email: str, metric_name: str, samples: List[dic
     if not samples:
         return 0
     
-    rows = []
-    for s in samples:
-        normalized = normalize_sample(s, units)
-        if normalized:
-            rows.append({
-                "email": email,
-                "metric_name": metric_name,
-                "timestamp": normalized["timestamp"],
-                "value": normalized["value"],
-                "units": normalized["units"]
-            })
+    with tracer.span("normalize", table="health_aggregated", metric=metric_name, samples=len(samples)) as span:
+        rows = []
+        for s in samples:
+            normalized = normalize_sample(s, units)
+            if normalized:
+                rows.append({
+                    "email": email,
+                    "metric_name": metric_name,
+                    "timestamp": normalized["timestamp"],
+                    "value": normalized["value"],
+                    "units": normalized["units"]
+                })
+        span.set(rows=len(rows))
     
     if not rows:
         return 0
 
     try:
-        # Switching to plain insert to avoid ON CONFLICT errors
-        print(f"\n[HEALTH_AGGREGATED] Inserting {len(rows)} records for {email}")
-        print(f"[HEALTH_AGGREGATED] Metric: {metric_name}")
-        for i, row in enumerate(rows):
-            print(f"[HEALTH_AGGREGATED]   [{i+1}] value={row['value']}, timestamp={row['timestamp']}, units={row.get('units')}")
+        with tracer.span("insert", table="health_aggregated", metric=metric_name, rows=len(rows)) as span:
+            inserted = None
+            if len(rows) >= BULK_INGEST_MIN_ROWS:
+                try:
+                    inserted = await copy_insert_rows("health_aggregated", rows)
+                except PartialCopyError as e:
+                    # Keep going with the committed rows so they are counted and checked
+                    print(f"[HEALTH_AGGREGATED] ⚠ Only {e.committed_rows}/{len(rows)} {metric_name} records for {email} were written: {e}")
+                    rows = rows[:e.committed_rows]
+                    inserted = e.inserted
+                    span.set(partial=True)
+                if inserted is not None:
+                    span.set(path="copy")
+                    print(f"[HEALTH_AGGREGATED] ✓ COPY inserted {inserted}/{len(rows)} {metric_name} records for {email} ({len(rows) - inserted} duplicates skipped)")
         
-        response = supabase.table("health_aggregated").insert(rows).execute()
-        inserted = len(response.data) if response.data else 0
-        print(f"[HEALTH_AGGREGATED] ✓ Successfully inserted {inserted} records")
+            if inserted is None:
+                span.set(path="rest")
+                # Switching to plain insert to avoid ON CONFLICT errors
+                print(f"\n[HEALTH_AGGREGATED] Inserting {len(rows)} records for {email}")
+                print(f"[HEALTH_AGGREGATED] Metric: {metric_name}")
+                for i, row in enumerate(rows):
+                    print(f"[HEALTH_AGGREGATED]   [{i+1}] value={row['value']}, timestamp={row['timestamp']}, units={row.get('units')}")
+            
+                started = time.perf_counter()
+                response = await db_execute(supabase.table("health_aggregated").insert(rows))
+                inserted = len(response.data) if response.data else 0
+                record_ingest("rest", len(rows), inserted, time.perf_counter() - started)
+                print(f"[HEALTH_AGGREGATED] ✓ Successfully inserted {inserted} records")
+            span.set(inserted=inserted)
         
         if inserted > 0:
-            print(f"[HEALTH_AGGREGATED] Triggering emergency check for {email}...")
-            try:
-                result = await check_vitals_and_trigger_emergency(email)
-                print(f"[HEALTH_AGGREGATED] Emergency check result: {result}")
-            except Exception as emerg_e:
-                print(f"[HEALTH_AGGREGATED] Error in emergency check: {emerg_e}")
-                import traceback
-                traceback.print_exc()
+            abnormal = vitals_window.observe(email, metric_name, rows)
+            if abnormal:
+                print(f"[HEALTH_AGGREGATED] {abnormal} abnormal {metric_name} sample(s), evaluating {email} now")
+            else:
+                print(f"[HEALTH_AGGREGATED] Scheduling emergency check for {email}...")
+            schedule_emergency_check(email, urgent=bool(abnormal))
+            queue_wakeup.notify_local(email)
         
         return inserted
     except Exception as e:
@@ -197,7 +244,7 @@ async def upsert_sleep_data(email: str, samples: List[dict]):
         return 0
 
     try:
-        response = supabase.table("sleep_analysis").insert(rows).execute()
+        response = await db_execute(supabase.table("sleep_analysis").insert(rows))
         return len(response.data)
     except Exception as e:
         # Fallback if table doesn't exist or constraint is different
@@ -0,0 +1,176 @@
+import os
+import time
+import asyncio
+from typing import Dict, List, Optional
+from utils.http_clients import get_http_client
+from utils.rate_limit import throttle
+
+IDENTITY_REFRESH_SECONDS = int(os.getenv("IDENTITY_REFRESH_SECONDS", "600"))
+IDENTITY_NEGATIVE_TTL_SECONDS = int(os.getenv("IDENTITY_NEGATIVE_TTL_SECONDS", "60"))
+IDENTITY_PAGE_SIZE = int(os.getenv("IDENTITY_PAGE_SIZE", "500"))
+# After a failed full refresh, wait this long before trying another one
+IDENTITY_RETRY_SECONDS = int(os.getenv("IDENTITY_RETRY_SECONDS", "30"))
+
+
+def _admin_headers() -> Dict[str, str]:
+    service_key = os.getenv("SUPABASE_SERVICE_KEY", os.getenv("SUPABASE_KEY"))
+    return {
+        "Authorization": f"Bearer {service_key}",
+        "apikey": service_key
+    }
+
+
+class IdentityDirectory:
+    """In-memory email <-> user id index over GoTrue users.
+
+    The full user list is loaded once and refreshed in the background after
+    IDENTITY_REFRESH_SECONDS, so lookups never wait on GoTrue once warm. Ids or emails
+    that are not in the snapshot get one targeted lookup, and misses are remembered
+    for IDENTITY_NEGATIVE_TTL_SECONDS. After a failed refresh, lookups use the targeted
+    path and the next full refresh runs in the background after IDENTITY_RETRY_SECONDS.
+    """
+
+    def __init__(self):
+        self._id_by_email: Dict[str, str] = {}
+        self._email_by_id: Dict[str, str] = {}
+        self._negative: Dict[str, float] = {}
+        self._loaded_at: Optional[float] = None
+        self._failed_at: Optional[float] = None
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.stats = {"hits": 0, "misses": 0, "negative_hits": 0, "refreshes": 0, "refresh_failures": 0}
+
+    def _is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > IDENTITY_REFRESH_SECONDS
+
+    def _backing_off(self) -> bool:
+        return self._failed_at is not None and time.monotonic() - self._failed_at < IDENTITY_RETRY_SECONDS
+
+    def _remember(self, user_id: str, email: str) -> None:
+        self._id_by_email[email.lower()] = user_id
+        self._email_by_id[user_id] = email
+
+    async def refresh(self) -> None:
+        """Reload every user from the GoTrue admin API and swap the index in one step."""
+        async with self._refresh_lock:
+            if self._loaded_at is not None and not self._is_stale():
+                return
+            id_by_email: Dict[str, str] = {}
+            email_by_id: Dict[str, str] = {}
+            page = 1
+            try:
+                client = get_http_client("gotrue")
+                while True:
+                    response = await client.get(
+                        "/admin/users",
+                        headers=_admin_headers(),
+                        params={"page": page, "per_page": IDENTITY_PAGE_SIZE}
+                    )
+                    if response.status_code != 200:
+                        raise Exception(f"GoTrue returned {response.status_code} on page {page}")
+                    users = response.json().get("users", [])
+                    if not users:
+                        break
+                    for user in users:
+                        if user.get("email") and user.get("id"):
+                            id_by_email[user["email"].lower()] = user["id"]
+                            email_by_id[user["id"]] = user["email"]
+                    page += 1
+            except Exception as e:
+                print(f"[IDENTITY] Refresh failed, keeping {len(self._email_by_id)} cached users: {e}")
+                self._failed_at = time.monotonic()
+                self.stats["refresh_failures"] += 1
+                return
+
+            self._id_by_email = id_by_email
+            self._email_by_id = email_by_id
+            self._negative.clear()
+            self._loaded_at = time.monotonic()
+            self._failed_at = None
+            self.stats["refreshes"] += 1
+            print(f"[IDENTITY] ✓ Loaded {len(email_by_id)} users")
+
+    async def _ensure_loaded(self) -> None:
+        if self._loaded_at is None and self._failed_at is None:
+            await self.refresh()
+        elif self._is_stale() and not self._backing_off() and (self._refresh_task is None or self._refresh_task.done()):
+            # Never block a lookup on a retry; misses take the targeted path meanwhile
+            self._refresh_task = asyncio.ensure_future(self.refresh())
+
+    def preload(self) -> None:
+        """Start loading the directory without holding up application startup."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self.refresh())
+
+    def _negative_hit(self, key: str) -> bool:
+        expires_at = self._negative.get(key)
+        if expires_at is None:
+            return False
+        if expires_at <= time.monotonic():
+            del self._negative[key]
+            return False
+        return True
+
+    async def get_user_id(self, email: str) -> Optional[str]:
+        await self._ensure_loaded()
+        key = email.lower()
+        user_id = self._id_by_email.get(key)
+        if user_id:
+            self.stats["hits"] += 1
+            return user_id
+        if self._negative_hit(f"email:{key}"):
+            self.stats["negative_hits"] += 1
+            return None
+
+        self.stats["misses"] += 1
+        await throttle("gotrue")
+        try:
+            response = await get_http_client("gotrue").get("/admin/users", headers=_admin_headers(), params={"query": email})
+            if response.status_code == 200:
+                for user in response.json().get("users", []):
+                    if user.get("email") and user["email"].lower() == key:
+                        self._remember(user["id"], user["email"])
+                        return user["id"]
+        except Exception as e:
+            print(f"[IDENTITY] Lookup failed for {email}: {e}")
+            return None
+
+        self._negative[f"email:{key}"] = time.monotonic() + IDENTITY_NEGATIVE_TTL_SECONDS
+        return None
+
+    async def get_email(self, user_id: str) -> Optional[str]:
+        await self._ensure_loaded()
+        email = self._email_by_id.get(user_id)
+        if email:
+            self.stats["hits"] += 1
+            return email
+        if self._negative_hit(f"id:{user_id}"):
+            self.stats["negative_hits"] += 1
+            return None
+
+        self.stats["misses"] += 1
+        await throttle("gotrue")
+        try:
+            response = await get_http_client("gotrue").get(f"/admin/users/{user_id}", headers=_admin_headers())
+            if response.status_code == 200:
+                email = response.json().get("email")
+                if email:
+                    self._remember(user_id, email)
+                    return email
+            else:
+                print(f"[IDENTITY] Error fetching user {user_id}: {response.status_code}")
+        except Exception as e:
+            print(f"[IDENTITY] Lookup failed for user {user_id}: {e}")
+            return None
+
+        self._negative[f"id:{user_id}"] = time.monotonic() + IDENTITY_NEGATIVE_TTL_SECONDS
+        return None
+
+    async def all_emails(self) -> List[str]:
+        """Every known email, refreshing first if the snapshot is stale."""
+        if self._is_stale() and not self._backing_off():
+            await self.refresh()
+        return list(self._email_by_id.values())
+
+
+identity_directory = IdentityDirectory()
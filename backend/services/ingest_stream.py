@@ -0,0 +1,103 @@
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import ijson
+
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "500"))
+
+METRIC_PREFIX = "data.metrics.item"
+SAMPLE_PREFIX = "data.metrics.item.data.item"
+
+ChunkHandler = Callable[[str, Optional[str], List[dict]], Awaitable[int]]
+
+
+class RequestBodyReader:
+    """Adapts an ASGI body stream to the async ``read`` interface ijson expects."""
+
+    def __init__(self, stream: AsyncIterator[bytes]):
+        self._stream = stream.__aiter__()
+
+    async def read(self, size: int = -1) -> bytes:
+        # ijson probes with read(0) to detect bytes vs str; don't consume a chunk for it
+        if size == 0:
+            return b""
+        while True:
+            try:
+                chunk = await self._stream.__anext__()
+            except StopAsyncIteration:
+                return b""
+            if chunk:
+                return chunk
+
+
+class _MetricState:
+    def __init__(self):
+        self.name: Optional[str] = None
+        self.units: Optional[str] = None
+        self.pending: List[dict] = []
+        self.samples = 0
+
+
+async def stream_health_metrics(
+    stream: AsyncIterator[bytes],
+    on_chunk: ChunkHandler,
+    chunk_size: int = INGEST_CHUNK_SIZE
+) -> Dict[str, Any]:
+    """Parse a Health Auto Export body incrementally and hand samples to ``on_chunk`` in bounded batches.
+
+    Only one chunk of samples per metric is held in memory at a time. Health Auto Export
+    writes ``name`` and ``units`` before ``data``; if a payload orders them the other way,
+    samples are buffered until the name is known.
+    """
+    metric: Optional[_MetricState] = None
+    builder: Optional[ijson.ObjectBuilder] = None
+    metrics_seen = 0
+    samples_seen = 0
+    total_inserted = 0
+
+    async def flush(state: _MetricState) -> None:
+        nonlocal total_inserted
+        if not state.pending or not state.name:
+            return
+        batch = state.pending
+        state.pending = []
+        total_inserted += await on_chunk(state.name, state.units, batch)
+
+    async for prefix, event, value in ijson.parse_async(RequestBodyReader(stream), use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == SAMPLE_PREFIX and event == "end_map":
+                metric.pending.append(builder.value)
+                metric.samples += 1
+                samples_seen += 1
+                builder = None
+                if len(metric.pending) >= chunk_size:
+                    await flush(metric)
+            continue
+
+        if prefix == METRIC_PREFIX:
+            if event == "start_map":
+                metric = _MetricState()
+            elif event == "end_map" and metric is not None:
+                await flush(metric)
+                if metric.pending:
+                    print(f"[INGEST_STREAM] Dropping {len(metric.pending)} samples for metric without a name")
+                if metric.name:
+                    print(f"[INGEST_STREAM] Processed metric: {metric.name} with {metric.samples} samples")
+                metrics_seen += 1
+                metric = None
+        elif metric is not None:
+            if prefix == f"{METRIC_PREFIX}.name" and event == "string":
+                metric.name = value
+                if len(metric.pending) >= chunk_size:
+                    await flush(metric)
+            elif prefix == f"{METRIC_PREFIX}.units" and event == "string":
+                metric.units = value
+            elif prefix == SAMPLE_PREFIX and event == "start_map":
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+
+    return {
+        "metrics": metrics_seen,
+        "samples": samples_seen,
+        "inserted": total_inserted
+    }
@@ -0,0 +1,130 @@
+import os
+import time
+import random
+import asyncio
+from typing import Any, Dict, Optional
+import google.genai as genai
+from utils.metrics import Histogram
+from utils.rate_limit import get_bucket
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# Gemini calls in flight per process, across the hourly sweep and interactive requests
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "2"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "30"))
+
+
+def is_retryable(error: Exception) -> bool:
+    """Quota, overload and timeout errors are worth retrying; bad requests are not."""
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    text = str(error).lower()
+    return any(marker in text for marker in ("429", "quota", "resource_exhausted", "503", "unavailable", "overloaded"))
+
+
+class LLMGateway:
+    """Single async entry point for Gemini calls.
+
+    Every call takes a token from the shared "gemini" bucket (utils.rate_limit), whether it
+    comes from a fan-out job or an interactive request, and at most LLM_MAX_CONCURRENCY
+    calls run at once. Calls use the SDK's async client with a timeout; retryable failures
+    back off with full jitter on asyncio.sleep. Latency and token usage are recorded per
+    model for /admin/llm-stats.
+    """
+
+    def __init__(self):
+        self._client: Optional[genai.Client] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.latency: Dict[str, Histogram] = {}
+        self.stats = {
+            "calls": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "timeouts": 0,
+            "in_flight": 0,
+            "prompt_tokens": 0,
+            "output_tokens": 0,
+            "total_tokens": 0
+        }
+
+    @property
+    def client(self) -> genai.Client:
+        if self._client is None:
+            self._client = genai.Client(api_key=GEMINI_API_KEY)
+        return self._client
+
+    def _record_usage(self, response: Any) -> Dict[str, int]:
+        usage = getattr(response, "usage_metadata", None)
+        tokens = {
+            "prompt_tokens": getattr(usage, "prompt_token_count", None) or 0,
+            "output_tokens": getattr(usage, "candidates_token_count", None) or 0,
+            "total_tokens": getattr(usage, "total_token_count", None) or 0
+        }
+        for key, value in tokens.items():
+            self.stats[key] += value
+        return tokens
+
+    async def _call(self, model: str, prompt: str, config: Optional[Dict[str, Any]], timeout: float) -> Any:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        await get_bucket("gemini").acquire()
+        async with self._semaphore:
+            self.stats["in_flight"] += 1
+            started = time.perf_counter()
+            try:
+                return await asyncio.wait_for(
+                    self.client.aio.models.generate_content(model=model, contents=prompt, config=config),
+                    timeout=timeout
+                )
+            finally:
+                self.stats["in_flight"] -= 1
+                self.latency.setdefault(model, Histogram()).observe((time.perf_counter() - started) * 1000)
+
+    async def generate(
+        self,
+        prompt: str,
+        model: str = GEMINI_MODEL,
+        config: Optional[Dict[str, Any]] = None,
+        purpose: str = "generate",
+        timeout: float = LLM_TIMEOUT_SECONDS
+    ) -> Optional[str]:
+        """Response text for ``prompt``, or None once retries are exhausted or the error is not retryable."""
+        self.stats["calls"] += 1
+        for attempt in range(LLM_MAX_RETRIES):
+            try:
+                response = await self._call(model, prompt, config, timeout)
+                tokens = self._record_usage(response)
+                self.stats["succeeded"] += 1
+                print(f"[LLM] {purpose}: {model} ok, {tokens['prompt_tokens']}+{tokens['output_tokens']} tokens")
+                return response.text
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.stats["timeouts"] += 1
+                elif "429" in str(e) or "quota" in str(e).lower():
+                    self.stats["rate_limited"] += 1
+                if not is_retryable(e) or attempt == LLM_MAX_RETRIES - 1:
+                    self.stats["failed"] += 1
+                    print(f"[LLM] {purpose}: {model} failed after {attempt + 1} attempt(s): {e or type(e).__name__}")
+                    return None
+                self.stats["retries"] += 1
+                wait_time = random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * (2 ** attempt)))
+                print(f"[LLM] {purpose}: retrying in {wait_time:.1f}s (attempt {attempt + 1}/{LLM_MAX_RETRIES}): {e or type(e).__name__}")
+                await asyncio.sleep(wait_time)
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        bucket = get_bucket("gemini")
+        return {
+            **self.stats,
+            "max_concurrency": LLM_MAX_CONCURRENCY,
+            "rate_limit": {"rate": bucket.rate, "burst": bucket.burst, **bucket.stats, "wait_seconds": round(bucket.stats["wait_seconds"], 3)},
+            "latency_ms": {model: histogram.snapshot() for model, histogram in self.latency.items()}
+        }
+
+
+llm_gateway = LLMGateway()
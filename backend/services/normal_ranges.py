@@ -0,0 +1,42 @@
+import os
+from typing import Any, Dict, Optional
+
+# Normal ranges given to Gemini in the analysis prompt, used by the pre-screen and by the
+# analysis cache fingerprint: metric -> (prompt label, low, high, unit)
+LLM_NORMAL_RANGES: Dict[str, Any] = {
+    "heart_rate": ("HR", 60, 100, ""),
+    "respiratory_rate": ("RR", 12, 20, ""),
+    "heart_rate_variability": ("HRV", 20, 200, "ms"),
+    "blood_oxygen_saturation": ("SpO2", 95, 100, "%"),
+    "resting_heart_rate": ("RHR", 60, 100, ""),
+}
+# A value within this share of the range width from either bound is near the limit
+PRESCREEN_MARGIN_FRACTION = float(os.getenv("PRESCREEN_MARGIN_FRACTION", "0.05"))
+
+
+def as_percent(metric_name: str, value: float) -> float:
+    # Some sources report SpO2 as a fraction
+    if metric_name == "blood_oxygen_saturation" and value <= 1.0:
+        return value * 100
+    return value
+
+
+def range_band(metric_name: str, value: float) -> Optional[str]:
+    """Where ``value`` sits against LLM_NORMAL_RANGES: low, near_low, in, near_high or high.
+
+    Returns None for metrics without a range. ``value`` must already be in the range's units.
+    """
+    if metric_name not in LLM_NORMAL_RANGES:
+        return None
+    _, low, high, _ = LLM_NORMAL_RANGES[metric_name]
+    margin = (high - low) * PRESCREEN_MARGIN_FRACTION
+    if value < low:
+        return "low"
+    if value > high:
+        return "high"
+    if value < low + margin:
+        return "near_low"
+    # 100% SpO2 is a ceiling, not a limit to approach
+    if value > high - margin and metric_name != "blood_oxygen_saturation":
+        return "near_high"
+    return "in"
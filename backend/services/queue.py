@@ -1,76 +1,269 @@
-from datetime import datetime, timezone
+import os
+import json
+import random
+import socket
+import asyncio
+from datetime import datetime, timedelta, timezone
 from utils.supabase_client import supabase_admin
-from services.emergency import check_vitals_and_trigger_emergency
-from typing import List, Dict, Any
+from utils.db import db_execute
+from utils.postgres import pg_fetch, pg_fetchrow
+from services.emergency import evaluate_vitals
+from services.emergency_scheduler import emergency_scheduler
+from services.vitals_window import parse_sample_timestamp
+from utils.tracing import tracer
+from typing import List, Dict, Any, Optional, Union
 
+QUEUE_BATCH_SIZE = int(os.getenv("QUEUE_BATCH_SIZE", "50"))
+QUEUE_WORKER_CONCURRENCY = int(os.getenv("QUEUE_WORKER_CONCURRENCY", "5"))
+QUEUE_LEASE_SECONDS = int(os.getenv("QUEUE_LEASE_SECONDS", "60"))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "5"))
+QUEUE_RETRY_BASE_SECONDS = float(os.getenv("QUEUE_RETRY_BASE_SECONDS", "5"))
+QUEUE_RETRY_MAX_SECONDS = float(os.getenv("QUEUE_RETRY_MAX_SECONDS", "600"))
+# Settled jobs older than this are rolled up into emergency_check_queue_daily and purged
+QUEUE_RETENTION_DAYS = int(os.getenv("QUEUE_RETENTION_DAYS", "7"))
+QUEUE_PARTITION_DAYS_AHEAD = int(os.getenv("QUEUE_PARTITION_DAYS_AHEAD", "3"))
 
-async def get_pending_emergency_checks(limit: int = 10) -> List[Dict[str, Any]]:
-    """Fetch pending emergency check jobs from the queue."""
+# Identifies this process's claims; a lease can only be settled by the worker holding it
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+
+async def claim_emergency_checks(limit: int = QUEUE_BATCH_SIZE) -> List[Dict[str, Any]]:
+    """Atomically claim up to ``limit`` pending (or lease-expired) jobs for this worker.
+
+    Needs database/10_emergency_queue_claim.sql: leases and settling rely on its columns,
+    so there is no unlocked fallback and a missing function fails the queue run loudly.
+    """
     try:
-        response = supabase_admin.table("emergency_check_queue").select("*").eq("status", "pending").limit(limit).execute()
-        return response.data or []
+        jobs = await pg_fetch(
+            "select * from public.claim_emergency_checks($1, $2, $3)",
+            WORKER_ID, limit, QUEUE_LEASE_SECONDS
+        )
+        if jobs is None:
+            jobs = (await db_execute(supabase_admin.rpc(
+                "claim_emergency_checks",
+                {"p_worker": WORKER_ID, "p_limit": limit, "p_lease_seconds": QUEUE_LEASE_SECONDS}
+            ))).data
+        return jobs or []
     except Exception as e:
-        print(f"[QUEUE] Error fetching pending jobs: {e}")
-        return []
+        raise RuntimeError(
+            f"claim_emergency_checks failed ({e}); is database/10_emergency_queue_claim.sql applied?"
+        ) from e
 
 
-async def update_job_status(job_id: int, status: str, error_message: str = None) -> bool:
-    """Update the status of a queue job."""
+async def update_job_status(job_ids: Union[int, List[int]], status: str, error_message: str = None) -> bool:
+    """Settle one or more jobs claimed by this worker in a single request.
+
+    Jobs whose lease expired and were reclaimed by another worker are left alone.
+    """
+    if not isinstance(job_ids, list):
+        job_ids = [job_ids]
     try:
         update_data = {
             "status": status,
-            "processed_at": datetime.now(timezone.utc).isoformat()
+            "processed_at": datetime.now(timezone.utc).isoformat(),
+            "lease_expires_at": None
         }
         if error_message:
             update_data["error_message"] = error_message
-        
-        supabase_admin.table("emergency_check_queue").update(update_data).eq("id", job_id).execute()
+
+        await db_execute(supabase_admin.table("emergency_check_queue").update(update_data).in_("id", job_ids).eq("claimed_by", WORKER_ID))
         return True
     except Exception as e:
-        print(f"[QUEUE] Error updating job {job_id}: {e}")
+        print(f"[QUEUE] Error updating job(s) {job_ids}: {e}")
         return False
 
 
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with equal jitter: half the capped delay is fixed, half is random."""
+    capped = min(QUEUE_RETRY_MAX_SECONDS, QUEUE_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)))
+    return capped / 2 + random.uniform(0, capped / 2)
+
+
+async def schedule_retry(jobs: List[Dict[str, Any]], error_message: str) -> str:
+    """Send a failed email's jobs back for a delayed retry, or to the dead-letter state."""
+    job_ids = [j.get("id") for j in jobs]
+    attempts = max(j.get("attempts") or 1 for j in jobs)
+    delay = retry_delay(attempts)
+    try:
+        row = await pg_fetchrow(
+            "select public.retry_emergency_checks($1::bigint[], $2, $3, $4, $5) as status",
+            job_ids, WORKER_ID, error_message, delay, QUEUE_MAX_ATTEMPTS
+        )
+        if row is not None:
+            status = row.get("status")
+        else:
+            status = (await db_execute(supabase_admin.rpc("retry_emergency_checks", {
+                "p_ids": job_ids,
+                "p_worker": WORKER_ID,
+                "p_error": error_message,
+                "p_delay_seconds": delay,
+                "p_max_attempts": QUEUE_MAX_ATTEMPTS
+            }))).data
+    except Exception as e:
+        print(f"[QUEUE] retry_emergency_checks unavailable, marking job(s) {job_ids} failed: {e}")
+        await update_job_status(job_ids, "failed", error_message)
+        return "failed"
+
+    if status == "pending":
+        print(f"[QUEUE] ↻ Job(s) {job_ids} retry {attempts + 1}/{QUEUE_MAX_ATTEMPTS} in {delay:.1f}s")
+        # No NOTIFY fires when a retry comes due, so wake ourselves instead of waiting for the poll
+        asyncio.get_running_loop().call_later(delay, _wake_for_retry)
+    elif status == "dead":
+        print(f"[QUEUE] ✗ Job(s) {job_ids} dead-lettered after {attempts} attempt(s): {error_message}")
+    else:
+        print(f"[QUEUE] Job(s) {job_ids} settled as {status}")
+    return status
+
+
+def _wake_for_retry() -> None:
+    from services.queue_wakeup import queue_wakeup
+    queue_wakeup.notify()
+
+
+async def list_dead_letters(limit: int = 50) -> List[Dict[str, Any]]:
+    jobs = await pg_fetch(
+        "select * from public.emergency_check_queue where status = 'dead' order by created_at desc limit $1",
+        limit
+    )
+    if jobs is None:
+        jobs = (await db_execute(supabase_admin.table("emergency_check_queue").select("*").eq("status", "dead").order("created_at", desc=True).limit(limit))).data or []
+    return jobs
+
+
+async def replay_dead_letters(job_ids: Optional[List[int]] = None) -> int:
+    """Re-queue dead jobs (all of them when ``job_ids`` is None); returns how many became pending."""
+    row = await pg_fetchrow("select public.replay_emergency_checks($1::bigint[]) as revived", job_ids)
+    if row is not None:
+        revived = row.get("revived") or 0
+    else:
+        revived = (await db_execute(supabase_admin.rpc("replay_emergency_checks", {"p_ids": job_ids}))).data or 0
+    print(f"[QUEUE] Replayed {revived} dead-lettered job(s)")
+    return revived
+
+
+async def run_queue_retention() -> Dict[str, Any]:
+    """Daily retention pass: roll up and purge settled jobs, drop empty old partitions, create upcoming ones."""
+    try:
+        row = await pg_fetchrow(
+            "select public.maintain_emergency_queue($1, $2) as result",
+            QUEUE_RETENTION_DAYS, QUEUE_PARTITION_DAYS_AHEAD
+        )
+        if row is not None:
+            result = row.get("result")
+            result = json.loads(result) if isinstance(result, str) else result
+        else:
+            result = (await db_execute(supabase_admin.rpc("maintain_emergency_queue", {
+                "p_retention_days": QUEUE_RETENTION_DAYS,
+                "p_days_ahead": QUEUE_PARTITION_DAYS_AHEAD
+            }))).data
+    except Exception as e:
+        message = str(e)
+        function_missing = "maintain_emergency_queue" in message and any(
+            marker in message for marker in ("does not exist", "Could not find", "PGRST202")
+        )
+        if not function_missing:
+            # The function exists but this pass failed; a plain delete here would skip the rollup
+            print(f"[QUEUE] Retention failed: {e}")
+            return {"error": message}
+        # Unpartitioned database: plain purge, no rollup
+        print(f"[QUEUE] maintain_emergency_queue unavailable, deleting settled jobs only: {e}")
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=QUEUE_RETENTION_DAYS)).isoformat()
+        try:
+            response = await db_execute(supabase_admin.table("emergency_check_queue").delete().in_("status", ["completed", "failed"]).lt("created_at", cutoff))
+            result = {"cutoff": cutoff, "purged_rows": len(response.data or [])}
+        except Exception as delete_error:
+            print(f"[QUEUE] Retention failed: {delete_error}")
+            return {"error": str(delete_error)}
+
+    print(f"[QUEUE] Retention pass: {result}")
+    return result
+
+
+async def process_jobs_for_email(email: str, jobs: List[Dict[str, Any]], deadline: Optional[float] = None) -> None:
+    """Evaluate one email's claimed jobs; ``deadline`` (loop time) defaults to 0.8 of a lease from now."""
+    loop = asyncio.get_running_loop()
+    if deadline is None:
+        deadline = loop.time() + QUEUE_LEASE_SECONDS * 0.8
+    job_ids = [j.get("id") for j in jobs]
+    metric_source = jobs[0].get("metric_source")
+
+    print(f"\n[QUEUE] Processing job(s) {job_ids}: email={email}, source={metric_source}")
+
+    try:
+        with tracer.span("queue.evaluate", new_trace=True, job_ids=job_ids, email=email, source=metric_source) as span:
+            # Finish well inside the lease (which started at claim time) so no other worker reclaims it
+            timeout = max(deadline - loop.time(), 0)
+            scheduled = emergency_scheduler.pending_evaluation(email)
+            if scheduled is not None:
+                # A request of this process is still ingesting for this email; share its single evaluation
+                span.set(via="scheduler")
+                result = await asyncio.wait_for(asyncio.shield(scheduled), timeout=timeout)
+            else:
+                result = await asyncio.wait_for(evaluate_vitals(email), timeout=timeout)
+            arrived_at = min(
+                (t for t in (parse_sample_timestamp(j.get("created_at")) for j in jobs) if t is not None),
+                default=None
+            )
+            # The scheduler records detection latency for the evaluations it runs
+            if result and arrived_at is not None and scheduled is None:
+                latency = tracer.record_detection(arrived_at, email)
+                span.set(emergency_created=True, detection_ms=round(latency * 1000, 3))
+
+        if result:
+            print(f"[QUEUE] ✓ Job(s) {job_ids} completed - emergency triggered")
+        else:
+            print(f"[QUEUE] ✓ Job(s) {job_ids} completed - no emergency needed")
+        await update_job_status(job_ids, "completed")
+
+    except Exception as e:
+        error_msg = str(e) or type(e).__name__
+        print(f"[QUEUE] ✗ Job(s) {job_ids} failed: {error_msg}")
+        await schedule_retry(jobs, error_msg)
+
+
 async def process_emergency_check_queue() -> None:
-    """Process all pending emergency check jobs."""
+    """Drain the queue with up to QUEUE_WORKER_CONCURRENCY emails in flight.
+
+    Only as many jobs as there are free worker slots are claimed, so no lease starts
+    ticking while its job waits for a slot; a finished evaluation frees a slot for the
+    next claim.
+    """
+    running = set()
     try:
-        print(f"\n[QUEUE] Starting emergency check queue processing...")
-        
-        pending_jobs = await get_pending_emergency_checks()
-        
-        if not pending_jobs:
+        print(f"\n[QUEUE] Starting emergency check queue processing ({WORKER_ID})...")
+        loop = asyncio.get_running_loop()
+
+        total = 0
+        while True:
+            free = QUEUE_WORKER_CONCURRENCY - len(running)
+            # Leases start inside the claim, so measure the evaluation deadline from before it
+            deadline = loop.time() + QUEUE_LEASE_SECONDS * 0.8
+            claimed_jobs = await claim_emergency_checks(min(free, QUEUE_BATCH_SIZE)) if free > 0 else []
+            if claimed_jobs:
+                total += len(claimed_jobs)
+                print(f"[QUEUE] Claimed {len(claimed_jobs)} job(s)")
+
+                # Jobs queued before coalescing (or racing it) can repeat an email; one evaluation covers them all
+                jobs_by_email: Dict[str, List[Dict[str, Any]]] = {}
+                for job in claimed_jobs:
+                    jobs_by_email.setdefault(job.get("email"), []).append(job)
+                for email, jobs in jobs_by_email.items():
+                    running.add(asyncio.ensure_future(process_jobs_for_email(email, jobs, deadline)))
+
+            if not running:
+                break
+            _, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+
+        if not total:
             print(f"[QUEUE] No pending jobs")
             return
-        
-        print(f"[QUEUE] Found {len(pending_jobs)} pending job(s)")
-        
-        for job in pending_jobs:
-            job_id = job.get("id")
-            email = job.get("email")
-            metric_source = job.get("metric_source")
-            
-            print(f"\n[QUEUE] Processing job {job_id}: email={email}, source={metric_source}")
-            
-            try:
-                await update_job_status(job_id, "processing")
-                
-                result = await check_vitals_and_trigger_emergency(email)
-                
-                if result:
-                    print(f"[QUEUE] ✓ Job {job_id} completed - emergency triggered")
-                    await update_job_status(job_id, "completed")
-                else:
-                    print(f"[QUEUE] ✓ Job {job_id} completed - no emergency needed")
-                    await update_job_status(job_id, "completed")
-                    
-            except Exception as e:
-                error_msg = str(e)
-                print(f"[QUEUE] ✗ Job {job_id} failed: {error_msg}")
-                await update_job_status(job_id, "failed", error_msg)
-        
-        print(f"[QUEUE] Queue processing completed\n")
-        
+        print(f"[QUEUE] Queue processing completed ({total} job(s))\n")
+
     except Exception as e:
         print(f"[QUEUE] Error in queue processing: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        # A failed claim must not orphan evaluations already running
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
@@ -0,0 +1,77 @@
+import os
+import asyncio
+from typing import Optional
+from utils.postgres import DATABASE_URL
+from utils.pg_listener import pg_listener
+from services.queue import process_emergency_check_queue
+
+# "postgres" wakes on LISTEN/NOTIFY from the queue triggers; "memory" wakes on this process's own inserts
+QUEUE_WAKEUP_BACKEND = os.getenv("QUEUE_WAKEUP_BACKEND", "postgres" if DATABASE_URL else "memory").lower()
+# Notifications arriving this close together are drained by one processor run
+QUEUE_WAKEUP_DEBOUNCE_SECONDS = float(os.getenv("QUEUE_WAKEUP_DEBOUNCE_SECONDS", "0.05"))
+# Interval of the APScheduler safety-net poll once push wakeups are running
+QUEUE_POLL_SECONDS = int(os.getenv("QUEUE_POLL_SECONDS", "300"))
+QUEUE_CHANNEL = "emergency_check_queued"
+
+
+class QueueWakeup:
+    """Runs the queue processor whenever a job is queued instead of waiting for the next poll.
+
+    Wakeups go through an asyncio.Queue. With the postgres backend they come from
+    pg_notify in the queue triggers (and after every listener reconnect, since
+    notifications sent while disconnected are lost). With the memory backend, for tests
+    and single-node deployments, the app calls ``notify_local`` after its own inserts.
+    """
+
+    def __init__(self, backend: str):
+        self.backend = backend
+        self._wakeups: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"wakeups": 0, "runs": 0}
+
+    def notify(self, email: str = "") -> None:
+        if self._wakeups is None:
+            return
+        self.stats["wakeups"] += 1
+        self._wakeups.put_nowait(email)
+
+    def notify_local(self, email: str) -> None:
+        """Wake after an insert made by this process; a no-op when Postgres notifies instead."""
+        if self.backend == "memory":
+            self.notify(email)
+
+    def _on_notify(self, channel: str, payload: str) -> None:
+        self.notify(payload)
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeups.get()
+            await asyncio.sleep(QUEUE_WAKEUP_DEBOUNCE_SECONDS)
+            while not self._wakeups.empty():
+                self._wakeups.get_nowait()
+            self.stats["runs"] += 1
+            try:
+                await process_emergency_check_queue()
+            except Exception as e:
+                print(f"[QUEUE_WAKEUP] Queue run failed: {e}")
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._wakeups = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._run())
+        # Drain whatever was queued while no worker was listening
+        self.notify()
+        print(f"[QUEUE_WAKEUP] ✓ Push wakeups enabled ({self.backend} backend)")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._wakeups = None
+
+
+queue_wakeup = QueueWakeup(QUEUE_WAKEUP_BACKEND)
+if QUEUE_WAKEUP_BACKEND == "postgres":
+    pg_listener.add(QUEUE_CHANNEL, queue_wakeup._on_notify)
+    pg_listener.on_reconnect(queue_wakeup.notify)
@@ -1,6 +1,7 @@
 import os
 import uuid
 import httpx
+from utils.http_clients import get_http_client
 from datetime import datetime, timedelta
 
 DAILY_API_KEY = os.getenv("DAILY_API_KEY")
@@ -27,24 +28,24 @@ async def create_room(conversation_id: int, recording_enabled: bool = False) ->
     }
     
     try:
-        async with httpx.AsyncClient() as client:
-            print(f"[DAILY] Posting to {DAILY_API_URL}/rooms with headers: {headers}")
-            response = await client.post(
-                f"{DAILY_API_URL}/rooms",
-                json=payload,
-                headers=headers,
-                timeout=10
-            )
-            
-            print(f"[DAILY] Room creation response status: {response.status_code}")
-            print(f"[DAILY] Room creation response body: {response.text}")
-            
-            if not response.is_success:
-                error_text = response.text
-                print(f"[DAILY] Room creation error: {error_text}")
-                raise Exception(f"Status {response.status_code}: {error_text}")
-            
-            data = response.json()
+        client = get_http_client("daily")
+        print(f"[DAILY] Posting to {DAILY_API_URL}/rooms with headers: {headers}")
+        response = await client.post(
+            "/rooms",
+            json=payload,
+            headers=headers,
+            timeout=10
+        )
+        
+        print(f"[DAILY] Room creation response status: {response.status_code}")
+        print(f"[DAILY] Room creation response body: {response.text}")
+        
+        if not response.is_success:
+            error_text = response.text
+            print(f"[DAILY] Room creation error: {error_text}")
+            raise Exception(f"Status {response.status_code}: {error_text}")
+        
+        data = response.json()
         
         print(f"[DAILY] Room created successfully: {data.get('name')}")
         return {
@@ -75,32 +76,32 @@ async def get_room_token(room_name: str, participant_name: str) -> dict:
     
     try:
         # Use the correct token endpoint: /v1/meeting-tokens
-        url = f"{DAILY_API_URL}/meeting-tokens"
+        url = "/meeting-tokens"
         print(f"[DAILY] Attempting to get token from: {url}")
         print(f"[DAILY] Payload: {payload}")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                json=payload,
-                headers=headers,
-                timeout=10
-            )
-            
-            print(f"[DAILY] Token response status: {response.status_code}")
-            print(f"[DAILY] Token response body: {response.text}")
-            
-            if not response.is_success:
-                error_text = response.text
-                print(f"[DAILY] Token error: {error_text}")
-                # For now, return empty token - Daily.co iframe works without it
-                print(f"[DAILY] Warning: Token generation failed, proceeding without token")
-                return {
-                    "success": True,
-                    "token": ""
-                }
-            
-            data = response.json()
+        client = get_http_client("daily")
+        response = await client.post(
+            url,
+            json=payload,
+            headers=headers,
+            timeout=10
+        )
+        
+        print(f"[DAILY] Token response status: {response.status_code}")
+        print(f"[DAILY] Token response body: {response.text}")
+        
+        if not response.is_success:
+            error_text = response.text
+            print(f"[DAILY] Token error: {error_text}")
+            # For now, return empty token - Daily.co iframe works without it
+            print(f"[DAILY] Warning: Token generation failed, proceeding without token")
+            return {
+                "success": True,
+                "token": ""
+            }
+        
+        data = response.json()
         
         print(f"[DAILY] Token generated successfully for room {room_name}")
         return {
@@ -123,14 +124,14 @@ async def get_room_info(room_name: str) -> dict:
     }
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{DAILY_API_URL}/rooms/{room_name}",
-                headers=headers,
-                timeout=10
-            )
-            response.raise_for_status()
-            return response.json()
+        client = get_http_client("daily")
+        response = await client.get(
+            f"/rooms/{room_name}",
+            headers=headers,
+            timeout=10
+        )
+        response.raise_for_status()
+        return response.json()
     except httpx.HTTPError as e:
         print(f"Error getting room info: {e}")
         return None
@@ -141,14 +142,14 @@ async def end_room(room_name: str) -> dict:
     }
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(
-                f"{DAILY_API_URL}/rooms/{room_name}",
-                headers=headers,
-                timeout=10
-            )
-            response.raise_for_status()
-            return {"success": True}
+        client = get_http_client("daily")
+        response = await client.delete(
+            f"/rooms/{room_name}",
+            headers=headers,
+            timeout=10
+        )
+        response.raise_for_status()
+        return {"success": True}
     except httpx.HTTPError as e:
         print(f"Error ending room: {e}")
         return {"success": False, "error": str(e)}
@@ -0,0 +1,135 @@
+import os
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+# Same lookback the emergency check has always used against the health tables
+VITALS_WINDOW_SECONDS = int(os.getenv("VITALS_WINDOW_SECONDS", "3600"))
+# Windows are rebuilt from the database this often so inserts handled by other workers are seen
+VITALS_RESEED_SECONDS = int(os.getenv("VITALS_RESEED_SECONDS", "900"))
+
+
+def parse_sample_timestamp(value: Any) -> Optional[float]:
+    """Epoch seconds for the timestamp formats the ingest paths and Postgres hand us."""
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            try:
+                # Health Auto Export style: "2024-01-31 08:15:00 -0500"
+                parsed = datetime.strptime(value, "%Y-%m-%d %H:%M:%S %z")
+            except ValueError:
+                return None
+    else:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class _UserWindow:
+    def __init__(self):
+        self.seeded_at: Optional[float] = None
+        # metric_name -> abnormal samples as (epoch, value, original timestamp), sorted by epoch
+        # because backfills and seeds from the realtime/aggregated union arrive out of order
+        self.abnormal: Dict[str, List[Tuple[float, float, Any]]] = {}
+        self.seen: Dict[str, Set[float]] = {}
+
+    def add(self, metric_name: str, epoch: float, value: float, timestamp: Any) -> bool:
+        seen = self.seen.setdefault(metric_name, set())
+        if epoch in seen:
+            return False
+        seen.add(epoch)
+        insort(self.abnormal.setdefault(metric_name, []), (epoch, value, timestamp))
+        return True
+
+    def evict(self, cutoff: float) -> None:
+        for metric_name, samples in self.abnormal.items():
+            expired = bisect_left(samples, (cutoff,))
+            if expired:
+                seen = self.seen[metric_name]
+                for epoch, _, _ in samples[:expired]:
+                    seen.discard(epoch)
+                del samples[:expired]
+
+
+class VitalsWindow:
+    """Per-user, per-metric sliding window of abnormal vitals over the last VITALS_WINDOW_SECONDS.
+
+    Ingest feeds every inserted sample through ``observe``, which does one threshold
+    check per sample and keeps only the abnormal ones, so the emergency check can answer
+    from memory. A user whose window was never seeded from the database (or was seeded
+    more than VITALS_RESEED_SECONDS ago) is cold and the caller scans the tables instead.
+    """
+
+    def __init__(self, is_abnormal: Callable[[str, float], bool]):
+        self._is_abnormal = is_abnormal
+        self._users: Dict[str, _UserWindow] = {}
+        self.stats = {"observed": 0, "abnormal": 0, "warm_hits": 0, "cold_scans": 0}
+
+    def observe(self, email: str, metric_name: str, rows: List[Dict[str, Any]]) -> int:
+        """Add freshly inserted rows; returns how many new abnormal samples they contained."""
+        cutoff = time.time() - VITALS_WINDOW_SECONDS
+        window = self._users.setdefault(email, _UserWindow())
+        window.evict(cutoff)
+        new_abnormal = 0
+        for row in rows:
+            self.stats["observed"] += 1
+            value = row.get("value")
+            if value is None or not self._is_abnormal(metric_name, float(value)):
+                continue
+            epoch = parse_sample_timestamp(row.get("timestamp"))
+            if epoch is None or epoch < cutoff:
+                continue
+            if window.add(metric_name, epoch, float(value), row.get("timestamp")):
+                new_abnormal += 1
+        self.stats["abnormal"] += new_abnormal
+        return new_abnormal
+
+    def seed(self, email: str, rows: List[Dict[str, Any]]) -> None:
+        """Rebuild a user's window from a database scan, keeping samples observed meanwhile."""
+        previous = self._users.get(email)
+        window = _UserWindow()
+        for row in rows:
+            metric_name = row.get("metric_name")
+            value = row.get("value")
+            if not metric_name or value is None:
+                continue
+            try:
+                value = float(value)
+            except (ValueError, TypeError):
+                continue
+            epoch = parse_sample_timestamp(row.get("timestamp"))
+            if epoch is not None and self._is_abnormal(metric_name, value):
+                window.add(metric_name, epoch, value, row.get("timestamp"))
+        if previous is not None:
+            for metric_name, samples in previous.abnormal.items():
+                for epoch, value, timestamp in samples:
+                    window.add(metric_name, epoch, value, timestamp)
+        window.seeded_at = time.monotonic()
+        self._users[email] = window
+
+    def abnormal_vitals(self, email: str) -> Optional[List[Dict[str, Any]]]:
+        """Abnormal vitals inside the window, or None if the user's window is cold."""
+        window = self._users.get(email)
+        if window is None or window.seeded_at is None or time.monotonic() - window.seeded_at > VITALS_RESEED_SECONDS:
+            self.stats["cold_scans"] += 1
+            return None
+        self.stats["warm_hits"] += 1
+        window.evict(time.time() - VITALS_WINDOW_SECONDS)
+        return [
+            {"metric": metric_name, "value": value, "timestamp": timestamp}
+            for metric_name, samples in window.abnormal.items()
+            for _, value, timestamp in samples
+        ]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "users": len(self._users),
+            "warm_users": sum(1 for w in self._users.values() if w.seeded_at is not None),
+            "abnormal_samples": sum(len(s) for w in self._users.values() for s in w.abnormal.values())
+        }
@@ -0,0 +1,32 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from utils.rate_limit import throttle
+
+# supabase-py is synchronous; its calls run on this bounded pool so they never block the event loop
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "64"))
+DB_CALL_TIMEOUT_SECONDS = float(os.getenv("DB_CALL_TIMEOUT_SECONDS", "15"))
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="supabase-db")
+
+
+async def run_blocking(fn: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+    """Run a blocking Supabase call on the DB executor and wait at most ``timeout`` seconds.
+
+    On timeout the caller gets asyncio.TimeoutError right away; the worker thread finishes
+    the HTTP call in the background since threads cannot be interrupted.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_executor, fn, *args)
+    return await asyncio.wait_for(future, timeout=timeout or DB_CALL_TIMEOUT_SECONDS)
+
+
+async def db_execute(query: Any, timeout: Optional[float] = None) -> Any:
+    """Await a PostgREST query builder (``supabase.table(...)...``) without blocking the loop."""
+    await throttle("db")
+    return await run_blocking(query.execute, timeout=timeout)
+
+
+def shutdown_executor() -> None:
+    _executor.shutdown(wait=False, cancel_futures=True)
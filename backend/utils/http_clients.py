@@ -0,0 +1,101 @@
+import os
+from typing import Any, Callable, Dict
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# One pooled client per upstream; each setting can be overridden with HTTP_<UPSTREAM>_<SETTING>
+UPSTREAMS: Dict[str, Dict[str, Any]] = {
+    "gotrue": {"base_url": f"{os.getenv('SUPABASE_URL', '')}/auth/v1", "max_connections": 20, "timeout": 10.0},
+    "daily": {"base_url": "https://api.daily.co/v1", "max_connections": 10, "timeout": 10.0},
+    "health_api": {"base_url": os.getenv("HEALTH_API_BASE", "http://127.0.0.1:9876/api"), "max_connections": 10, "timeout": 30.0},
+}
+DEFAULT_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+DEFAULT_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+
+
+def _setting(upstream: str, name: str, default: Any, cast: Callable[[str], Any]) -> Any:
+    value = os.getenv(f"HTTP_{upstream.upper()}_{name.upper()}")
+    return cast(value) if value is not None else default
+
+
+class HTTPClientRegistry:
+    """Long-lived httpx clients keyed by upstream, with per-upstream connection reuse counters."""
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def _build(self, upstream: str) -> httpx.AsyncClient:
+        config = UPSTREAMS.get(upstream, {})
+        stats = self._stats.setdefault(upstream, {"requests": 0, "new_connections": 0, "http_versions": {}})
+
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            if event_name == "connection.connect_tcp.complete":
+                stats["new_connections"] += 1
+
+        async def on_request(request: httpx.Request) -> None:
+            # httpcore reports connection setup through the per-request trace extension
+            request.extensions["trace"] = trace
+
+        async def on_response(response: httpx.Response) -> None:
+            stats["requests"] += 1
+            versions = stats["http_versions"]
+            versions[response.http_version] = versions.get(response.http_version, 0) + 1
+
+        limits = httpx.Limits(
+            max_connections=_setting(upstream, "max_connections", config.get("max_connections", 10), int),
+            max_keepalive_connections=_setting(upstream, "max_keepalive", DEFAULT_MAX_KEEPALIVE, int),
+            keepalive_expiry=_setting(upstream, "keepalive_expiry", DEFAULT_KEEPALIVE_EXPIRY, float)
+        )
+        options = {
+            "base_url": _setting(upstream, "base_url", config.get("base_url", ""), str),
+            "limits": limits,
+            "timeout": _setting(upstream, "timeout", config.get("timeout", 10.0), float),
+            "event_hooks": {"request": [on_request], "response": [on_response]}
+        }
+        try:
+            return httpx.AsyncClient(http2=HTTP2_ENABLED, **options)
+        except ImportError:
+            print(f"[HTTP] h2 is not installed, {upstream} client falls back to HTTP/1.1")
+            return httpx.AsyncClient(**options)
+
+    def get(self, upstream: str) -> httpx.AsyncClient:
+        client = self._clients.get(upstream)
+        if client is None or client.is_closed:
+            client = self._build(upstream)
+            self._clients[upstream] = client
+        return client
+
+    async def start(self) -> None:
+        for upstream in UPSTREAMS:
+            self.get(upstream)
+        print(f"[HTTP] ✓ Pooled clients ready: {', '.join(self._clients)}")
+
+    async def close(self) -> None:
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+        print("[HTTP] ✓ Pooled clients closed")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for upstream, stats in self._stats.items():
+            requests = stats["requests"]
+            reused = max(requests - stats["new_connections"], 0)
+            result[upstream] = {
+                **stats,
+                "reused_connections": reused,
+                "reuse_ratio": round(reused / requests, 3) if requests else None
+            }
+        return result
+
+
+http_clients = HTTPClientRegistry()
+
+
+def get_http_client(upstream: str) -> httpx.AsyncClient:
+    return http_clients.get(upstream)
@@ -0,0 +1,146 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from typing import Any, Dict, List, Optional
+from utils.metrics import Histogram
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() in ("1", "true", "yes")
+LOOP_LAG_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+LOOP_STACK_DEPTH = int(os.getenv("LOOP_STACK_DEPTH", "12"))
+LOOP_TOP_BLOCKERS = int(os.getenv("LOOP_TOP_BLOCKERS", "20"))
+
+# Frames under this directory count as our code when picking the blocking call site
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class LoopMonitor:
+    """Measures event-loop lag and samples the loop thread's stack while it is blocked.
+
+    A heartbeat coroutine sleeps LOOP_LAG_INTERVAL_MS and records how late it woke up.
+    A watchdog thread notices when the heartbeat has not run for longer than
+    LOOP_BLOCK_THRESHOLD_MS and grabs the loop thread's stack while the blocking call is
+    still on it, so the stall is attributed to the innermost backend frame and task.
+    """
+
+    def __init__(self):
+        self.lag = Histogram()
+        self.blocked = Histogram()
+        self.blockers: Dict[str, Dict[str, Any]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._last_beat = time.monotonic()
+        self._stall_sample: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    def _sample_loop_stack(self) -> Optional[Dict[str, Any]]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return None
+
+        stack = traceback.extract_stack(frame)
+        site = None
+        for entry in reversed(stack):
+            if entry.filename.startswith(BACKEND_DIR) and not entry.filename.endswith("loop_monitor.py"):
+                site = f"{os.path.relpath(entry.filename, BACKEND_DIR)}:{entry.lineno} in {entry.name}"
+                break
+        if site is None:
+            last = stack[-1]
+            site = f"{last.filename}:{last.lineno} in {last.name}"
+
+        task_name = None
+        try:
+            task = asyncio.current_task(self._loop)
+            if task is not None:
+                task_name = getattr(task.get_coro(), "__qualname__", task.get_name())
+        except RuntimeError:
+            pass
+
+        return {
+            "site": site,
+            "task": task_name,
+            "stack": [line.rstrip() for line in traceback.format_list(stack[-LOOP_STACK_DEPTH:])]
+        }
+
+    def _watch(self) -> None:
+        threshold = LOOP_BLOCK_THRESHOLD_MS / 1000
+        budget = LOOP_LAG_INTERVAL_MS / 1000 + threshold
+        while not self._stopping.wait(threshold / 2):
+            if time.monotonic() - self._last_beat < budget:
+                continue
+            with self._lock:
+                if self._stall_sample is None:
+                    self._stall_sample = self._sample_loop_stack()
+
+    def _record_stall(self, lag_ms: float) -> None:
+        with self._lock:
+            sample, self._stall_sample = self._stall_sample, None
+        self.blocked.observe(lag_ms)
+
+        site = sample["site"] if sample else "unsampled"
+        entry = self.blockers.setdefault(site, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "task": None, "stack": []})
+        entry["count"] += 1
+        entry["total_ms"] += lag_ms
+        if lag_ms >= entry["max_ms"]:
+            entry["max_ms"] = lag_ms
+            if sample:
+                entry["task"] = sample["task"]
+                entry["stack"] = sample["stack"]
+        print(f"[LOOP] Event loop blocked for {lag_ms:.0f}ms at {site}")
+
+    async def _heartbeat(self) -> None:
+        interval = LOOP_LAG_INTERVAL_MS / 1000
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            lag_ms = max((time.perf_counter() - started - interval) * 1000, 0.0)
+            self._last_beat = time.monotonic()
+            self.lag.observe(lag_ms)
+            if lag_ms >= LOOP_BLOCK_THRESHOLD_MS:
+                self._record_stall(lag_ms)
+
+    async def start(self) -> None:
+        if not LOOP_MONITOR_ENABLED or self._heartbeat_task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopping.clear()
+        self._heartbeat_task = asyncio.ensure_future(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        print(f"[LOOP] ✓ Monitoring event-loop lag (threshold {LOOP_BLOCK_THRESHOLD_MS:.0f}ms)")
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        self._watchdog = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        top: List[Dict[str, Any]] = sorted(
+            ({"site": site, **entry} for site, entry in self.blockers.items()),
+            key=lambda e: e["total_ms"],
+            reverse=True
+        )[:LOOP_TOP_BLOCKERS]
+        for entry in top:
+            entry["total_ms"] = round(entry["total_ms"], 1)
+            entry["max_ms"] = round(entry["max_ms"], 1)
+        return {
+            "enabled": LOOP_MONITOR_ENABLED,
+            "interval_ms": LOOP_LAG_INTERVAL_MS,
+            "threshold_ms": LOOP_BLOCK_THRESHOLD_MS,
+            "lag": self.lag.snapshot(),
+            "blocked": self.blocked.snapshot(),
+            "top_blockers": top
+        }
+
+
+loop_monitor = LoopMonitor()
@@ -0,0 +1,77 @@
+import os
+import asyncio
+from typing import Callable, Dict, List, Optional
+import asyncpg
+from utils.postgres import DATABASE_URL
+
+PG_LISTEN_RECONNECT_SECONDS = float(os.getenv("PG_LISTEN_RECONNECT_SECONDS", "5"))
+
+NotifyCallback = Callable[[str, str], None]
+
+
+class PgListener:
+    """One dedicated Postgres connection that LISTENs on every registered channel.
+
+    Callbacks get (channel, payload) and run on the event loop, so they must not block.
+    The connection is re-established after PG_LISTEN_RECONNECT_SECONDS if it drops;
+    ``on_reconnect`` callbacks run after every successful connect, including the first,
+    because notifications sent while not listening are lost.
+    """
+
+    def __init__(self):
+        self._callbacks: Dict[str, List[NotifyCallback]] = {}
+        self._reconnect_callbacks: List[Callable[[], None]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._connection: Optional[asyncpg.Connection] = None
+        self.connected = asyncio.Event()
+
+    def add(self, channel: str, callback: NotifyCallback) -> None:
+        self._callbacks.setdefault(channel, []).append(callback)
+
+    def on_reconnect(self, callback: Callable[[], None]) -> None:
+        self._reconnect_callbacks.append(callback)
+
+    def _dispatch(self, connection, pid, channel: str, payload: str) -> None:
+        for callback in self._callbacks.get(channel, []):
+            try:
+                callback(channel, payload)
+            except Exception as e:
+                print(f"[PG_LISTEN] Callback for {channel} failed: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                self._connection = await asyncpg.connect(DATABASE_URL)
+                for channel in self._callbacks:
+                    await self._connection.add_listener(channel, self._dispatch)
+                print(f"[PG_LISTEN] ✓ Listening on {', '.join(self._callbacks)}")
+                self.connected.set()
+                for callback in self._reconnect_callbacks:
+                    callback()
+                closed = asyncio.Event()
+                self._connection.add_termination_listener(lambda _: closed.set())
+                await closed.wait()
+                print("[PG_LISTEN] Connection lost, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[PG_LISTEN] Could not listen: {e}")
+            self.connected.clear()
+            await asyncio.sleep(PG_LISTEN_RECONNECT_SECONDS)
+
+    async def start(self) -> None:
+        if not DATABASE_URL or not self._callbacks or self._task is not None:
+            return
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._connection is not None and not self._connection.is_closed():
+            await self._connection.close()
+        self._connection = None
+        self.connected.clear()
+
+
+pg_listener = PgListener()
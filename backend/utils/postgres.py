@@ -0,0 +1,101 @@
+import os
+import json
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+import asyncpg
+from dotenv import load_dotenv
+from utils.rate_limit import throttle
+
+load_dotenv()
+
+# Direct Postgres connection string; when unset every query goes through PostgREST
+DATABASE_URL: Optional[str] = os.getenv("DATABASE_URL")
+PG_POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "2"))
+PG_POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "10"))
+# Prepared statements are cached per connection; set to 0 behind a transaction-mode pooler (pgbouncer/supavisor :6543)
+PG_STATEMENT_CACHE_SIZE = int(os.getenv("PG_STATEMENT_CACHE_SIZE", "256"))
+PG_COMMAND_TIMEOUT = float(os.getenv("PG_COMMAND_TIMEOUT", "10"))
+
+_pool: Optional[asyncpg.Pool] = None
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    # asyncpg returns json/jsonb as text by default; decode them like PostgREST does
+    for type_name in ("json", "jsonb"):
+        await conn.set_type_codec(type_name, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+async def init_pool() -> Optional[asyncpg.Pool]:
+    """Open the shared asyncpg pool if DATABASE_URL is configured."""
+    global _pool
+    if _pool is not None or not DATABASE_URL:
+        return _pool
+    try:
+        _pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=PG_POOL_MIN_SIZE,
+            max_size=PG_POOL_MAX_SIZE,
+            statement_cache_size=PG_STATEMENT_CACHE_SIZE,
+            command_timeout=PG_COMMAND_TIMEOUT,
+            init=_init_connection
+        )
+        print(f"[POSTGRES] ✓ Connection pool ready ({PG_POOL_MIN_SIZE}-{PG_POOL_MAX_SIZE} connections)")
+    except Exception as e:
+        print(f"[POSTGRES] ✗ Could not open connection pool, falling back to PostgREST: {e}")
+        _pool = None
+    return _pool
+
+
+async def close_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+        print("[POSTGRES] ✓ Connection pool closed")
+
+
+def get_pool() -> Optional[asyncpg.Pool]:
+    return _pool
+
+
+def _to_json_value(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def record_to_dict(record: asyncpg.Record) -> Dict[str, Any]:
+    """Convert a record to the same JSON-friendly shape PostgREST returns."""
+    return {key: _to_json_value(value) for key, value in record.items()}
+
+
+async def pg_fetch(query: str, *args) -> Optional[List[Dict[str, Any]]]:
+    """Run a query on the pool. Returns None when the pool is unavailable so callers can fall back."""
+    if _pool is None:
+        return None
+    await throttle("db")
+    try:
+        records = await _pool.fetch(query, *args)
+        return [record_to_dict(r) for r in records]
+    except Exception as e:
+        print(f"[POSTGRES] Query failed, falling back to PostgREST: {e}")
+        return None
+
+
+async def pg_fetchrow(query: str, *args) -> Optional[Dict[str, Any]]:
+    """Like pg_fetch for a single row. Returns {} when no row matched and None when the pool is unavailable."""
+    if _pool is None:
+        return None
+    await throttle("db")
+    try:
+        record = await _pool.fetchrow(query, *args)
+        return record_to_dict(record) if record is not None else {}
+    except Exception as e:
+        print(f"[POSTGRES] Query failed, falling back to PostgREST: {e}")
+        return None
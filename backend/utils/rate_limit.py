@@ -0,0 +1,76 @@
+import os
+import time
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Dict
+
+# Requests per second (and burst) each upstream may receive from scheduled fan-out jobs;
+# override with RATE_LIMIT_<UPSTREAM> and RATE_LIMIT_<UPSTREAM>_BURST
+DEFAULT_RATE_LIMITS: Dict[str, Dict[str, float]] = {
+    "db": {"rate": 50.0, "burst": 50.0},
+    "gotrue": {"rate": 10.0, "burst": 10.0},
+    "gemini": {"rate": 2.0, "burst": 4.0},
+}
+
+# Set inside fan-out workers; interactive requests are never throttled
+fanout_active: ContextVar[bool] = ContextVar("fanout_active", default=False)
+
+
+class TokenBucket:
+    """Async token bucket; waiters queue on a lock so they are served in arrival order."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.stats = {"acquired": 0, "waited": 0, "wait_seconds": 0.0}
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                wait = (1 - self._tokens) / self.rate
+                self.stats["waited"] += 1
+                self.stats["wait_seconds"] += wait
+                await asyncio.sleep(wait)
+                self._refill()
+            self._tokens -= 1
+            self.stats["acquired"] += 1
+
+
+def _limit(upstream: str, name: str, default: float) -> float:
+    suffix = "" if name == "rate" else f"_{name.upper()}"
+    value = os.getenv(f"RATE_LIMIT_{upstream.upper()}{suffix}")
+    return float(value) if value is not None else default
+
+
+_buckets: Dict[str, TokenBucket] = {}
+
+
+def get_bucket(upstream: str) -> TokenBucket:
+    bucket = _buckets.get(upstream)
+    if bucket is None:
+        defaults = DEFAULT_RATE_LIMITS.get(upstream, {"rate": 10.0, "burst": 10.0})
+        bucket = TokenBucket(_limit(upstream, "rate", defaults["rate"]), _limit(upstream, "burst", defaults["burst"]))
+        _buckets[upstream] = bucket
+    return bucket
+
+
+async def throttle(upstream: str) -> None:
+    """Wait for a token for ``upstream`` when called from inside a fan-out job."""
+    if fanout_active.get():
+        await get_bucket(upstream).acquire()
+
+
+def rate_limit_stats() -> Dict[str, Dict[str, Any]]:
+    return {
+        upstream: {"rate": bucket.rate, "burst": bucket.burst, **bucket.stats, "wait_seconds": round(bucket.stats["wait_seconds"], 3)}
+        for upstream, bucket in _buckets.items()
+    }
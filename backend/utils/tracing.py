@@ -0,0 +1,149 @@
+import os
+import time
+import secrets
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional
+from utils.metrics import Histogram
+
+TRACE_HISTORY = int(os.getenv("TRACE_HISTORY", "200"))
+# Spans kept per trace; a streamed ingest adds spans per chunk, so later ones are only counted
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "100"))
+# Target for vital arrival -> emergency and both alerts written
+DETECTION_SLO_SECONDS = float(os.getenv("DETECTION_SLO_SECONDS", "5"))
+# Share of detections that must meet the SLO before /admin/traces reports it as violated
+DETECTION_SLO_TARGET = float(os.getenv("DETECTION_SLO_TARGET", "0.99"))
+
+
+class Span:
+    def __init__(self, name: str, trace: "Trace", parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_offset_ms": round((self.started_at - self.trace.root.started_at) * 1000, 3),
+            "duration_ms": round(self.duration_ms, 3) if self.duration_ms is not None else None,
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = secrets.token_hex(16)
+        self.root: Optional[Span] = None
+        self.spans: List[Span] = []
+        self.dropped_spans = 0
+
+    def add(self, span: Span) -> None:
+        if len(self.spans) < TRACE_MAX_SPANS:
+            self.spans.append(span)
+        else:
+            self.dropped_spans += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "started_at": self.root.started_at,
+            "duration_ms": round(self.root.duration_ms, 3) if self.root.duration_ms is not None else None,
+            "spans": [span.to_dict() for span in self.spans],
+            "dropped_spans": self.dropped_spans
+        }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """In-process span recorder for the vitals-to-emergency pipeline.
+
+    Spans nest through a context variable, so a span opened inside a request or task
+    becomes a child of whatever span is current there. Every finished span feeds the
+    latency histogram for its name, and finished traces are kept in a ring buffer of
+    TRACE_HISTORY entries. Work that continues in another task after the originating
+    trace has finished opens a new trace and lists the originating trace ids in a
+    ``links`` attribute.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Histogram] = {}
+        self.traces: Deque[Dict[str, Any]] = deque(maxlen=TRACE_HISTORY)
+        self.detection = Histogram()
+        self.slo = {"detections": 0, "within_slo": 0}
+
+    @contextmanager
+    def span(self, name: str, new_trace: bool = False, **attributes: Any) -> Iterator[Span]:
+        parent = None if new_trace else _current_span.get()
+        if parent is None:
+            trace = Trace()
+            span = Span(name, trace, None, attributes)
+            trace.root = span
+        else:
+            trace = parent.trace
+            span = Span(name, trace, parent.span_id, attributes)
+        trace.add(span)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.duration_ms = (time.perf_counter() - span._started) * 1000
+            self.stages.setdefault(name, Histogram()).observe(span.duration_ms)
+            if span is trace.root:
+                self.traces.appendleft(trace.to_dict())
+
+    def current_span(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def record_detection(self, arrived_at: float, email: str) -> float:
+        """Record vital arrival (epoch seconds) -> emergency created; returns the latency in seconds."""
+        latency = time.time() - arrived_at
+        self.detection.observe(latency * 1000)
+        self.slo["detections"] += 1
+        if latency <= DETECTION_SLO_SECONDS:
+            self.slo["within_slo"] += 1
+        else:
+            print(f"[TRACE] ⚠ Detection SLO missed for {email}: {latency:.2f}s > {DETECTION_SLO_SECONDS:g}s")
+        return latency
+
+    def slo_status(self) -> Dict[str, Any]:
+        detections = self.slo["detections"]
+        compliance = self.slo["within_slo"] / detections if detections else None
+        return {
+            "objective_seconds": DETECTION_SLO_SECONDS,
+            "target": DETECTION_SLO_TARGET,
+            **self.slo,
+            "compliance": round(compliance, 4) if compliance is not None else None,
+            "met": compliance is None or compliance >= DETECTION_SLO_TARGET,
+            "latency": self.detection.snapshot()
+        }
+
+    def export(self, limit: int = 50, name: Optional[str] = None) -> Dict[str, Any]:
+        traces = [t for t in self.traces if name is None or t["name"] == name][:limit]
+        return {
+            "slo": self.slo_status(),
+            "stages": {stage: histogram.snapshot() for stage, histogram in self.stages.items()},
+            "traces": traces
+        }
+
+
+tracer = Tracer()